@@ -0,0 +1,61 @@
+"""Benchmark: chunked blob transfer throughput by block size and concurrency
+
+Usage: python -m benchmarks.bench_blob_transfer [megabytes] [latency_ms]
+
+Runs against the filesystem-backed fake blob service, with latency_ms added
+to every service call to stand in for network round trips.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from etl.src.blob_manager import BlobManager
+from tests.unit.fake_blob_service import FakeBlobServiceClient
+
+_BLOCK_SIZES = [1 * 1024 * 1024, 4 * 1024 * 1024]
+_CONCURRENCY = [1, 2, 4, 8]
+
+
+def main(megabytes, latency_ms):
+    print(
+        "{:>10} {:>12} {:>12} {:>12}".format(
+            "block MiB", "concurrency", "upload MB/s", "download MB/s"
+        )
+    )
+    with tempfile.TemporaryDirectory() as work_dir:
+        store = os.path.join(work_dir, "store")
+        os.makedirs(store)
+        upload_file = os.path.join(work_dir, "payload.bin")
+        with open(upload_file, "wb") as f:
+            f.write(os.urandom(megabytes * 1024 * 1024))
+        download_file = os.path.join(work_dir, "download", "payload.bin")
+        os.makedirs(os.path.dirname(download_file))
+
+        for block_size in _BLOCK_SIZES:
+            for concurrency in _CONCURRENCY:
+                service = FakeBlobServiceClient(store, latency=latency_ms / 1000)
+                blob_manager = BlobManager(
+                    service, block_size=block_size, max_concurrency=concurrency
+                )
+                start = time.perf_counter()
+                blob_manager.upload_blob_file("fake", "bench", upload_file)
+                upload_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                blob_manager.download_blob_file("fake", "bench", download_file)
+                download_seconds = time.perf_counter() - start
+                print(
+                    "{:>10} {:>12} {:>12.1f} {:>12.1f}".format(
+                        block_size // (1024 * 1024),
+                        concurrency,
+                        megabytes / upload_seconds,
+                        megabytes / download_seconds,
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 64,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 20.0,
+    )
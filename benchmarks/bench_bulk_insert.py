@@ -0,0 +1,50 @@
+"""Benchmark: bulk insert throughput by batch size on the SQLite stand-in
+
+Usage: python -m benchmarks.bench_bulk_insert [rows]
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.sqlite_db_manager import SqliteDBManager
+
+_BATCH_SIZES = [1, 10, 100, 1000, 10000]
+
+
+def main(row_count):
+    print("{:>12} {:>10} {:>12}".format("mode", "batch", "rows/s"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_file = write_person_csv(os.path.join(work_dir, "person.csv"), row_count)
+        for use_executemany in (True, False):
+            for batch_size in _BATCH_SIZES:
+                db_manager = SqliteDBManager(os.path.join(work_dir, "bench.db"))
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+                    devnull
+                ):
+                    conn = db_manager.connect_to_db()
+                    cursor = conn.cursor()
+                    db_manager.create_table(cursor)
+                    start = time.perf_counter()
+                    rows = db_manager.bulk_insert_data(
+                        conn,
+                        cursor,
+                        input_file,
+                        batch_size=batch_size,
+                        use_executemany=use_executemany,
+                    )
+                    elapsed = time.perf_counter() - start
+                    conn.close()
+                print(
+                    "{:>12} {:>10} {:>12.0f}".format(
+                        "executemany" if use_executemany else "values",
+                        batch_size,
+                        rows / elapsed,
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
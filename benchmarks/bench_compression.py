@@ -0,0 +1,86 @@
+"""Benchmark: transfer compression, CPU cost versus bytes saved
+
+Usage: python -m benchmarks.bench_compression [rows]
+
+Compresses and decompresses a transformed person.csv shaped file with each
+codec and level in memory, one 8 MB block at a time as BlobManager uploads
+it. Compression overlaps the upload, so the estimated upload time over a
+link is max(compress seconds, compressed bytes / bandwidth).
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.compression_manager import CompressionManager
+from etl.src.data_mappings import ProjectionPlan
+from etl.src.transform_manager import TransformManager
+
+_BLOCK_SIZE = 8 * 1024 * 1024
+_CODECS = [(None, None), ("gzip", 1), ("gzip", 6), ("zstd", 1), ("zstd", 3), ("zstd", 9)]
+# Link speeds in Mbit/s
+_BANDWIDTHS = [100, 1000, 10000]
+
+
+def read_blocks(path):
+    with open(path, "rb") as f:
+        return list(iter(lambda: f.read(_BLOCK_SIZE), b""))
+
+
+def main(row_count):
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_file = write_person_csv(os.path.join(work_dir, "person.csv"), row_count)
+        output_file = os.path.join(work_dir, "person_transformed.csv")
+        TransformManager().transform_file(
+            source_file,
+            output_file,
+            ProjectionPlan(
+                ["Id", "DATE", "BODYSITE_CODE", "MODALITY_DESCRIPTION"],
+                ["personId", "personDOB", "BodySiteCode", "ModalityDescription"],
+            ),
+        )
+        blocks = read_blocks(output_file)
+    size = sum(len(block) for block in blocks)
+    print("{} rows, {:.1f} MB transformed csv".format(row_count, size / 1e6))
+    print(
+        "{:>8} {:>6} {:>8} {:>10} {:>10}".format(
+            "codec", "level", "ratio", "comp MB/s", "dec MB/s"
+        )
+        + "".join(" {:>9}".format("{}Mb s".format(b)) for b in _BANDWIDTHS)
+    )
+    for codec, level in _CODECS:
+        start = time.perf_counter()
+        compressed = list(CompressionManager(codec, level).compress(iter(blocks)))
+        compress_seconds = time.perf_counter() - start
+        compressed_size = sum(len(chunk) for chunk in compressed)
+
+        start = time.perf_counter()
+        for _ in CompressionManager.decompress(iter(compressed), codec):
+            pass
+        decompress_seconds = time.perf_counter() - start
+
+        upload_seconds = [
+            max(compress_seconds, compressed_size * 8 / (bandwidth * 1e6))
+            for bandwidth in _BANDWIDTHS
+        ]
+        if codec is None:
+            throughput = ("-", "-")
+        else:
+            throughput = (
+                "{:.0f}".format(size / 1e6 / compress_seconds),
+                "{:.0f}".format(size / 1e6 / decompress_seconds),
+            )
+        print(
+            "{:>8} {:>6} {:>8.1f} {:>10} {:>10}".format(
+                codec or "none",
+                level if level is not None else "-",
+                size / compressed_size,
+                *throughput
+            )
+            + "".join(" {:>9.2f}".format(seconds) for seconds in upload_seconds)
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
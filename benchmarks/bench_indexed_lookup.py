@@ -0,0 +1,90 @@
+"""Benchmark: lookup latency with and without the mapping's secondary index
+on the SQLite stand-in
+
+Usage: python -m benchmarks.bench_indexed_lookup [rows] [lookups]
+"""
+import contextlib
+import csv
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.etl_manager import EtlManager
+from etl.src.sqlite_db_manager import SqliteDBManager
+from etl.src.transform_manager import TransformManager
+
+
+def spread_codes(input_file, output_file, column, distinct_codes):
+    """Rewrite column with distinct_codes values, so lookups are selective"""
+    with open(input_file, newline="") as f_in, open(output_file, "w", newline="") as f_out:
+        reader = csv.reader(f_in)
+        writer = csv.writer(f_out)
+        header = next(reader)
+        writer.writerow(header)
+        index = header.index(column)
+        for i, row in enumerate(reader):
+            row[index] = str(i % distinct_codes)
+            writer.writerow(row)
+    return output_file
+
+
+def time_lookups(db_manager, cursor, query, values):
+    start = time.perf_counter()
+    for value in values:
+        for _ in db_manager.query_rows(cursor, query, (value,)):
+            pass
+    return (time.perf_counter() - start) / len(values)
+
+
+def main(row_count, lookups):
+    with tempfile.TemporaryDirectory() as work_dir, open(
+        os.devnull, "w"
+    ) as devnull, contextlib.redirect_stdout(devnull):
+        data_mappings = EtlManager().parse_mapping_file("./file_input/person_map.json")
+        column = data_mappings._indexes[0][0]
+        transformed_file = os.path.join(work_dir, "transformed.csv")
+        TransformManager().transform_file(
+            write_person_csv(os.path.join(work_dir, "person.csv"), row_count),
+            transformed_file,
+            data_mappings._projection_plan,
+        )
+        # About 20 rows per code
+        output_file = spread_codes(
+            transformed_file,
+            os.path.join(work_dir, "person_transformed.csv"),
+            column,
+            max(1, row_count // 20),
+        )
+        query = "SELECT * FROM {} WHERE {} = ?".format(data_mappings._table_name, column)
+        db_manager = SqliteDBManager(os.path.join(work_dir, "bench.db"))
+        conn = db_manager.connect_to_db()
+        cursor = conn.cursor()
+
+        indexes = data_mappings._indexes
+        data_mappings._indexes = []
+        db_manager.upsert_data(conn, cursor, data_mappings, output_file)
+        cursor.execute("SELECT DISTINCT {} FROM {}".format(column, data_mappings._table_name))
+        values = [row[0] for row in cursor.fetchall()]
+        values = [values[i % len(values)] for i in range(lookups)]
+        without_index = time_lookups(db_manager, cursor, query, values)
+
+        data_mappings._indexes = indexes
+        start = time.perf_counter()
+        db_manager.create_mapped_indexes(conn, cursor, data_mappings)
+        build_seconds = time.perf_counter() - start
+        with_index = time_lookups(db_manager, cursor, query, values)
+        conn.close()
+
+    print("rows={} lookups={} index build={:.3f}s".format(row_count, lookups, build_seconds))
+    print("{:>10} {:>14}".format("index", "ms/lookup"))
+    print("{:>10} {:>14.3f}".format("without", without_index * 1000))
+    print("{:>10} {:>14.3f}".format("with", with_index * 1000))
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50,
+    )
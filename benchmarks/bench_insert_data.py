@@ -0,0 +1,51 @@
+"""Benchmark: DBManager.insert_data load time versus row count
+
+Usage: python -m benchmarks.bench_insert_data [rows ...]
+
+Times the single-pass loader against a cursor that discards statements, so
+only csv reading and statement building are measured. Time per row should
+stay flat as the row count grows (linear total time).
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.db_manager import DBManager
+
+_DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+
+class NullCursor:
+    """Cursor that accepts and discards statements"""
+
+    def execute(self, statement, params=None):
+        pass
+
+
+def main(sizes):
+    db_manager = DBManager()
+    print("{:>12} {:>10} {:>12}".format("rows", "seconds", "us/row"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            input_file = write_person_csv(
+                os.path.join(work_dir, "person_{}.csv".format(size)), size
+            )
+            start = time.perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+                devnull
+            ):
+                rows = db_manager.insert_data(None, NullCursor(), input_file)
+            elapsed = time.perf_counter() - start
+            print(
+                "{:>12} {:>10.2f} {:>12.2f}".format(
+                    rows, elapsed, elapsed * 1_000_000 / max(rows, 1)
+                )
+            )
+            os.remove(input_file)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or _DEFAULT_SIZES)
@@ -0,0 +1,86 @@
+"""Benchmark: csv versus parquet output, write time and file size
+
+Usage: python -m benchmarks.bench_output_formats [rows]
+
+Transforms person.csv shaped data with the person_map.json mappings (DATE
+as datetime2, BODYSITE_CODE as Int64) to csv with the csv and pandas
+backends, and to parquet with typed columns, then times reading each output
+back into pandas.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pandas
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.data_mappings import ColumnMappings, ProjectionPlan
+from etl.src.transform_manager import TransformManager
+
+_COLUMNS = [
+    ("Id", "String", "String", "personId"),
+    ("DATE", "DateTime", "datetime2", "personDOB"),
+    ("BODYSITE_CODE", "Int64", "Int64", "BodySiteCode"),
+    ("MODALITY_DESCRIPTION", "String", "String", "ModalityDescription"),
+]
+
+
+def main(row_count):
+    column_mappings = [
+        ColumnMappings(source, column_type, physical, sink, column_type, physical)
+        for source, column_type, physical, sink in _COLUMNS
+    ]
+    plan = ProjectionPlan([c[0] for c in _COLUMNS], [c[3] for c in _COLUMNS])
+    transform_manager = TransformManager()
+    print(
+        "{:>14} {:>10} {:>10} {:>10}".format("output", "write s", "MB", "read s")
+    )
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_file = write_person_csv(os.path.join(work_dir, "person.csv"), row_count)
+        outputs = [
+            (
+                "csv",
+                "csv.csv",
+                lambda output: transform_manager.transform_file(
+                    source_file, output, plan
+                ),
+                pandas.read_csv,
+            ),
+            (
+                "csv (pandas)",
+                "pandas.csv",
+                lambda output: transform_manager.transform_file_pandas(
+                    source_file, output, column_mappings, plan
+                ),
+                pandas.read_csv,
+            ),
+            (
+                "parquet",
+                "out.parquet",
+                lambda output: transform_manager.transform_file_parquet(
+                    source_file, output, column_mappings, plan
+                ),
+                pandas.read_parquet,
+            ),
+        ]
+        for label, name, write, read in outputs:
+            output = os.path.join(work_dir, name)
+            start = time.perf_counter()
+            write(output)
+            write_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            read(output)
+            read_seconds = time.perf_counter() - start
+            print(
+                "{:>14} {:>10.2f} {:>10.1f} {:>10.2f}".format(
+                    label,
+                    write_seconds,
+                    os.path.getsize(output) / 1e6,
+                    read_seconds,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
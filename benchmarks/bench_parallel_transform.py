@@ -0,0 +1,47 @@
+"""Benchmark: byte-range parallel transform scaling by worker count
+
+Usage: python -m benchmarks.bench_parallel_transform [rows]
+"""
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.data_mappings import ProjectionPlan
+from etl.src.transform_manager import TransformManager
+
+_WORKERS = [1, 2, 4, 8]
+_SOURCE_COLUMNS = ["Id", "DATE", "BODYSITE_CODE", "MODALITY_DESCRIPTION"]
+_DESTINATION_COLUMNS = ["personId", "personDOB", "BodySiteCode", "ModalityDescription"]
+
+
+def main(row_count):
+    transform_manager = TransformManager()
+    plan = ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    print("cpus: {}".format(os.cpu_count()))
+    print("{:>8} {:>10} {:>8} {:>10}".format("workers", "seconds", "speedup", "identical"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_file = write_person_csv(os.path.join(work_dir, "person.csv"), row_count)
+        serial_output = os.path.join(work_dir, "serial.csv")
+        transform_manager.transform_file(source_file, serial_output, plan)
+        baseline = None
+        for workers in _WORKERS:
+            output = os.path.join(work_dir, "parallel.csv")
+            start = time.perf_counter()
+            transform_manager.transform_file_parallel(source_file, output, plan, workers)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(
+                "{:>8} {:>10.2f} {:>7.2f}x {:>10}".format(
+                    workers,
+                    elapsed,
+                    baseline / elapsed,
+                    str(filecmp.cmp(serial_output, output, shallow=False)),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
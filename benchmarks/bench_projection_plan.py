@@ -0,0 +1,67 @@
+"""Benchmark: compiled ProjectionPlan versus chained petl.cut + petl.rename
+
+Usage: python -m benchmarks.bench_projection_plan [rows]
+
+Projects a wide synthetic csv on 5, 50 and 500 mapped columns.
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+
+import petl
+
+from etl.src.data_mappings import ProjectionPlan
+
+_MAPPED_COLUMNS = [5, 50, 500]
+
+
+def write_wide_csv(output_file, columns, row_count):
+    with open(output_file, "w", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(["col{}".format(i) for i in range(columns)])
+        row = ["value{}".format(i) for i in range(columns)]
+        for _ in range(row_count):
+            writer.writerow(row)
+
+
+def run_chain(source_file, source_columns, destination_columns):
+    table = petl.cut(petl.fromcsv(source_file), *source_columns)
+    for source, destination in zip(source_columns, destination_columns):
+        table = petl.rename(table, source, destination)
+    for _ in table:
+        pass
+
+
+def run_plan(source_file, source_columns, destination_columns):
+    plan = ProjectionPlan(source_columns, destination_columns)
+    with open(source_file, newline="") as source:
+        reader = csv.reader(source)
+        for _ in plan.project(next(reader), reader):
+            pass
+
+
+def main(row_count):
+    print("{:>8} {:>12} {:>12} {:>8}".format("columns", "chain s", "plan s", "speedup"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for mapped in _MAPPED_COLUMNS:
+            source_file = os.path.join(work_dir, "wide_{}.csv".format(mapped))
+            write_wide_csv(source_file, mapped * 2, row_count)
+            # Every other column is mapped
+            source_columns = ["col{}".format(i * 2) for i in range(mapped)]
+            destination_columns = ["out{}".format(i) for i in range(mapped)]
+            timings = []
+            for run in (run_chain, run_plan):
+                start = time.perf_counter()
+                run(source_file, source_columns, destination_columns)
+                timings.append(time.perf_counter() - start)
+            print(
+                "{:>8} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+                    mapped, timings[0], timings[1], timings[0] / timings[1]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
@@ -0,0 +1,70 @@
+"""Benchmark: csv versus pandas transform backends on person.csv shaped data
+
+Usage: python -m benchmarks.bench_transform_backends [rows]
+
+Runs the person_map.json projection (4 of 13 columns) and a projection of
+all 13 columns, and checks both backends wrote identical bytes.
+"""
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.data_mappings import ColumnMappings, ProjectionPlan
+from etl.src.transform_manager import TransformManager
+
+_PERSON_MAP_COLUMNS = ["Id", "DATE", "BODYSITE_CODE", "MODALITY_DESCRIPTION"]
+
+
+def column_mappings_for(columns):
+    return [
+        ColumnMappings(
+            column,
+            "DateTime" if column == "DATE" else "String",
+            "datetime2" if column == "DATE" else "String",
+            column.lower(),
+            "DateTime" if column == "DATE" else "String",
+            "datetime2" if column == "DATE" else "String",
+        )
+        for column in columns
+    ]
+
+
+def main(row_count):
+    transform_manager = TransformManager()
+    print("{:>8} {:>10} {:>10} {:>8} {:>10}".format("columns", "csv s", "pandas s", "speedup", "identical"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_file = write_person_csv(os.path.join(work_dir, "person.csv"), row_count)
+        with open(source_file) as f:
+            all_columns = f.readline().strip().split(",")
+        for columns in (_PERSON_MAP_COLUMNS, all_columns):
+            column_mappings = column_mappings_for(columns)
+            plan = ProjectionPlan(columns, [c.lower() for c in columns])
+            csv_output = os.path.join(work_dir, "csv.csv")
+            pandas_output = os.path.join(work_dir, "pandas.csv")
+
+            start = time.perf_counter()
+            transform_manager.transform_file(source_file, csv_output, plan)
+            csv_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            transform_manager.transform_file_pandas(
+                source_file, pandas_output, column_mappings, plan
+            )
+            pandas_seconds = time.perf_counter() - start
+
+            print(
+                "{:>8} {:>10.2f} {:>10.2f} {:>7.2f}x {:>10}".format(
+                    len(columns),
+                    csv_seconds,
+                    pandas_seconds,
+                    csv_seconds / pandas_seconds,
+                    str(filecmp.cmp(csv_output, pandas_output, shallow=False)),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,59 @@
+"""Benchmark: peak RSS of the streaming transform versus input size
+
+Usage: python -m benchmarks.bench_transform_memory [rows ...]
+
+Each size runs in a fresh process so its peak RSS is measured on its own.
+Peak RSS should stay flat as the input grows.
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.transform_manager import TransformManager
+
+_DEFAULT_SIZES = [50, 100_000, 1_000_000, 5_000_000]
+_SOURCE_COLUMNS = ["Id", "DATE", "BODYSITE_CODE", "MODALITY_DESCRIPTION"]
+_DESTINATION_COLUMNS = ["personId", "personDOB", "BodySiteCode", "ModalityDescription"]
+
+
+def run_transform(source_file, destination_file, results):
+    start = time.perf_counter()
+    TransformManager().transform_file(
+        source_file, destination_file, _SOURCE_COLUMNS, _DESTINATION_COLUMNS
+    )
+    # ru_maxrss is reported in KiB on Linux
+    results.put(
+        (
+            time.perf_counter() - start,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        )
+    )
+
+
+def main(sizes):
+    print("{:>12} {:>12} {:>10} {:>12}".format("rows", "input MiB", "seconds", "peak MiB"))
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            source_file = write_person_csv(os.path.join(work_dir, "person.csv"), size)
+            results = context.Queue()
+            process = context.Process(
+                target=run_transform,
+                args=(source_file, os.path.join(work_dir, "out.csv"), results),
+            )
+            process.start()
+            elapsed, peak = results.get()
+            process.join()
+            print(
+                "{:>12} {:>12.1f} {:>10.2f} {:>12.1f}".format(
+                    size, os.path.getsize(source_file) / 2 ** 20, elapsed, peak
+                )
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or _DEFAULT_SIZES)
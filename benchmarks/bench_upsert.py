@@ -0,0 +1,54 @@
+"""Benchmark: full load against a 1% delta upsert on the SQLite stand-in
+
+Usage: python -m benchmarks.bench_upsert [rows]
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_data import write_person_csv
+from etl.src.etl_manager import EtlManager
+from etl.src.sqlite_db_manager import SqliteDBManager
+from etl.src.transform_manager import TransformManager
+
+
+def main(row_count):
+    with tempfile.TemporaryDirectory() as work_dir, open(
+        os.devnull, "w"
+    ) as devnull, contextlib.redirect_stdout(devnull):
+        data_mappings = EtlManager().parse_mapping_file("./file_input/person_map.json")
+        plan = data_mappings._projection_plan
+        transform_manager = TransformManager()
+        full_load = os.path.join(work_dir, "full.csv")
+        delta = os.path.join(work_dir, "delta.csv")
+        transform_manager.transform_file(
+            write_person_csv(os.path.join(work_dir, "person.csv"), row_count),
+            full_load,
+            plan,
+        )
+        # The first 1% of ids, so the delta updates existing rows
+        transform_manager.transform_file(
+            write_person_csv(os.path.join(work_dir, "person_delta.csv"), row_count // 100),
+            delta,
+            plan,
+        )
+
+        db_manager = SqliteDBManager(os.path.join(work_dir, "bench.db"))
+        conn = db_manager.connect_to_db()
+        cursor = conn.cursor()
+        timings = []
+        for input_file in (full_load, delta):
+            start = time.perf_counter()
+            rows = db_manager.upsert_data(conn, cursor, data_mappings, input_file)
+            timings.append((os.path.basename(input_file), rows, time.perf_counter() - start))
+        conn.close()
+
+    print("{:>10} {:>10} {:>10}".format("load", "rows", "seconds"))
+    for name, rows, elapsed in timings:
+        print("{:>10} {:>10} {:>10.3f}".format(name, rows, elapsed))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
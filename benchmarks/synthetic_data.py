@@ -0,0 +1,25 @@
+"""Synthetic person.csv style data for benchmarks"""
+import csv
+import itertools
+import os
+
+_TEMPLATE_FILE = "./file_input/person.csv"
+
+
+def write_person_csv(output_file: str, row_count: int) -> str:
+    """Write row_count rows shaped like person.csv, cycling its sample rows"""
+    with open(_TEMPLATE_FILE, newline="") as template:
+        reader = csv.reader(template)
+        header = next(reader)
+        sample_rows = list(reader)
+
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    with open(output_file, "w", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        for i, row in zip(range(row_count), itertools.cycle(sample_rows)):
+            # Unique Id per row so keyed loads see distinct records
+            row = list(row)
+            row[0] = "{:08x}-0000-4000-8000-{:012x}".format(i >> 48, i)
+            writer.writerow(row)
+    return output_file
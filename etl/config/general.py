@@ -25,14 +25,64 @@ _CONTAINER_NAME = "input"
 _STORAGE_ACCOUNT_NAME = "bonobostorage"
 _POOL_ID = "WindowsPool"
 _POOL_NODE_COUNT = 1
+_POOL_TASK_SLOTS_PER_NODE = 4
+_POOL_MAX_DEDICATED_NODES = 10
+_POOL_MAX_LOW_PRIORITY_NODES = 20
+_POOL_LOW_PRIORITY_RATIO = 0.5
+_POOL_TARGET_SECONDS = 15 * 60  # finish the pending tasks within
+_POOL_DEFAULT_TASK_SECONDS = 120  # until task durations are observed
+_POOL_TIMINGS_FILE = "./.pool_timings.json"
+_POOL_TIMINGS_KEPT = 200
+_POOL_AUTOSCALE = False
+_POOL_IDLE_MINUTES = 15  # nodes are kept warm this long after the last task
+_POOL_RESIZE_WAIT_SECONDS = 10 * 60  # for a resizing pool to become steady
+_POOL_RESIZE_POLL_SECONDS = 15
 _POOL_VM_SIZE = "STANDARD_A2_v2"
 _JOB_ID = "PerformTransforms" + "".join(
     random.choices(string.ascii_uppercase + string.digits, k=6)
 )
 _TASK_ID = "CDMInsert"
+_BATCH_TASKS_PER_REQUEST = 100  # add_collection limit
+_BATCH_ADD_RETRIES = 3
+_BATCH_ADD_BACKOFF_SECONDS = 1  # doubled after each retry
+_BATCH_POLL_MIN_SECONDS = 1
+_BATCH_POLL_MAX_SECONDS = 30
+_BATCH_STAGE_FILES = True  # inputs as resource files, outputs as output files
 _STANDARD_OUT_FILE_NAME = "stdout.txt"
 _STANDARD_ERR_FILE_NAME = "stderr.txt"
+_TASK_OUTPUT_DIR = "./task_output"
+_TASK_OUTPUT_WORKERS = 16
 _REGISTRY_USER_NAME = "registryetl"
 _REGISTRY_SERVER = "registryetl.azurecr.io"
 _DOCKER_IMAGE = "registryetl.azurecr.io/images/python-etl:latest"
 _DOCKER_IMAGE_ABBREV = "registryetl.azurecr.io/images/python-etl:latest"
+_BULK_INSERT_BATCH_SIZE = 500
+_BULK_INSERT_COMMIT_EVERY = 20
+_QUERY_FETCH_SIZE = 1000
+_DB_LOAD_PARTITIONS = 4
+_TRANSFORM_CHUNK_ROWS = 10000
+_TRANSFORM_MAX_CHUNK_BYTES = 16 * 1024 * 1024
+_PLAN_CACHE_DIR = "./.plan_cache"
+_CHECKPOINT_INTERVAL_SECONDS = 30
+_CHECKPOINT_CONTAINER = "checkpoints"
+_TRANSFORM_BACKEND = "csv"
+_OUTPUT_FORMAT = "csv"  # or "parquet"
+_PARQUET_ROW_GROUP_ROWS = 128 * 1024
+_PARQUET_COMPRESSION = "snappy"
+_CONTENT_TYPES = {".csv": "text/csv", ".parquet": "application/vnd.apache.parquet"}
+_MANIFEST_IO_WORKERS = 8
+_MANIFEST_TRANSFORM_WORKERS = None  # None uses every core
+_MANIFEST_CACHE_DIR = "./.manifest_cache"
+_MANIFEST_CACHE_CONTAINER = "manifest-cache"
+_MANIFEST_CACHE_MAX_ENTRIES = 10000
+_MANIFEST_CACHE_TTL_SECONDS = 7 * 24 * 3600
+_BLOB_BLOCK_SIZE = 8 * 1024 * 1024
+_BLOB_MAX_CONCURRENCY = 4
+_BLOB_MAX_RETRIES = 3
+_BLOB_SAS_EXPIRY_HOURS = 24
+_TRANSFER_COMPRESSION = None  # None, "gzip" or "zstd" for uploaded outputs
+_COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+_COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+_ADLS_FILE_SYSTEM = "transformations"
+_ADLS_CHUNK_SIZE = 8 * 1024 * 1024
+_ADLS_MAX_CONCURRENCY = 4
@@ -1,69 +1,153 @@
 """Main driver for application logic"""
 
-from azure.storage.filedatalake import DataLakeServiceClient
+from azure.storage.filedatalake import ContentSettings, DataLakeServiceClient
 
 
 import os
-
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from etl.config.general import (
+    _ADLS_CHUNK_SIZE,
+    _ADLS_FILE_SYSTEM,
+    _ADLS_MAX_CONCURRENCY,
+    _CONTENT_TYPES,
+    _TRANSFER_COMPRESSION,
+)
+from etl.src.compression_manager import CompressionManager
 from etl.config.secrets import _DATALAKE_CONNECTION_STRING
 
 
 class ADLS2Manager:
-    """class"""
+    """Upload files to ADLS Gen2 in chunks appended concurrently"""
 
-    def __init__(self):
+    def __init__(
+        self,
+        datalake_service_client=None,
+        chunk_size: int = _ADLS_CHUNK_SIZE,
+        max_concurrency: int = _ADLS_MAX_CONCURRENCY,
+        compression: str = _TRANSFER_COMPRESSION,
+    ):
         super().__init__()
-        self._datalake_service_client = None
-        pass
+        self._datalake_service_client = datalake_service_client
+        self._chunk_size = chunk_size
+        self._max_concurrency = max_concurrency
+        self._compression = CompressionManager(compression)
+        self._file_system_clients = {}
 
     def connect_adls_gen2(
         self,
     ):
 
         try:
-
-            self._datalake_service_client = (
-                DataLakeServiceClient.from_connection_string(
-                    _DATALAKE_CONNECTION_STRING
+            # Keep the client for the lifetime of the manager
+            if self._datalake_service_client is None:
+                self._datalake_service_client = (
+                    DataLakeServiceClient.from_connection_string(
+                        _DATALAKE_CONNECTION_STRING
+                    )
                 )
-            )
 
         except Exception as e:
             print(e)
 
-    def upload_file(self, file_name: str):
-        try:
-
-            filesystem = "transformations"
-            service_client = (
-                self._datalake_service_client
-            ) = DataLakeServiceClient.from_connection_string(
-                _DATALAKE_CONNECTION_STRING
+    def get_file_system_client(self, filesystem: str = _ADLS_FILE_SYSTEM):
+        """File system client, creating the file system on first use"""
+        file_system_client = self._file_system_clients.get(filesystem)
+        if file_system_client is None:
+            if self._datalake_service_client is None:
+                self.connect_adls_gen2()
+            file_system_client = self._datalake_service_client.get_file_system_client(
+                filesystem
             )
-
-            # create the file system if it does not exist
-            file_system_client = service_client.get_file_system_client(filesystem)
-            # print("the file system exists: " + str(file_system_client.exists()))
-
             if not file_system_client.exists():
                 file_system_client.create_file_system()
-                # print("the file system is created.")
-            # else:
-            # print("the file system exists: " + str(file_system_client.exists()))
-
-            data = None
-            with open(file_name, "r") as text_file:
-                data = text_file.read()
-            file_client = file_system_client.get_file_client(
-                os.path.basename(file_name)
-            )
-            file_client.create_file()
+            self._file_system_clients[filesystem] = file_system_client
+        return file_system_client
 
-            file_client.append_data(data, offset=0, length=len(data))
-            file_client.flush_data(len(data))
+    def file_exists(self, file_name: str) -> bool:
+        """Whether file_name is in the transformations file system"""
+        return self.get_file_system_client().get_file_client(file_name).exists()
+
+    def upload_file(self, file_name: str, raise_errors: bool = False):
+        """Upload file_name, printing failures or raising them with
+        raise_errors"""
+        try:
+            with open(file_name, "rb") as data:
+                self.upload_stream(
+                    os.path.basename(file_name),
+                    iter(lambda: data.read(self._chunk_size), b""),
+                )
 
         except Exception as e:
             print(e)
+            if raise_errors:
+                raise
+
+    def rechunk(self, chunks):
+        """Regroup an iterable of byte strings into chunks of chunk_size"""
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= self._chunk_size:
+                yield bytes(buffer[: self._chunk_size])
+                del buffer[: self._chunk_size]
+        if buffer:
+            yield bytes(buffer)
+
+    def upload_stream(self, file_name: str, chunks) -> int:
+        """Upload an iterable of byte strings to file_name in the
+        transformations file system as it is produced, without a local file.
+        With a compression the content is compressed on the way and the
+        codec's extension added to file_name.
+
+        Chunks are appended at their running offsets with up to
+        max_concurrency appends in flight, then committed with a single
+        flush_data. Memory is bounded to a few chunks per worker.
+        Returns the number of bytes uploaded.
+        """
+        file_name, chunks = self.compress_upload(file_name, chunks)
+        file_client = self.get_file_system_client().get_file_client(file_name)
+        file_client.create_file(metadata=self.metadata(file_name))
+
+        offset = 0
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+            in_flight = set()
+            for chunk in self.rechunk(chunks):
+                if len(in_flight) >= self._max_concurrency * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(
+                    executor.submit(
+                        file_client.append_data, chunk, offset=offset, length=len(chunk)
+                    )
+                )
+                offset += len(chunk)
+            for future in in_flight:
+                future.result()
+        file_client.flush_data(offset, content_settings=self.content_settings(file_name))
+        return offset
+
+    def compress_upload(self, file_name: str, chunks):
+        """(file name, chunks) to upload an iterable of byte strings named
+        file_name as, compressed when the manager has a compression"""
+        compressed_name = self._compression.compressed_name(file_name)
+        if compressed_name != file_name:
+            chunks = self._compression.compress(chunks)
+        return compressed_name, chunks
+
+    def metadata(self, file_name: str):
+        """Metadata recording the codec of file_name, or None"""
+        return self._compression.metadata(file_name)
+
+    def content_settings(self, file_name: str):
+        """Content type for file_name from its extension, or None"""
+        content_type = _CONTENT_TYPES.get(
+            os.path.splitext(CompressionManager.strip_extension(file_name))[1].lower()
+        )
+        if content_type is None:
+            return None
+        return ContentSettings(content_type=content_type)
 
 
 if __name__ == "__main__":
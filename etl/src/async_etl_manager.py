@@ -0,0 +1,228 @@
+"""AsyncEtlManager: EtlManager with concurrent I/O stages on asyncio"""
+from __future__ import print_function
+import asyncio
+import contextlib
+import datetime
+import os
+import sys
+import time
+
+import aiohttp
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import BlobServiceClient
+from azure.storage.filedatalake.aio import DataLakeServiceClient
+
+from etl.config.general import (
+    _ADLS_CHUNK_SIZE,
+    _ADLS_FILE_SYSTEM,
+    _ADLS_MAX_CONCURRENCY,
+    _BLOB_BLOCK_SIZE,
+    _BLOB_MAX_CONCURRENCY,
+    _CONTAINER_NAME,
+)
+from etl.config.secrets import (
+    _DATALAKE_CONNECTION_STRING,
+    _STORAGE_CONNECTION_STRING,
+)
+from etl.src.adls2_manager import ADLS2Manager
+from etl.src.compression_manager import CompressionManager
+from etl.src.etl_manager import EtlManager
+
+
+class AsyncEtlManager(EtlManager):
+    """Run a job with both downloads concurrent and both uploads concurrent.
+
+    All transfers share one event loop and one aiohttp connection pool, so
+    a job takes about as long as its longest transfer plus the transform,
+    instead of the sum of all transfers. Blob names, compression, content
+    settings and the manifest cache are those of the synchronous managers.
+    """
+
+    def __init__(self, blob_service_client=None, datalake_service_client=None):
+        super().__init__()
+        # Injected aio clients (e.g. local fakes) are used as they are
+        self._async_blob_service_client = blob_service_client
+        self._async_datalake_service_client = datalake_service_client
+        # Names and settings of ADLS uploads, it connects only if used itself
+        self._adls2_manager = ADLS2Manager()
+
+    @contextlib.asynccontextmanager
+    async def open_clients(self):
+        """Open the aio clients on one shared aiohttp session"""
+        if self._async_blob_service_client is not None:
+            yield self._async_blob_service_client, self._async_datalake_service_client
+            return
+        async with aiohttp.ClientSession() as session:
+            transport_options = {
+                "transport": AioHttpTransport(session=session, session_owner=False)
+            }
+            blob_service_client = BlobServiceClient.from_connection_string(
+                _STORAGE_CONNECTION_STRING, **transport_options
+            )
+            datalake_service_client = DataLakeServiceClient.from_connection_string(
+                _DATALAKE_CONNECTION_STRING, **transport_options
+            )
+            async with blob_service_client, datalake_service_client:
+                yield blob_service_client, datalake_service_client
+
+    async def download_blob_file_async(
+        self, blob_service_client, container_name: str, download_file: str
+    ) -> str:
+        """Download download_file from blob container"""
+        blob_name = os.path.basename(download_file)
+        blob_client = blob_service_client.get_blob_client(container_name, blob_name)
+        print(
+            "[{}]:[INFO] : Downloading {} ...".format(
+                datetime.datetime.utcnow(), blob_name
+            )
+        )
+        try:
+            downloader = await blob_client.download_blob(
+                max_concurrency=_BLOB_MAX_CONCURRENCY
+            )
+        except ResourceNotFoundError:
+            raise RuntimeError(
+                "Unable to download {} from container {}".format(
+                    blob_name, container_name
+                )
+            )
+        # Compressed content is kept compressed, as download_blob_file does
+        codec = CompressionManager.codec_for(
+            blob_name, downloader.properties.metadata
+        )
+        if codec is not None:
+            download_file = CompressionManager(codec).compressed_name(download_file)
+        with open(download_file, "wb") as f:
+            async for chunk in downloader.chunks():
+                f.write(chunk)
+        return download_file
+
+    async def upload_blob_file_async(
+        self, blob_service_client, container_name: str, upload_file: str
+    ):
+        """Upload upload_file to blob container, named, compressed and with
+        the settings BlobManager.upload_blob_file gives it"""
+        container_client = blob_service_client.get_container_client(container_name)
+        try:
+            await container_client.create_container()
+        except ResourceExistsError:
+            pass
+        file_name = os.path.basename(upload_file)
+        with open(upload_file, "rb") as data:
+            blob_name, chunks = self._blob_manager.compress_upload(
+                file_name, iter(lambda: data.read(_BLOB_BLOCK_SIZE), b"")
+            )
+            await container_client.upload_blob(
+                name=blob_name,
+                # An uncompressed file has a known length to split into blocks
+                data=data if blob_name == file_name else chunks,
+                overwrite=True,
+                max_concurrency=_BLOB_MAX_CONCURRENCY,
+                **self._blob_manager.blob_settings(blob_name)
+            )
+
+    async def upload_adls_file_async(self, datalake_service_client, upload_file: str):
+        """Upload upload_file to ADLS Gen2 with concurrent chunked appends,
+        named, compressed and with the settings ADLS2Manager.upload_file
+        gives it"""
+        file_system_client = datalake_service_client.get_file_system_client(
+            _ADLS_FILE_SYSTEM
+        )
+        try:
+            await file_system_client.create_file_system()
+        except ResourceExistsError:
+            pass
+        adls2_manager = self._adls2_manager
+
+        slots = asyncio.Semaphore(_ADLS_MAX_CONCURRENCY)
+
+        async def append(chunk, offset):
+            try:
+                await file_client.append_data(chunk, offset=offset, length=len(chunk))
+            finally:
+                slots.release()
+
+        appends = []
+        offset = 0
+        with open(upload_file, "rb") as data:
+            file_name, chunks = adls2_manager.compress_upload(
+                os.path.basename(upload_file),
+                iter(lambda: data.read(_ADLS_CHUNK_SIZE), b""),
+            )
+            file_client = file_system_client.get_file_client(file_name)
+            await file_client.create_file(metadata=adls2_manager.metadata(file_name))
+            for chunk in adls2_manager.rechunk(chunks):
+                # Bounds the chunks held in memory as well as in flight
+                await slots.acquire()
+                appends.append(asyncio.ensure_future(append(chunk, offset)))
+                offset += len(chunk)
+        await asyncio.gather(*appends)
+        await file_client.flush_data(
+            offset, content_settings=adls2_manager.content_settings(file_name)
+        )
+
+    async def run_job_async(self, data_file: str, mapping_file: str) -> dict:
+        """Download, transform and upload one data file"""
+        result = {"data_file": data_file, "mapping_file": mapping_file}
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            # Unchanged inputs were already transformed and uploaded
+            key, cached = await loop.run_in_executor(
+                None, self.cached_result, data_file, mapping_file
+            )
+            if cached is not None:
+                result.update(cached, status="cached")
+                result["seconds"] = round(time.perf_counter() - start, 3)
+                return result
+            async with self.open_clients() as (blob_client, datalake_client):
+                input_file, mapping_file = await asyncio.gather(
+                    self.download_blob_file_async(
+                        blob_client,
+                        _CONTAINER_NAME,
+                        ".//file_input//{}".format(data_file),
+                    ),
+                    self.download_blob_file_async(
+                        blob_client,
+                        _CONTAINER_NAME,
+                        ".//file_input//{}".format(mapping_file),
+                    ),
+                )
+                # The transform is CPU bound, keep it off the event loop
+                output_file, rows = await loop.run_in_executor(
+                    None, self.transform_file, input_file, mapping_file
+                )
+                await asyncio.gather(
+                    self.upload_blob_file_async(blob_client, "output", output_file),
+                    self.upload_adls_file_async(datalake_client, output_file),
+                )
+            print("[{}]:[INFO] : Transformed file uploaded... ".format(output_file))
+            self.record_result(
+                key, output_file, rows, self._blob_manager.blob_name(output_file)
+            )
+            result.update(status="success", output_file=output_file, rows=rows)
+        except Exception as ex:
+            print(ex)
+            result.update(status="failed", error=str(ex))
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def run_job(
+        self, data_file: str, mapping_file: str, inputs_local: bool = False
+    ) -> dict:
+        """EtlManager.run_job with the transfers run concurrently. Staged
+        inputs_local jobs have no transfers and run as EtlManager does."""
+        if inputs_local:
+            return super().run_job(data_file, mapping_file, inputs_local)
+        return asyncio.run(self.run_job_async(data_file, mapping_file))
+
+
+if __name__ == "__main__":
+    """
+    async_etl_manager.py <data_file> <mapping_file>
+    """
+    async_etl_manager = AsyncEtlManager()
+    async_etl_manager.print_results(
+        [async_etl_manager.run_job(sys.argv[1], sys.argv[2])]
+    )
@@ -2,8 +2,11 @@
 from __future__ import print_function
 import datetime
 import io
+import json
+import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 import azure.batch._batch_service_client as batch
@@ -11,9 +14,19 @@ import azure.batch.batch_auth as batch_auth
 import azure.batch.models as batchmodels
 
 from etl.config.general import (
+    _ADLS_FILE_SYSTEM,
     _BATCH_ACCOUNT_NAME,
     _BATCH_ACCOUNT_URL,
+    _BATCH_ADD_BACKOFF_SECONDS,
+    _BATCH_ADD_RETRIES,
+    _BATCH_POLL_MAX_SECONDS,
+    _BATCH_POLL_MIN_SECONDS,
+    _BATCH_STAGE_FILES,
+    _BATCH_TASKS_PER_REQUEST,
+    _CONTAINER_NAME,
+    _CONTENT_TYPES,
     _JOB_ID,
+    _MANIFEST_IO_WORKERS,
     _REGISTRY_SERVER,
     _REGISTRY_USER_NAME,
     _DOCKER_IMAGE_ABBREV,
@@ -21,15 +34,27 @@ from etl.config.general import (
     _POOL_ID,
     _POOL_VM_SIZE,
     _POOL_NODE_COUNT,
+    _POOL_AUTOSCALE,
+    _POOL_TASK_SLOTS_PER_NODE,
     _STANDARD_OUT_FILE_NAME,
-    _STANDARD_ERR_FILE_NAME, 
+    _STANDARD_ERR_FILE_NAME,
+    _TASK_OUTPUT_DIR,
+    _TASK_OUTPUT_WORKERS,
     _TASK_ID
 )
+from etl.src.blob_manager import BlobManager
+from etl.src.etl_manager import EtlManager
+from etl.src.pool_manager import PoolManager
 from etl.config.secrets import (
     _BATCH_ACCOUNT_KEY,
-    _REGISTRY_PASSWORD
+    _DATALAKE_CONNECTION_STRING,
+    _REGISTRY_PASSWORD,
+    _STORAGE_CONNECTION_STRING,
 )
 
+# Margin subtracted from the last task listing time when listing newly
+# completed tasks
+_CLOCK_SKEW = datetime.timedelta(minutes=1)
 
 
 class AzureBatchManager:  # pylint: disable=too-few-public-methods
@@ -37,6 +62,10 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
 
     def __init__(self):
         super().__init__()
+        # Set by stage_files: tasks get their inputs as resource files and
+        # their outputs uploaded as output files
+        self._input_container_url = None
+        self._output_container_urls = []
 
     def print_start_time(self):
         start_time = datetime.datetime.now().replace(microsecond=0)
@@ -86,13 +115,23 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
                     print("{}:\t{}".format(mesg.key, mesg.value))
         print("-------------------------------------------")
 
-    def create_pool(self, batch_service_client, pool_id):
+    def create_pool(
+        self,
+        batch_service_client,
+        pool_id,
+        target_nodes=(_POOL_NODE_COUNT, 0),
+        auto_scale_formula=None,
+    ):
         """
         Creates a pool of compute nodes with the specified OS settings.
 
         :param batch_service_client: A Batch service client.
         :type batch_service_client: `azure.batch.BatchServiceClient`
         :param str pool_id: An ID for the new pool.
+        :param tuple target_nodes: The dedicated and low-priority node counts.
+        :param str auto_scale_formula: Size the pool with this formula instead
+        of target_nodes.
+        :return: Whether the pool was created, False if it already existed.
         :param str publisher: Marketplace image publisher
         :param str offer: Marketplace image offer
         :param str sku: Marketplace image sku
@@ -137,12 +176,53 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
                 node_agent_sku_id="batch.node.windows amd64",
             ),
             vm_size=_POOL_VM_SIZE,
-            target_dedicated_nodes=_POOL_NODE_COUNT,
+            # Run several ETL containers per node, spread across the nodes
+            task_slots_per_node=_POOL_TASK_SLOTS_PER_NODE,
+            task_scheduling_policy=batchmodels.TaskSchedulingPolicy(
+                node_fill_type=batchmodels.ComputeNodeFillType.spread
+            ),
         )
+        if auto_scale_formula is None:
+            new_pool.target_dedicated_nodes = target_nodes[0]
+            new_pool.target_low_priority_nodes = target_nodes[1]
+        else:
+            new_pool.enable_auto_scale = True
+            new_pool.auto_scale_formula = auto_scale_formula
+            new_pool.auto_scale_evaluation_interval = datetime.timedelta(minutes=5)
+
         # Test Pool Exists
         response = batch_service_client.pool.exists(pool_id)
         if not response:
             batch_service_client.pool.add(new_pool)
+        return not response
+
+    def size_pool(
+        self,
+        batch_service_client,
+        pool_id,
+        pending_tasks,
+        pool_manager,
+        autoscale=_POOL_AUTOSCALE,
+    ):
+        """
+        Creates the pool sized for pending_tasks, or resizes the existing warm
+        pool, by node targets or by autoscale formula.
+
+        :param batch_service_client: A Batch service client.
+        :type batch_service_client: `azure.batch.BatchServiceClient`
+        :param str pool_id: The ID of the pool.
+        :param int pending_tasks: The number of tasks about to be added.
+        :param pool_manager: The PoolManager computing the size.
+        :param bool autoscale: Apply an autoscale formula instead of targets.
+        """
+        created = self.create_pool(
+            batch_service_client,
+            pool_id,
+            target_nodes=pool_manager.target_nodes(pending_tasks),
+            auto_scale_formula=pool_manager.autoscale_formula() if autoscale else None,
+        )
+        if not created:
+            pool_manager.apply(batch_service_client, pool_id, pending_tasks, autoscale)
 
     def create_job(self, batch_service_client, job_id, pool_id):
         """
@@ -161,21 +241,37 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
 
         batch_service_client.job.add(job)
 
-    def add_tasks(self, batch_service_client, job_id, data_file, mapping_file):
+    def stage_files(self, input_container_url, output_container_urls):
         """
-        Adds a task for each input file in the collection to the specified job.
-
-        :param batch_service_client: A Batch service client.
-        :type batch_service_client: `azure.batch.BatchServiceClient`
-        :param str job_id: The ID of the job to which to add the tasks.
-        :param list input_files: A collection of input files. One task will be
-         created for each input file.
-        :param output_container_sas_token: A SAS token granting write access to
-        the specified Azure Blob storage container.
+        Makes tasks built from now on declare their data and mapping blobs as
+        resource files, which the node agent downloads in parallel before the
+        task starts, and their transformed files as output files, uploaded
+        when the task succeeds. The tasks run etl_manager.py --local.
+
+        :param str input_container_url: SAS URL of the input container, with
+        read permission.
+        :param list output_container_urls: SAS URLs of the containers to
+        upload outputs to, with write permission.
         """
+        self._input_container_url = input_container_url
+        self._output_container_urls = list(output_container_urls)
 
-        print("Adding {} tasks to job #[{}]...".format("Python ETL Job", job_id))
+    def blob_url(self, container_url, blob_name):
+        """The URL of blob_name within a container SAS URL"""
+        container, _, sas_token = container_url.partition("?")
+        return "{}/{}?{}".format(container, blob_name, sas_token)
 
+    def build_task(self, task_id, command_args, input_files=()):
+        """
+        Builds a containerized ETL task running etl_manager.py.
+
+        :param str task_id: The unique ID of the task within its job.
+        :param list command_args: The etl_manager.py arguments.
+        :param tuple input_files: The blobs the task reads, staged as
+        resource files after stage_files.
+        :return: The task to add.
+        :rtype: `azure.batch.models.TaskAddParameter`
+        """
         # This is the user who run the command inside the container.
         # An unprivileged one
         user = batchmodels.AutoUserSpecification(
@@ -189,25 +285,181 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
             image_name=_DOCKER_IMAGE,
         )
 
-        task = batchmodels.TaskAddParameter(
-            id=_TASK_ID,
-            command_line="python  etl\src\etl_manager.py {} {}".format(data_file, mapping_file),
+        resource_files = None
+        output_files = None
+        if self._input_container_url is not None:
+            command_args = ["--local"] + list(command_args)
+            # Paths are relative to the task working directory
+            resource_files = [
+                batchmodels.ResourceFile(
+                    http_url=self.blob_url(self._input_container_url, name),
+                    file_path="file_input/{}".format(name),
+                )
+                for name in input_files
+            ]
+            upload_options = batchmodels.OutputFileUploadOptions(
+                upload_condition=batchmodels.OutputFileUploadCondition.task_success
+            )
+            # One pattern per output format, csv or parquet
+            output_files = [
+                batchmodels.OutputFile(
+                    file_pattern="file_output/*{}".format(extension),
+                    destination=batchmodels.OutputFileDestination(
+                        container=batchmodels.OutputFileBlobContainerDestination(
+                            container_url=container_url
+                        )
+                    ),
+                    upload_options=upload_options,
+                )
+                for container_url in self._output_container_urls
+                for extension in sorted(_CONTENT_TYPES)
+            ]
+
+        return batchmodels.TaskAddParameter(
+            id=task_id,
+            command_line="python  etl\\src\\etl_manager.py {}".format(
+                " ".join(command_args)
+            ),
             container_settings=task_container_settings,
             user_identity=batchmodels.UserIdentity(auto_user=user),
+            required_slots=1,
+            resource_files=resource_files,
+            output_files=output_files,
         )
 
-        batch_service_client.task.add(job_id, task)
+    def build_file_tasks(self, pairs):
+        """
+        Builds one task per (data_file, mapping_file) pair.
+
+        :param list pairs: The (data_file, mapping_file) pairs to process.
+        """
+        return [
+            self.build_task(
+                "{}-{:05d}".format(_TASK_ID, index),
+                [data_file, mapping_file],
+                (data_file, mapping_file),
+            )
+            for index, (data_file, mapping_file) in enumerate(pairs)
+        ]
+
+    def build_shard_tasks(self, data_file, mapping_file, shards):
+        """
+        Builds shards tasks, each transforming one byte range of data_file.
+        Only the mapping file is staged, each task reads its own range of the
+        data blob.
+
+        :param str data_file: The data file to split.
+        :param str mapping_file: The mapping file.
+        :param int shards: The number of tasks to split data_file across.
+        """
+        return [
+            self.build_task(
+                "{}-{:05d}".format(_TASK_ID, shard),
+                ["--shard", str(shard), str(shards), data_file, mapping_file],
+                (mapping_file,),
+            )
+            for shard in range(shards)
+        ]
+
+    def build_job_tasks(self, data_file, mapping_file, shards=1):
+        """
+        Builds the tasks for one data file: a single task, or one task per
+        byte-range shard when shards is more than 1.
+        """
+        if shards > 1:
+            return self.build_shard_tasks(data_file, mapping_file, shards)
+        return self.build_file_tasks([(data_file, mapping_file)])
+
+    def add_task_collection(self, batch_service_client, job_id, tasks):
+        """
+        Adds tasks to the specified job with the bulk add_collection API, at
+        most _BATCH_TASKS_PER_REQUEST per request. Tasks rejected with a
+        server error are submitted again after a backoff, starting at
+        _BATCH_ADD_BACKOFF_SECONDS and doubling with each retry.
+
+        :param batch_service_client: A Batch service client.
+        :type batch_service_client: `azure.batch.BatchServiceClient`
+        :param str job_id: The ID of the job to which to add the tasks.
+        :param list tasks: The tasks to add.
+        :return: The number of tasks added.
+        """
+        for start in range(0, len(tasks), _BATCH_TASKS_PER_REQUEST):
+            pending = tasks[start : start + _BATCH_TASKS_PER_REQUEST]
+            for attempt in range(_BATCH_ADD_RETRIES):
+                if attempt:
+                    time.sleep(_BATCH_ADD_BACKOFF_SECONDS * 2 ** (attempt - 1))
+                by_id = {task.id: task for task in pending}
+                results = batch_service_client.task.add_collection(job_id, pending)
+                pending = []
+                for result in results.value:
+                    if result.status == batchmodels.TaskAddStatus.success:
+                        continue
+                    code = result.error.code if result.error else None
+                    if result.status == batchmodels.TaskAddStatus.server_error:
+                        pending.append(by_id[result.task_id])
+                    elif not (attempt and code == "TaskExists"):
+                        # TaskExists on a retry: an earlier attempt added it
+                        raise RuntimeError(
+                            "Task {} was rejected: {}".format(result.task_id, code)
+                        )
+                if not pending:
+                    break
+            if pending:
+                raise RuntimeError(
+                    "Unable to add tasks {}".format(", ".join(t.id for t in pending))
+                )
+        return len(tasks)
+
+    def add_tasks(self, batch_service_client, job_id, data_file, mapping_file, shards=1):
+        """
+        Adds the tasks for one data file to the specified job: a single task,
+        or one task per byte-range shard when shards is more than 1.
+
+        :param batch_service_client: A Batch service client.
+        :type batch_service_client: `azure.batch.BatchServiceClient`
+        :param str job_id: The ID of the job to which to add the tasks.
+        :param str data_file: The data file to transform.
+        :param str mapping_file: The mapping file.
+        :param int shards: The number of tasks to split data_file across.
+        """
+        tasks = self.build_job_tasks(data_file, mapping_file, shards)
+        print("Adding {} tasks to job #[{}]...".format(len(tasks), job_id))
+        return self.add_task_collection(batch_service_client, job_id, tasks)
+
+    def add_manifest_tasks(self, batch_service_client, job_id, pairs):
+        """
+        Adds one task per (data_file, mapping_file) pair to the specified job.
+
+        :param batch_service_client: A Batch service client.
+        :type batch_service_client: `azure.batch.BatchServiceClient`
+        :param str job_id: The ID of the job to which to add the tasks.
+        :param list pairs: The (data_file, mapping_file) pairs to process.
+        """
+        tasks = self.build_file_tasks(pairs)
+        print("Adding {} tasks to job #[{}]...".format(len(tasks), job_id))
+        return self.add_task_collection(batch_service_client, job_id, tasks)
 
-    def wait_for_tasks_to_complete(self, batch_service_client, job_id, timeout):
+    def wait_for_tasks_to_complete(
+        self, batch_service_client, job_id, timeout, on_task_completed=None
+    ):
         """
         Returns when all tasks in the specified job reach the Completed state.
 
+        Progress is polled with the job's task counts, one small request
+        however many tasks there are. The poll interval doubles from
+        _BATCH_POLL_MIN_SECONDS up to _BATCH_POLL_MAX_SECONDS while nothing
+        changes, and drops back when tasks complete.
+
         :param batch_service_client: A Batch service client.
         :type batch_service_client: `azure.batch.BatchServiceClient`
         :param str job_id: The id of the job whose tasks should be to monitored.
         :param timedelta timeout: The duration to wait for task completion. If all
         tasks in the specified job do not reach Completed state within this time
         period, an exception will be raised.
+        :param on_task_completed: Called with each task as it completes, with
+        its id and execution info, so later steps can start on finished
+        shards while others still run. Each listing asks only for the tasks
+        that completed since the previous one.
         """
         timeout_expiration = datetime.datetime.now() + timeout
 
@@ -218,19 +470,46 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
             end="",
         )
 
+        interval = _BATCH_POLL_MIN_SECONDS
+        completed = 0
+        reported = set()
+        listed_at = None
         while datetime.datetime.now() < timeout_expiration:
             print(".", end="")
             sys.stdout.flush()
-            tasks = batch_service_client.task.list(job_id)
-
-            incomplete_tasks = [
-                task for task in tasks if task.state != batchmodels.TaskState.completed
-            ]
-            if not incomplete_tasks:
+            counts = batch_service_client.job.get_task_counts(job_id).task_counts
+
+            if counts.completed != completed:
+                completed = counts.completed
+                interval = _BATCH_POLL_MIN_SECONDS
+                if on_task_completed is not None:
+                    task_filter = "state eq 'completed'"
+                    if listed_at is not None:
+                        # Overlap the previous listing to allow for clock skew,
+                        # tasks seen twice are reported once
+                        since = listed_at - _CLOCK_SKEW
+                        task_filter += (
+                            " and stateTransitionTime ge datetime'{}'".format(
+                                since.strftime("%Y-%m-%dT%H:%M:%SZ")
+                            )
+                        )
+                    listed_at = datetime.datetime.now(datetime.timezone.utc)
+                    for task in self.list_tasks(
+                        batch_service_client, job_id, task_filter, "id,executionInfo"
+                    ):
+                        if task.id not in reported:
+                            reported.add(task.id)
+                            on_task_completed(task)
+
+            # Task counts can lag behind task states, confirm with a filtered
+            # list before returning
+            if not counts.active and not counts.running and not self.list_tasks(
+                batch_service_client, job_id, "state ne 'completed'", "id"
+            ):
                 print()
                 return True
-            else:
-                time.sleep(1)
+            time.sleep(interval)
+            interval = min(interval * 2, _BATCH_POLL_MAX_SECONDS)
 
         print()
         raise RuntimeError(
@@ -238,39 +517,134 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
             "timeout period of " + str(timeout)
         )
 
-    def print_task_output(self, batch_service_client, job_id, encoding=None):
-        """Prints the stdout.txt file for each task in the job.
+    def list_tasks(self, batch_service_client, job_id, task_filter, select):
+        """
+        Lists the tasks of the specified job matching an OData filter, with
+        only the selected properties returned.
+
+        :param batch_service_client: A Batch service client.
+        :type batch_service_client: `azure.batch.BatchServiceClient`
+        :param str job_id: The id of the job.
+        :param str task_filter: The $filter clause, e.g. "state eq 'completed'",
+        or None for every task.
+        :param str select: The $select clause, e.g. "id,executionInfo".
+        """
+        return list(
+            batch_service_client.task.list(
+                job_id,
+                task_list_options=batchmodels.TaskListOptions(
+                    filter=task_filter, select=select
+                ),
+            )
+        )
+
+    def print_task_output(
+        self, batch_service_client, job_id, encoding=None, tail_bytes=None
+    ):
+        """Prints the stdout.txt and stderr.txt files for each task in the job,
+        after saving them locally with save_task_output.
 
         :param batch_client: The batch client to use.
         :type batch_client: `batchserviceclient.BatchServiceClient`
         :param str job_id: The id of the job with task output files to print.
+        :param int tail_bytes: Print only the last tail_bytes of each file.
         """
 
         print("Printing task output...")
 
-        tasks = batch_service_client.task.list(job_id)
-
-        for task in tasks:
-
-            node_id = batch_service_client.task.get(job_id, task.id).node_info.node_id
-            print("Task: {}".format(task.id))
+        if encoding is None:
+            encoding = "utf-8"
+        saved = self.save_task_output(
+            batch_service_client, job_id, tail_bytes=tail_bytes
+        )
+        for task_id, (node_id, output_files) in saved.items():
+            print("Task: {}".format(task_id))
             print("Node: {}".format(node_id))
+            for title, output_file in zip(
+                ("Standard output:", "Standard error:"), output_files
+            ):
+                print(title)
+                if output_file is not None:
+                    with open(output_file, "rb") as f:
+                        print(f.read().decode(encoding, errors="replace"))
+
+    def save_task_output(
+        self,
+        batch_service_client,
+        job_id,
+        output_dir=_TASK_OUTPUT_DIR,
+        tail_bytes=None,
+        workers=_TASK_OUTPUT_WORKERS,
+    ):
+        """Streams the stdout.txt and stderr.txt files of every task in the job
+        to output_dir/<task id>/, fetching tasks concurrently.
+
+        The tasks are listed once, with their node info, and no task is
+        fetched again.
 
-            stream = batch_service_client.file.get_from_task(
-                job_id, task.id, _STANDARD_OUT_FILE_NAME
+        :param batch_client: The batch client to use.
+        :type batch_client: `batchserviceclient.BatchServiceClient`
+        :param str job_id: The id of the job with task output files to save.
+        :param str output_dir: The local directory to save the files to.
+        :param int tail_bytes: Save only the last tail_bytes of each file.
+        :param int workers: The number of concurrent downloads.
+        :return: {task id: (node id, (stdout file, stderr file))}, in task list
+        order. A file that could not be fetched is None.
+        """
+        tasks = self.list_tasks(batch_service_client, job_id, None, "id,nodeInfo")
+
+        def save(task):
+            task_dir = os.path.join(output_dir, task.id)
+            os.makedirs(task_dir, exist_ok=True)
+            output_files = tuple(
+                self.save_task_file(
+                    batch_service_client,
+                    job_id,
+                    task.id,
+                    file_name,
+                    os.path.join(task_dir, file_name),
+                    tail_bytes,
+                )
+                for file_name in (_STANDARD_OUT_FILE_NAME, _STANDARD_ERR_FILE_NAME)
             )
-
-            file_text = self._read_stream_as_string(stream, encoding)
-            print("Standard output:")
-            print(file_text)
-
+            node_id = task.node_info.node_id if task.node_info else None
+            return task.id, (node_id, output_files)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(save, tasks))
+
+    def save_task_file(
+        self,
+        batch_service_client,
+        job_id,
+        task_id,
+        file_name,
+        output_file,
+        tail_bytes=None,
+    ):
+        """Streams one task file to output_file, or only its last tail_bytes
+        with a ranged read. Returns output_file, or None if the file could
+        not be fetched."""
+        try:
+            options = None
+            if tail_bytes is not None:
+                size = batch_service_client.file.get_properties_from_task(
+                    job_id, task_id, file_name, raw=True
+                ).headers["Content-Length"]
+                if size > tail_bytes:
+                    options = batchmodels.FileGetFromTaskOptions(
+                        ocp_range="bytes={}-{}".format(size - tail_bytes, size - 1)
+                    )
             stream = batch_service_client.file.get_from_task(
-                job_id, task.id, _STANDARD_ERR_FILE_NAME
+                job_id, task_id, file_name, file_get_from_task_options=options
             )
-
-            file_text = self._read_stream_as_string(stream, encoding)
-            print("Standard error:")
-            print(file_text)
+            with open(output_file, "wb") as f:
+                for data in stream:
+                    f.write(data)
+            return output_file
+        except batchmodels.BatchErrorException as err:
+            self.print_batch_exception(err)
+        return None
 
     def _read_stream_as_string(self, stream, encoding):
         """Read stream as string
@@ -291,7 +665,65 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
             output.close()
         raise RuntimeError("could not write data to stream or decode bytes")
 
-    def run_job(self, data_file, mapping_file):
+    def stage_storage_files(self):
+        """
+        stage_files with SAS URLs for the input container, and for the output
+        container and ADLS Gen2 file system, signed with the account keys.
+        """
+        blob_manager = BlobManager()
+        self.stage_files(
+            blob_manager.container_sas_url(
+                _STORAGE_CONNECTION_STRING, _CONTAINER_NAME, "r"
+            ),
+            [
+                blob_manager.container_sas_url(
+                    _STORAGE_CONNECTION_STRING, "output", "cw"
+                ),
+                # An ADLS Gen2 file system is also a blob container
+                blob_manager.container_sas_url(
+                    _DATALAKE_CONNECTION_STRING, _ADLS_FILE_SYSTEM, "cw"
+                ),
+            ],
+        )
+
+    def uncached_pairs(self, pairs, etl_manager=None):
+        """
+        The (data_file, mapping_file) pairs without a result in the manifest
+        cache whose output still exists, looked up concurrently.
+
+        :param list pairs: The (data_file, mapping_file) pairs to process.
+        :param etl_manager: The EtlManager whose cache is consulted.
+        """
+        etl_manager = etl_manager or EtlManager()
+        with ThreadPoolExecutor(max_workers=_MANIFEST_IO_WORKERS) as executor:
+            lookups = list(
+                executor.map(lambda pair: etl_manager.cached_result(*pair), pairs)
+            )
+        uncached = []
+        for (data_file, mapping_file), (_, cached) in zip(pairs, lookups):
+            if cached is None:
+                uncached.append((data_file, mapping_file))
+            else:
+                print("Skipping {}, its inputs are unchanged".format(data_file))
+        return uncached
+
+    def run_job(self, data_file, mapping_file, shards=1):
+        # Sharded jobs write one output per shard and are not cached
+        if shards == 1 and not self.uncached_pairs([(data_file, mapping_file)]):
+            return
+        if _BATCH_STAGE_FILES:
+            self.stage_storage_files()
+        self.run_tasks(self.build_job_tasks(data_file, mapping_file, shards))
+
+    def run_manifest(self, pairs):
+        pairs = self.uncached_pairs(pairs)
+        if not pairs:
+            return
+        if _BATCH_STAGE_FILES:
+            self.stage_storage_files()
+        self.run_tasks(self.build_file_tasks(pairs))
+
+    def run_tasks(self, tasks, autoscale=_POOL_AUTOSCALE):
 
         try:
             start_time = self.print_start_time()
@@ -300,19 +732,25 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
 
             batch_client = self.get_batch_service_client(credentials)
 
-            # Create the pool that will contain the compute nodes that will execute the tasks.
-            self.create_pool(batch_client, _POOL_ID)
+            # Size the pool for the tasks, using task durations of earlier runs
+            pool_manager = PoolManager().load_timings()
+            self.size_pool(batch_client, _POOL_ID, len(tasks), pool_manager, autoscale)
 
             # Create the job that will run the tasks.
             self.create_job(batch_client, _JOB_ID, _POOL_ID)
 
             # Add the tasks to the job.
-            self.add_tasks(batch_client, _JOB_ID, data_file, mapping_file)
+            print("Adding {} tasks to job #[{}]...".format(len(tasks), _JOB_ID))
+            self.add_task_collection(batch_client, _JOB_ID, tasks)
 
             # Pause execution until tasks reach Completed state.
             self.wait_for_tasks_to_complete(
-                batch_client, _JOB_ID, datetime.timedelta(minutes=30)
+                batch_client,
+                _JOB_ID,
+                datetime.timedelta(minutes=30),
+                on_task_completed=pool_manager.record_task,
             )
+            pool_manager.save_timings()
 
             print(
                 "  Success! All tasks reached the 'Completed' state within the "
@@ -322,6 +760,11 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
             # Print the stdout.txt and stderr.txt files for each task to the console
             self.print_task_output(batch_client, _JOB_ID)
 
+            # Keep the nodes warm for a following run, then scale down once
+            # idle. An autoscale formula does it itself.
+            if not autoscale:
+                pool_manager.scale_down_when_idle(batch_client, _POOL_ID)
+
             self.print_end_time(start_time)
 
         except batchmodels.BatchErrorException as err:
@@ -329,5 +772,17 @@ class AzureBatchManager:  # pylint: disable=too-few-public-methods
             raise
 
 if __name__ == "__main__":
+    """
+    azure_batch_manager.py <data_file> <mapping_file>
+    azure_batch_manager.py --shards <shards> <data_file> <mapping_file>
+    azure_batch_manager.py --manifest <manifest.json>
+    """
     azure_batch_manager = AzureBatchManager()
-    azure_batch_manager.run_job(sys.argv[1], sys.argv[2])
+    if sys.argv[1] == "--shards":
+        azure_batch_manager.run_job(sys.argv[3], sys.argv[4], int(sys.argv[2]))
+    elif sys.argv[1] == "--manifest":
+        with open(sys.argv[2]) as f:
+            pairs = EtlManager().expand_manifest(json.load(f))
+        azure_batch_manager.run_manifest(pairs)
+    else:
+        azure_batch_manager.run_job(sys.argv[1], sys.argv[2])
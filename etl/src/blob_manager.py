@@ -1,55 +1,158 @@
 """BlobManager: Uploading and downloading blob files"""
 from __future__ import print_function
+import base64
 import datetime
+import fnmatch
+import json
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    AzureError,
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
 from azure.storage.blob import (
+    BlobBlock,
     BlobServiceClient,
-    BlobClient,
-    ContainerClient,
+    ContentSettings,
     __version__,
+    generate_container_sas,
+)
+
+from etl.config.general import (
+    _BLOB_BLOCK_SIZE,
+    _BLOB_MAX_CONCURRENCY,
+    _BLOB_MAX_RETRIES,
+    _BLOB_SAS_EXPIRY_HOURS,
+    _CONTENT_TYPES,
+    _TRANSFER_COMPRESSION,
 )
+from etl.src.compression_manager import CompressionManager
+
+# Bytes read at a time when looking for the end of a line
+_LINE_SCAN_BYTES = 64 * 1024
+
+class TransferProgress:
+    """Thread-safe byte counter reporting to a progress callback.
+
+    callback(bytes_transferred, total_bytes, seconds_elapsed) is called after
+    every block, throughput is bytes_transferred / seconds_elapsed.
+    """
+
+    def __init__(self, total_bytes: int, callback=None, bytes_transferred: int = 0):
+        self._total_bytes = total_bytes
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self.bytes_transferred = bytes_transferred
+
+    def add(self, byte_count: int):
+        with self._lock:
+            self.bytes_transferred += byte_count
+            if self._callback is not None:
+                self._callback(
+                    self.bytes_transferred,
+                    self._total_bytes,
+                    time.perf_counter() - self._start,
+                )
+
 
 class BlobManager:  # pylint: disable=too-few-public-methods
-    """Upload and download files from Azure Blob Storage"""
+    """Upload and download files from Azure Blob Storage.
+
+    Service and container clients are created once and reused for the
+    lifetime of the manager, and containers known to exist are not checked
+    again, so each transfer costs a constant number of service calls.
+    """
+
+    # Locks of local download targets, by absolute path
+    _target_locks = {}
+    _target_locks_lock = threading.Lock()
 
-    def __init__(self):
+    def __init__(
+        self,
+        blob_service_client=None,
+        block_size: int = _BLOB_BLOCK_SIZE,
+        max_concurrency: int = _BLOB_MAX_CONCURRENCY,
+        progress_callback=None,
+        compression: str = _TRANSFER_COMPRESSION,
+    ):
         super().__init__()
+        # An injected client (e.g. a local fake) is used for every account
+        self._blob_service_client = blob_service_client
+        self._block_size = block_size
+        self._max_concurrency = max_concurrency
+        self._progress_callback = progress_callback
+        self._compression = CompressionManager(compression)
+        self._service_clients = {}
+        self._container_clients = {}
+        self._known_containers = set()
+
+    def get_service_client(self, storage_account_connection_string: str):
+        """Pooled BlobServiceClient for the storage account"""
+        if self._blob_service_client is not None:
+            return self._blob_service_client
+        client = self._service_clients.get(storage_account_connection_string)
+        if client is None:
+            client = BlobServiceClient.from_connection_string(
+                storage_account_connection_string
+            )
+            self._service_clients[storage_account_connection_string] = client
+        return client
+
+    def get_container_client(
+        self,
+        storage_account_connection_string: str,
+        container_name: str,
+        create: bool = False,
+    ):
+        """Pooled ContainerClient, creating the container on first use when
+        create is set"""
+        key = (storage_account_connection_string, container_name)
+        client = self._container_clients.get(key)
+        if client is None:
+            client = self.get_service_client(
+                storage_account_connection_string
+            ).get_container_client(container_name)
+            self._container_clients[key] = client
+        if create and key not in self._known_containers:
+            if not client.exists():
+                try:
+                    client.create_container()
+                except ResourceExistsError:
+                    pass
+            self._known_containers.add(key)
+        return client
 
     def upload_blob_file(
         self,
         storage_account_connection_string: str,
         container_name: str,
         upload_file: str,
+        raise_errors: bool = False,
     ):
-        """Uploads upload_file to blob storage"""
+        """Uploads upload_file to blob storage. Failures are printed, or
+        raised with raise_errors."""
         try:
-            # Create the BlobServiceClient object which will be used to create a container client
-            blob_service_client = BlobServiceClient.from_connection_string(
-                storage_account_connection_string
+            container_client = self.get_container_client(
+                storage_account_connection_string, container_name, create=True
             )
 
-            all_containers = blob_service_client.list_containers()
-            if not (
-                container_name in [container["name"] for container in all_containers]
-            ):
-                _ = blob_service_client.create_container(container_name)
-            else:
-                _ = blob_service_client.get_container_client(container_name)
-
-            # Upload the created file
-            container_client = ContainerClient.from_connection_string(
-                conn_str=storage_account_connection_string,
-                container_name=container_name,
+            blob_name = self.blob_name(upload_file)
+            blob_client = container_client.get_blob_client(blob_name)
+            self.upload_blocks(
+                blob_client, upload_file, blob_name != os.path.basename(upload_file)
             )
 
-            # Upload file
-            with open(upload_file, "rb") as data:
-                container_client.upload_blob(
-                    name=os.path.basename(upload_file), data=data, overwrite=True
-                )
-
         except Exception as e:
             print(e)
+            if raise_errors:
+                raise
+            return False
 
         return True
 
@@ -61,43 +164,421 @@ class BlobManager:  # pylint: disable=too-few-public-methods
     ):
         """Download download_file from blob container"""
         try:
-            # Create the BlobServiceClient object which will be used to create a container client
-            blob_service_client = BlobServiceClient.from_connection_string(
-                storage_account_connection_string
-            )
             # blob name is the base filename
             blob_name = os.path.basename(download_file)
-            container_client = blob_service_client.get_container_client(container_name)
-            blob_list = container_client.list_blobs()
-            if not (blob_name in [blob["name"] for blob in blob_list]):
+            blob = self.get_container_client(
+                storage_account_connection_string, container_name
+            ).get_blob_client(blob_name)
+
+            print(
+                "[{}]:[INFO] : Downloading {} ...".format(
+                    datetime.datetime.utcnow(), blob_name
+                )
+            )
+
+            # A missing blob fails the properties call itself, no listing needed
+            try:
+                properties = blob.get_blob_properties()
+            except ResourceNotFoundError:
                 print(
                     "[{}]:[FAILURE] : Downloading {} ...".format(
-                        datetime.datetime.utcnow(), os.path.basename(download_file)
+                        datetime.datetime.utcnow(), blob_name
                     )
                 )
                 return None
 
-            print(
-                "[{}]:[INFO] : Downloading {} ...".format(
-                    datetime.datetime.utcnow(), os.path.basename(download_file)
+            # Compressed content is kept compressed, named for its codec so
+            # that transforms read it directly
+            codec = CompressionManager.codec_for(
+                blob_name, properties.get("metadata")
+            )
+            if codec is not None:
+                download_file = CompressionManager(codec).compressed_name(
+                    download_file
                 )
+            blob_name = download_file
+            self.download_blocks(
+                blob, download_file, properties["size"], properties.get("etag")
             )
 
-            blob = BlobClient.from_connection_string(
-                conn_str=storage_account_connection_string,
-                container_name=container_name,
-                blob_name=blob_name,
+            print(
+                "[{}]:[INFO] : download finished. ".format(datetime.datetime.utcnow())
             )
+        except Exception as e:
+            print(e)
+            return None
+        return blob_name
 
-            blob_name = download_file
-            with open(blob_name, "wb") as my_blob:
-                blob_data = blob.download_blob()
-                blob_data.readinto(my_blob)
+    def download_blob_shard(
+        self,
+        storage_account_connection_string: str,
+        container_name: str,
+        download_file: str,
+        shard: int,
+        shards: int,
+    ):
+        """Download the header line and the rows of one of shards newline
+        aligned byte ranges of a csv blob to download_file, splitting the
+        blob as TransformManager.split_ranges splits a local file. Only the
+        header, the shard's range and the lines at its ends are read, all
+        from the same blob version. Returns download_file, or None if the
+        blob is missing, compressed or cannot be read."""
+        try:
+            blob_name = os.path.basename(download_file)
+            blob = self.get_container_client(
+                storage_account_connection_string, container_name
+            ).get_blob_client(blob_name)
+            properties = blob.get_blob_properties()
+            if CompressionManager.codec_for(blob_name, properties.get("metadata")):
+                print(
+                    "[FAILURE] : {} is compressed and cannot be read by "
+                    "byte range".format(blob_name)
+                )
+                return None
+            size = properties["size"]
+            etag = properties.get("etag")
+
+            def read_range(offset, length):
+                return blob.download_blob(
+                    offset=offset,
+                    length=length,
+                    etag=etag,
+                    match_condition=MatchConditions.IfNotModified,
+                ).readall()
+
+            def next_line(offset):
+                # Where readline from offset would stop
+                while offset < size:
+                    length = min(_LINE_SCAN_BYTES, size - offset)
+                    data = self.with_retries(read_range, offset, length)
+                    newline = data.find(b"\n")
+                    if newline >= 0:
+                        return offset + newline + 1
+                    offset += len(data)
+                return size
 
+            data_start = next_line(0)
+
+            def boundary(part):
+                if part <= 0:
+                    return data_start
+                if part >= shards:
+                    return size
+                return next_line(data_start + (size - data_start) * part // shards)
+
+            start = boundary(shard)
+            end = max(start, boundary(shard + 1))
             print(
-                "[{}]:[INFO] : download finished. ".format(datetime.datetime.utcnow())
+                "[{}]:[INFO] : Downloading bytes {}-{} of {} ...".format(
+                    datetime.datetime.utcnow(), start, end, blob_name
+                )
             )
+            with open(download_file, "wb") as f:
+                if data_start:
+                    f.write(self.with_retries(read_range, 0, data_start))
+                for offset in range(start, end, self._block_size):
+                    length = min(self._block_size, end - offset)
+                    f.write(self.with_retries(read_range, offset, length))
         except Exception as e:
             print(e)
             return None
-        return blob_name
+        return download_file
+
+    def blob_fingerprint(
+        self,
+        storage_account_connection_string: str,
+        container_name: str,
+        blob_name: str,
+    ):
+        """Content MD5 of the blob when the service has one, else its ETag,
+        from a single properties request. None when the blob is missing."""
+        blob = self.get_container_client(
+            storage_account_connection_string, container_name
+        ).get_blob_client(blob_name)
+        try:
+            properties = blob.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        content_md5 = (properties.get("content_settings") or {}).get("content_md5")
+        if content_md5:
+            return "md5:{}".format(base64.b64encode(bytes(content_md5)).decode())
+        return "etag:{}".format(properties["etag"])
+
+    def with_retries(self, operation, *args):
+        """Call operation, retrying transient service errors"""
+        for attempt in range(_BLOB_MAX_RETRIES + 1):
+            try:
+                return operation(*args)
+            except (ResourceNotFoundError, ResourceModifiedError):
+                raise
+            except AzureError:
+                if attempt == _BLOB_MAX_RETRIES:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+    def upload_blocks(self, blob_client, upload_file: str, compress: bool = False):
+        """Upload upload_file as blocks of block_size, staging up to
+        max_concurrency blocks at once, then commit the block list. With
+        compress the blocks are compressed as they are read."""
+        total_bytes = os.path.getsize(upload_file)
+        if total_bytes <= self._block_size and not compress:
+            with open(upload_file, "rb") as data:
+                blob_client.upload_blob(
+                    data, overwrite=True, **self.blob_settings(blob_client.blob_name)
+                )
+            TransferProgress(total_bytes, self._progress_callback).add(total_bytes)
+            return
+
+        def read_blocks():
+            with open(upload_file, "rb") as data:
+                block = data.read(self._block_size)
+                while block:
+                    yield block
+                    block = data.read(self._block_size)
+
+        if compress:
+            # Progress counts compressed bytes, the total is not known up front
+            self.stage_blocks(
+                blob_client, self.rechunk(self._compression.compress(read_blocks()))
+            )
+            return
+        self.stage_blocks(blob_client, read_blocks(), total_bytes)
+
+    def stage_blocks(self, blob_client, blocks, total_bytes: int = None):
+        """Stage an iterable of byte blocks on a thread pool and commit them
+        in order. Returns the number of bytes uploaded."""
+        progress = TransferProgress(total_bytes, self._progress_callback)
+
+        def stage(block_id, data):
+            self.with_retries(blob_client.stage_block, block_id, data)
+            progress.add(len(data))
+
+        block_ids = []
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+            in_flight = set()
+            for block in blocks:
+                block_id = base64.b64encode(
+                    "{:08d}".format(len(block_ids)).encode()
+                ).decode()
+                block_ids.append(block_id)
+                # Bound memory to a few blocks per worker
+                if len(in_flight) >= self._max_concurrency * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(executor.submit(stage, block_id, block))
+            for future in in_flight:
+                future.result()
+        blob_client.commit_block_list(
+            [BlobBlock(block_id=i) for i in block_ids],
+            **self.blob_settings(blob_client.blob_name)
+        )
+        return progress.bytes_transferred
+
+    def content_settings(self, blob_name: str):
+        """Content type for blob_name from its extension, e.g. parquet or csv
+        output, or None to leave the service default"""
+        content_type = _CONTENT_TYPES.get(
+            os.path.splitext(CompressionManager.strip_extension(blob_name))[1].lower()
+        )
+        if content_type is None:
+            return None
+        return ContentSettings(content_type=content_type)
+
+    def blob_settings(self, blob_name: str) -> dict:
+        """Content settings and compression metadata of blob_name, as upload
+        keyword arguments"""
+        return {
+            "content_settings": self.content_settings(blob_name),
+            "metadata": self._compression.metadata(blob_name),
+        }
+
+    def blob_name(self, upload_file: str) -> str:
+        """The name upload_file is uploaded as, with the extension of the
+        manager's compression"""
+        return self._compression.compressed_name(os.path.basename(upload_file))
+
+    def compress_upload(self, file_name: str, chunks):
+        """(blob name, chunks) to upload an iterable of byte strings named
+        file_name as, compressed when the manager has a compression"""
+        blob_name = self._compression.compressed_name(file_name)
+        if blob_name != file_name:
+            chunks = self._compression.compress(chunks)
+        return blob_name, chunks
+
+    def rechunk(self, chunks):
+        """Regroup an iterable of byte strings into blocks of block_size"""
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= self._block_size:
+                yield bytes(buffer[: self._block_size])
+                del buffer[: self._block_size]
+        if buffer:
+            yield bytes(buffer)
+
+    def upload_blob_stream(
+        self,
+        storage_account_connection_string: str,
+        container_name: str,
+        blob_name: str,
+        chunks,
+    ) -> int:
+        """Upload an iterable of byte strings to blob_name as it is produced,
+        without a local file, compressed when the manager has a compression.
+        Returns the number of bytes uploaded."""
+        container_client = self.get_container_client(
+            storage_account_connection_string, container_name, create=True
+        )
+        blob_name, chunks = self.compress_upload(blob_name, chunks)
+        blob_client = container_client.get_blob_client(blob_name)
+        return self.stage_blocks(blob_client, self.rechunk(chunks))
+
+    def iter_blob_chunks(
+        self,
+        storage_account_connection_string: str,
+        container_name: str,
+        blob_name: str,
+    ):
+        """Yield the content of blob_name as byte strings while it downloads,
+        decompressed when its extension or metadata names a codec"""
+        blob_client = self.get_container_client(
+            storage_account_connection_string, container_name
+        ).get_blob_client(blob_name)
+        downloader = blob_client.download_blob(max_concurrency=self._max_concurrency)
+        codec = CompressionManager.codec_for(blob_name, downloader.properties.metadata)
+        yield from CompressionManager.decompress(downloader.chunks(), codec)
+
+    def download_blocks(
+        self, blob_client, download_file: str, size: int, etag: str = None
+    ):
+        """Download blob_client into download_file with ranged reads of
+        block_size, up to max_concurrency at once.
+
+        Data goes to download_file.partial and the end of the contiguous
+        completed range is recorded in download_file.progress with the blob's
+        etag, so a download that failed part way restarts from the last
+        completed block of the same blob version. Every read requires the
+        blob to still have etag, so a blob overwritten during the download
+        fails it rather than mixing old and new bytes. Downloads to the same
+        download_file in this process run one at a time.
+        """
+        with self.target_lock(download_file):
+            partial_file = download_file + ".partial"
+            progress_file = download_file + ".progress"
+            start = self.resume_offset(partial_file, progress_file, etag)
+            if start == 0:
+                with open(partial_file, "wb"):
+                    pass
+            with open(partial_file, "r+b") as f:
+                f.truncate(size)
+
+            progress = TransferProgress(size, self._progress_callback, start)
+            offsets = list(range(start, size, self._block_size))
+            completed = set()
+            state = {"watermark": start}
+            lock = threading.Lock()
+
+            conditions = {}
+            if etag is not None:
+                conditions = {
+                    "etag": etag,
+                    "match_condition": MatchConditions.IfNotModified,
+                }
+
+            def read_range(offset, length):
+                return blob_client.download_blob(
+                    offset=offset, length=length, **conditions
+                ).readall()
+
+            def fetch(offset):
+                length = min(self._block_size, size - offset)
+                data = self.with_retries(read_range, offset, length)
+                with open(partial_file, "r+b") as f:
+                    f.seek(offset)
+                    f.write(data)
+                progress.add(len(data))
+                with lock:
+                    completed.add(offset)
+                    # Advance the resume point past every contiguous finished block
+                    while state["watermark"] in completed:
+                        completed.remove(state["watermark"])
+                        state["watermark"] += self._block_size
+                    with open(progress_file, "w") as f:
+                        json.dump(
+                            {"etag": etag, "offset": min(state["watermark"], size)}, f
+                        )
+
+            with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+                for future in [executor.submit(fetch, offset) for offset in offsets]:
+                    future.result()
+
+            os.replace(partial_file, download_file)
+            if os.path.exists(progress_file):
+                os.remove(progress_file)
+
+    @classmethod
+    def target_lock(cls, download_file: str):
+        """Lock held while downloading to download_file, shared by every
+        manager in the process"""
+        key = os.path.abspath(download_file)
+        with cls._target_locks_lock:
+            return cls._target_locks.setdefault(key, threading.Lock())
+
+    def resume_offset(self, partial_file: str, progress_file: str, etag: str) -> int:
+        """Offset to resume a download from, 0 unless a previous attempt at
+        the same blob version left a partial file"""
+        if not (os.path.exists(partial_file) and os.path.exists(progress_file)):
+            return 0
+        try:
+            with open(progress_file) as f:
+                progress = json.load(f)
+        except ValueError:
+            return 0
+        if not isinstance(progress, dict) or progress.get("etag") != etag:
+            print("[INFO] : {} changed, downloading again".format(partial_file))
+            return 0
+        return progress["offset"]
+
+    def list_blob_names(
+        self,
+        storage_account_connection_string: str,
+        container_name: str,
+        pattern: str,
+    ) -> list:
+        """Names of blobs in container_name matching the glob pattern"""
+        container_client = self.get_container_client(
+            storage_account_connection_string, container_name
+        )
+        # Only list below the fixed prefix of the pattern
+        prefix = pattern
+        for i, char in enumerate(pattern):
+            if char in "*?[":
+                prefix = pattern[:i]
+                break
+        return sorted(
+            blob["name"]
+            for blob in container_client.list_blobs(name_starts_with=prefix or None)
+            if fnmatch.fnmatchcase(blob["name"], pattern)
+        )
+
+    def container_sas_url(
+        self,
+        storage_account_connection_string: str,
+        container_name: str,
+        permission: str = "r",
+        expiry_hours: float = _BLOB_SAS_EXPIRY_HOURS,
+    ) -> str:
+        """URL of container_name with a SAS token signed with the account key,
+        e.g. for Batch resource and output files"""
+        client = self.get_service_client(storage_account_connection_string)
+        sas_token = generate_container_sas(
+            client.account_name,
+            container_name,
+            account_key=client.credential.account_key,
+            permission=permission,
+            expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=expiry_hours),
+        )
+        return "{}/{}?{}".format(
+            client.primary_endpoint.rstrip("/"), container_name, sas_token
+        )
@@ -0,0 +1,442 @@
+"""Bulk loads and upserts shared by the database managers"""
+import csv
+import itertools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import petl
+
+from etl.config.general import (
+    _BULK_INSERT_BATCH_SIZE,
+    _BULK_INSERT_COMMIT_EVERY,
+    _DB_LOAD_PARTITIONS,
+    _QUERY_FETCH_SIZE,
+)
+from etl.src.checkpoint_manager import CheckpointManager
+from etl.src.connection_pool import ConnectionPool
+from etl.src.transform_manager import TransformManager
+
+
+class BulkLoadManager:
+    """Loader mixed into the DBManagerInterface implementations, which
+    supply connect_to_db and override the driver settings below"""
+
+    # Driver specific settings for the shared bulk loader. The defaults suit
+    # pymssql, whose executemany runs one statement per row, so bulk loads
+    # send multi-row VALUES instead (SQL Server allows 2100 parameters)
+    _PLACEHOLDER = "%s"
+    _MAX_PARAMETERS = 2000
+    _MAX_ROWS_PER_STATEMENT = 1000
+    _USE_EXECUTEMANY = False
+    _INSERT_COLUMNS = ["Id", "DATE", "BODYSITE_CODE", "MODALITY_DESCRIPTION"]
+    # Column types of sink physical types, for tables built from DataMappings.
+    # Keyed on lower case ADF interim type names (String, Int32) and SQL
+    # Server type names (nvarchar, int), either may be a physicalType
+    _PHYSICAL_TYPES = {
+        "string": "nvarchar(255)",
+        "nvarchar": "nvarchar(255)",
+        "varchar": "varchar(255)",
+        "guid": "uniqueidentifier",
+        "uniqueidentifier": "uniqueidentifier",
+        "datetime": "datetime2",
+        "datetime2": "datetime2",
+        "date": "date",
+        "datetimeoffset": "datetimeoffset",
+        "byte": "tinyint",
+        "tinyint": "tinyint",
+        "int16": "smallint",
+        "smallint": "smallint",
+        "int32": "int",
+        "int": "int",
+        "int64": "bigint",
+        "bigint": "bigint",
+        "single": "real",
+        "real": "real",
+        "double": "float",
+        "float": "float",
+        "decimal": "decimal(38, 18)",
+        "numeric": "decimal(38, 18)",
+        "money": "money",
+        "boolean": "bit",
+        "bit": "bit",
+    }
+    _CREATE_TABLE_IF_MISSING = (
+        "IF OBJECT_ID('{table}', 'U') IS NULL CREATE TABLE {table} ({columns})"
+    )
+    _DROP_TABLE_IF_EXISTS = "DROP TABLE IF EXISTS {table}"
+    _CREATE_INDEX_IF_MISSING = (
+        "IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}' "
+        "AND object_id = OBJECT_ID('{table}')) CREATE INDEX {name} ON {table} ({columns})"
+    )
+
+    def query_rows(self, cursor, query, params=(), fetch_size=_QUERY_FETCH_SIZE):
+        """Run a parameterized query and yield its rows, fetched fetch_size
+        at a time so large results are never held in memory at once"""
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        rows = cursor.fetchmany(fetch_size)
+        while rows:
+            yield from rows
+            rows = cursor.fetchmany(fetch_size)
+
+    def read_insert_rows(self, input_file):
+        """Yield parameter tuples for the persons table in one pass over input_file"""
+        table = petl.cut(petl.fromcsv(input_file), *self._INSERT_COLUMNS)
+        return self.with_generated_ids(petl.data(table))
+
+    def with_generated_ids(self, rows):
+        """Yield rows with the leading source Id replaced by a generated one,
+        as in insert_data"""
+        for row in rows:
+            yield (str(uuid.uuid1()),) + tuple(row[1:])
+
+    def column_type(self, physical_type):
+        """The column type of a sink physicalType, raising ValueError for
+        one without a mapping rather than guessing"""
+        column_type = self._PHYSICAL_TYPES.get((physical_type or "").lower())
+        if column_type is None:
+            raise ValueError("Unsupported physicalType {!r}".format(physical_type))
+        return column_type
+
+    def create_mapped_table(self, cursor, data_mappings):
+        """Create the table described by data_mappings if it does not exist.
+        Existing tables and their rows are left in place. The key columns
+        are its primary key, which upserts match rows on."""
+        if not data_mappings._key_columns:
+            raise ValueError(
+                "{} has no key columns to upsert on".format(data_mappings._table_name)
+            )
+        columns = [
+            "{} {}{}".format(
+                name,
+                self.column_type(physical_type),
+                " NOT NULL" if name in data_mappings._key_columns else "",
+            )
+            for name, physical_type in data_mappings.table_columns()
+        ]
+        columns.append("PRIMARY KEY ({})".format(",".join(data_mappings._key_columns)))
+        cursor.execute(
+            self._CREATE_TABLE_IF_MISSING.format(
+                table=data_mappings._table_name, columns=", ".join(columns)
+            )
+        )
+
+    def create_mapped_indexes(self, conn, cursor, data_mappings):
+        """Create the secondary indexes declared in data_mappings, if missing.
+        Run after loading: building an index once is cheaper than updating
+        it on every inserted row."""
+        for columns in data_mappings._indexes:
+            cursor.execute(
+                self._CREATE_INDEX_IF_MISSING.format(
+                    name="ix_{}_{}".format(data_mappings._table_name, "_".join(columns)),
+                    table=data_mappings._table_name,
+                    columns=",".join(columns),
+                )
+            )
+        conn.commit()
+
+    def upsert_data(
+        self,
+        conn,
+        cursor,
+        data_mappings,
+        input_file,
+        batch_size=_BULK_INSERT_BATCH_SIZE,
+        commit_every=_BULK_INSERT_COMMIT_EVERY,
+    ):
+        """Upsert a transformed csv, whose header is the sink column names,
+        into the table described by data_mappings, then build its declared
+        indexes. Returns rows processed."""
+        self.create_mapped_table(cursor, data_mappings)
+        with open(input_file, newline="") as f:
+            reader = csv.reader(f)
+            columns = next(reader)
+            row_count = self.upsert_rows(
+                conn,
+                cursor,
+                data_mappings._table_name,
+                columns,
+                data_mappings._key_columns,
+                reader,
+                batch_size,
+                commit_every,
+            )
+        self.create_mapped_indexes(conn, cursor, data_mappings)
+        return row_count
+
+    def upsert_rows(
+        self,
+        conn,
+        cursor,
+        table_name,
+        columns,
+        key_columns,
+        rows,
+        batch_size=_BULK_INSERT_BATCH_SIZE,
+        commit_every=_BULK_INSERT_COMMIT_EVERY,
+    ):
+        """Insert or update rows by key_columns. Rows are bulk loaded into a
+        session staging table and merged in one statement, so only the rows
+        in the delta are written. The last row wins for a repeated key."""
+        staging_table = "#staging_{}".format(table_name)
+        self.create_staging_table(cursor, staging_table, table_name, columns)
+        row_count = self.bulk_insert_rows(
+            conn, cursor, staging_table, columns, rows, batch_size, commit_every
+        )
+        self.merge_staging_table(
+            cursor, staging_table, table_name, columns, key_columns
+        )
+        cursor.execute("DROP TABLE {}".format(staging_table))
+        conn.commit()
+        return row_count
+
+    def create_staging_table(self, cursor, staging_table, table_name, columns):
+        """Create an empty staging_table with the columns of table_name, plus
+        staged_order recording the load order"""
+        cursor.execute(
+            "SELECT TOP 0 IDENTITY(int, 1, 1) AS staged_order, {} INTO {} FROM {}".format(
+                ",".join(columns), staging_table, table_name
+            )
+        )
+
+    def merge_staging_table(
+        self, cursor, staging_table, table_name, columns, key_columns
+    ):
+        """Upsert the rows of staging_table into table_name by key_columns,
+        the last staged row winning for a repeated key"""
+        updates = [c for c in columns if c not in key_columns]
+        cursor.execute(
+            """
+            MERGE {table} AS target
+            USING (
+                SELECT {columns} FROM (
+                    SELECT *, ROW_NUMBER() OVER (
+                        PARTITION BY {keys} ORDER BY staged_order DESC
+                    ) AS staged_rank
+                    FROM {staging}
+                ) AS staged WHERE staged_rank = 1
+            ) AS source
+            ON {match}
+            {update}
+            WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({values});
+            """.format(
+                table=table_name,
+                staging=staging_table,
+                columns=",".join(columns),
+                keys=",".join(key_columns),
+                match=" AND ".join(
+                    "target.{0} = source.{0}".format(c) for c in key_columns
+                ),
+                update="WHEN MATCHED THEN UPDATE SET {}".format(
+                    ",".join("{0} = source.{0}".format(c) for c in updates)
+                )
+                if updates
+                else "",
+                values=",".join("source.{}".format(c) for c in columns),
+            )
+        )
+
+    def parallel_upsert_data(
+        self,
+        data_mappings,
+        input_file,
+        partitions=_DB_LOAD_PARTITIONS,
+        batch_size=_BULK_INSERT_BATCH_SIZE,
+    ):
+        """Upsert a transformed csv like upsert_data, split into partitions
+        loaded concurrently over a pool of connections.
+
+        Each partition is loaded into its own staging table in a single
+        transaction. Only when every partition has loaded are the staging
+        tables merged into the target, in order and in one transaction, so
+        a failed load leaves the target untouched. Returns rows processed.
+        """
+        table_name = data_mappings._table_name
+        transform_manager = TransformManager()
+        header_line, ranges = transform_manager.split_ranges(input_file, partitions)
+        columns = next(csv.reader([header_line.decode("utf-8")]))
+        run_id = uuid.uuid4().hex[:8]
+        staging_tables = [
+            "{}_staging_{}_{}".format(table_name, run_id, part)
+            for part in range(len(ranges))
+        ]
+        pool = ConnectionPool(self, max(1, len(ranges)))
+
+        def load_partition(staging_table, start, end):
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                self.create_staging_table(cursor, staging_table, table_name, columns)
+                # commit_every=0: one commit when the partition is loaded
+                return self.bulk_insert_rows(
+                    conn,
+                    cursor,
+                    staging_table,
+                    columns,
+                    transform_manager.read_range(input_file, start, end),
+                    batch_size,
+                    commit_every=0,
+                )
+
+        try:
+            with pool.connection() as conn:
+                self.create_mapped_table(conn.cursor(), data_mappings)
+                conn.commit()
+            with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+                futures = [
+                    executor.submit(load_partition, staging_table, start, end)
+                    for staging_table, (start, end) in zip(staging_tables, ranges)
+                ]
+                row_count = sum(future.result() for future in futures)
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    for staging_table in staging_tables:
+                        self.merge_staging_table(
+                            cursor,
+                            staging_table,
+                            table_name,
+                            columns,
+                            data_mappings._key_columns,
+                        )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                self.create_mapped_indexes(conn, cursor, data_mappings)
+            return row_count
+        finally:
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                for staging_table in staging_tables:
+                    cursor.execute(self._DROP_TABLE_IF_EXISTS.format(table=staging_table))
+                conn.commit()
+            pool.close()
+
+    def bulk_insert_data(
+        self,
+        conn,
+        cursor,
+        input_file,
+        batch_size=_BULK_INSERT_BATCH_SIZE,
+        commit_every=_BULK_INSERT_COMMIT_EVERY,
+        use_executemany=None,
+        checkpoint=None,
+    ):
+        """Insert input_file in batches of bound parameters, committing every
+        commit_every batches. Returns the number of rows inserted.
+
+        With a checkpoint, the committed row count is saved after every
+        commit and a restarted load of the same input_file skips the rows
+        already committed. A crash between a commit and its save inserts that
+        commit's rows again on restart."""
+        if use_executemany is None:
+            use_executemany = self._USE_EXECUTEMANY
+        rows = self.read_insert_rows(input_file)
+        committed = 0
+        on_commit = None
+        if checkpoint is not None:
+            source, committed = self.resume_rows(input_file, checkpoint)
+            rows = itertools.islice(rows, committed, None)
+
+            def on_commit(row_count):
+                checkpoint.save(source=source, rows_committed=committed + row_count)
+
+        row_count = self.bulk_insert_rows(
+            conn,
+            cursor,
+            "persons",
+            self._INSERT_COLUMNS,
+            rows,
+            batch_size,
+            commit_every,
+            use_executemany,
+            on_commit=on_commit,
+        )
+        if checkpoint is not None:
+            checkpoint.clear()
+        return committed + row_count
+
+    def resume_rows(self, input_file, checkpoint):
+        """(source fingerprint of input_file, rows committed by an earlier
+        load of it to skip)"""
+        source = CheckpointManager.source_fingerprint(input_file)
+        state = checkpoint.load()
+        if state is None or state.get("source") != source:
+            return source, 0
+        committed = state["rows_committed"]
+        print("[INFO] : Resuming {} after {} rows".format(input_file, committed))
+        return source, committed
+
+    def bulk_insert_rows(
+        self,
+        conn,
+        cursor,
+        table_name,
+        columns,
+        rows,
+        batch_size=_BULK_INSERT_BATCH_SIZE,
+        commit_every=_BULK_INSERT_COMMIT_EVERY,
+        use_executemany=False,
+        statement_suffix="",
+        on_commit=None,
+    ):
+        """Insert an iterable of row tuples into table_name in batches.
+        statement_suffix is appended to every INSERT, e.g. an ON CONFLICT clause.
+        A commit_every of 0 commits once, at the end. on_commit(rows committed)
+        is called after each commit."""
+        insert_cols = ",".join(columns)
+        row_marker = "({})".format(",".join([self._PLACEHOLDER] * len(columns)))
+        # Multi-row VALUES statements are capped by the driver's parameter limit
+        rows_per_statement = max(
+            1,
+            min(
+                batch_size,
+                self._MAX_ROWS_PER_STATEMENT,
+                self._MAX_PARAMETERS // len(columns),
+            ),
+        )
+        statements = {}
+
+        def statement_for(row_count):
+            if row_count not in statements:
+                statements[row_count] = "INSERT INTO {} ({}) VALUES {}{}".format(
+                    table_name,
+                    insert_cols,
+                    ",".join([row_marker] * row_count),
+                    statement_suffix,
+                )
+            return statements[row_count]
+
+        def flush(batch):
+            if use_executemany:
+                cursor.executemany(statement_for(1), batch)
+                return
+            for start in range(0, len(batch), rows_per_statement):
+                chunk = batch[start : start + rows_per_statement]
+                params = tuple(value for row in chunk for value in row)
+                cursor.execute(statement_for(len(chunk)), params)
+
+        row_count = 0
+        batch_count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush(batch)
+                row_count += len(batch)
+                batch = []
+                batch_count += 1
+                if commit_every and batch_count % commit_every == 0:
+                    conn.commit()
+                    if on_commit is not None:
+                        on_commit(row_count)
+        if batch:
+            flush(batch)
+            row_count += len(batch)
+        conn.commit()
+        if on_commit is not None:
+            on_commit(row_count)
+        print("Number of rows inserted = {}".format(row_count))
+        return row_count
@@ -0,0 +1,196 @@
+"""CheckpointManager: Progress of a long transform or load, for resuming"""
+from __future__ import print_function
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobBlock
+
+from etl.config.general import (
+    _BLOB_BLOCK_SIZE,
+    _CHECKPOINT_CONTAINER,
+    _CHECKPOINT_INTERVAL_SECONDS,
+)
+
+# Bytes before the checkpointed offset hashed to recognize the same source
+_SOURCE_TAIL_BYTES = 4096
+
+
+class CheckpointManager:
+    """Save and load the progress of one job as a small json state file.
+
+    A restarted job loads the state and continues from it. The state is
+    cleared when the job finishes, so the next run starts from the beginning.
+    """
+
+    def __init__(
+        self, state_file: str, interval_seconds: float = _CHECKPOINT_INTERVAL_SECONDS
+    ):
+        super().__init__()
+        self._state_file = state_file
+        self._interval_seconds = interval_seconds
+        self._saved_at = time.monotonic()
+
+    @staticmethod
+    def source_fingerprint(source_file: str, offset: int = None) -> dict:
+        """Size of source_file and a hash of the bytes just before offset
+        (default the end of the file), to tell whether a checkpoint was made
+        from the same source without reading all of it"""
+        size = os.path.getsize(source_file)
+        offset = size if offset is None else min(offset, size)
+        with open(source_file, "rb") as source:
+            start = max(0, offset - _SOURCE_TAIL_BYTES)
+            source.seek(start)
+            tail = hashlib.sha256(source.read(offset - start)).hexdigest()
+        return {"size": size, "tail": tail}
+
+    def load(self):
+        """The saved state, or None if there is none"""
+        try:
+            with open(self._state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def due(self) -> bool:
+        """Whether interval_seconds have passed since the last save"""
+        return time.monotonic() - self._saved_at >= self._interval_seconds
+
+    def save(self, **state):
+        """Replace the saved state, atomically so a crash while saving leaves
+        the previous state"""
+        temp_file = "{}.{}.{}.tmp".format(
+            self._state_file, os.getpid(), threading.get_ident()
+        )
+        with open(temp_file, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self._state_file)
+        self._saved_at = time.monotonic()
+
+    def clear(self):
+        """Remove the saved state"""
+        try:
+            os.remove(self._state_file)
+        except OSError:
+            pass
+
+    def save_output(self, output_file: str, output_offset: int):
+        """Keep output_file up to output_offset for a restart. It is on local
+        disk already."""
+
+    def restore_output(self, output_file: str, output_offset: int) -> bool:
+        """Whether output_file holds the output up to output_offset to
+        continue from"""
+        return (
+            os.path.exists(output_file)
+            and os.path.getsize(output_file) >= output_offset
+        )
+
+
+class BlobCheckpointManager(CheckpointManager):
+    """CheckpointManager keeping the state and the output written so far in
+    a blob container, so a job restarted on another node, e.g. a Batch task
+    whose node was lost, continues from them.
+
+    The output is appended to the partial blob as blocks, committed with
+    each save, and downloaded again by a restart without the local file.
+    """
+
+    def __init__(
+        self,
+        blob_manager,
+        storage_account_connection_string: str,
+        name: str,
+        container_name: str = _CHECKPOINT_CONTAINER,
+        interval_seconds: float = _CHECKPOINT_INTERVAL_SECONDS,
+    ):
+        super().__init__(name, interval_seconds)
+        self._blob_manager = blob_manager
+        self._storage_account_connection_string = storage_account_connection_string
+        self._container_name = container_name
+        # Blocks of the partial output, and the output offset they end at
+        self._output_blocks = []
+        self._output_offset = 0
+        # Blocks of the loaded state, continued from once its output is
+        # restored
+        self._loaded_blocks = []
+
+    def _blob_client(self, suffix: str):
+        return self._blob_manager.get_container_client(
+            self._storage_account_connection_string, self._container_name, create=True
+        ).get_blob_client("{}{}".format(self._state_file, suffix))
+
+    def load(self):
+        """The saved state, or None if there is none"""
+        try:
+            state = json.loads(self._blob_client(".json").download_blob().readall())
+        except (ResourceNotFoundError, ValueError):
+            return None
+        self._loaded_blocks = state.pop("output_blocks", [])
+        return state
+
+    def save(self, **state):
+        """Replace the saved state with one blob upload, which is atomic"""
+        state["output_blocks"] = self._output_blocks
+        self._blob_client(".json").upload_blob(
+            json.dumps(state).encode("utf-8"), overwrite=True
+        )
+        self._saved_at = time.monotonic()
+
+    def clear(self):
+        """Remove the saved state and partial output"""
+        for suffix in (".json", ".partial"):
+            try:
+                self._blob_client(suffix).delete_blob()
+            except ResourceNotFoundError:
+                pass
+        self._output_blocks = []
+        self._output_offset = 0
+
+    def save_output(self, output_file: str, output_offset: int):
+        """Stage output_file from the last save up to output_offset as blocks
+        of the partial blob and commit them after the earlier ones"""
+        blob_client = self._blob_client(".partial")
+        block_ids = list(self._output_blocks)
+        with open(output_file, "rb") as f:
+            f.seek(self._output_offset)
+            remaining = output_offset - self._output_offset
+            while remaining > 0:
+                data = f.read(min(_BLOB_BLOCK_SIZE, remaining))
+                if not data:
+                    raise RuntimeError(
+                        "{} is shorter than its checkpoint".format(output_file)
+                    )
+                block_id = base64.b64encode(
+                    "{:08d}".format(len(block_ids)).encode()
+                ).decode()
+                self._blob_manager.with_retries(blob_client.stage_block, block_id, data)
+                block_ids.append(block_id)
+                remaining -= len(data)
+        blob_client.commit_block_list([BlobBlock(block_id=i) for i in block_ids])
+        self._output_blocks = block_ids
+        self._output_offset = output_offset
+
+    def restore_output(self, output_file: str, output_offset: int) -> bool:
+        """Download the partial output to output_file when the local copy
+        was lost with its node"""
+        if not super().restore_output(output_file, output_offset):
+            try:
+                downloader = self._blob_client(".partial").download_blob(
+                    offset=0, length=output_offset
+                )
+            except ResourceNotFoundError:
+                return False
+            with open(output_file, "wb") as f:
+                downloader.readinto(f)
+            if not super().restore_output(output_file, output_offset):
+                return False
+        self._output_blocks = self._loaded_blocks
+        self._output_offset = output_offset
+        return True
@@ -0,0 +1,151 @@
+"""CompressionManager: Streaming gzip and zstd for transfers and transforms"""
+from __future__ import print_function
+import gzip
+import io
+import os
+import zlib
+
+import zstandard
+
+from etl.config.general import (
+    _COMPRESSION_EXTENSIONS,
+    _COMPRESSION_LEVELS,
+    _TRANSFER_COMPRESSION,
+)
+
+# Blob and file metadata key naming the codec of compressed content
+_METADATA_KEY = "compression"
+_ZSTD_READ_SIZE = 1024 * 1024
+
+
+class ChunkReader(io.RawIOBase):
+    """Readable binary stream over an iterable of byte strings"""
+
+    def __init__(self, chunks):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, None)
+            if self._pending is None:
+                self._pending = b""
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class CompressionManager:
+    """Compress and decompress iterables of byte strings one chunk at a time.
+
+    A file's codec is named by its extension (.gz, .zst) or, for blobs, by
+    their "compression" metadata. codec is the codec used to compress, None
+    to leave content as it is.
+    """
+
+    def __init__(self, codec: str = _TRANSFER_COMPRESSION, level: int = None):
+        super().__init__()
+        if codec is not None and codec not in _COMPRESSION_LEVELS:
+            raise ValueError("Unknown compression {}".format(codec))
+        self._codec = codec
+        self._level = _COMPRESSION_LEVELS.get(codec) if level is None else level
+
+    @staticmethod
+    def codec_for(name: str, metadata: dict = None):
+        """Codec of name from its extension, else from metadata, else None"""
+        extension = os.path.splitext(name)[1].lower()
+        if extension in _COMPRESSION_EXTENSIONS:
+            return _COMPRESSION_EXTENSIONS[extension]
+        return (metadata or {}).get(_METADATA_KEY)
+
+    @staticmethod
+    def strip_extension(name: str) -> str:
+        """name without its compression extension, e.g. person.csv.gz to
+        person.csv"""
+        stem, extension = os.path.splitext(name)
+        if extension.lower() in _COMPRESSION_EXTENSIONS:
+            return stem
+        return name
+
+    def compressed_name(self, name: str) -> str:
+        """Name for name compressed with codec. Names of files that are
+        already compressed, or with no codec, are unchanged."""
+        if self._codec is None or self.codec_for(name) is not None:
+            return name
+        extension = {codec: ext for ext, codec in _COMPRESSION_EXTENSIONS.items()}
+        return name + extension[self._codec]
+
+    def metadata(self, name: str):
+        """Metadata recording the codec of compressed_name(name), or None"""
+        codec = self.codec_for(self.compressed_name(name))
+        return {_METADATA_KEY: codec} if codec else None
+
+    def compress(self, chunks):
+        """Yield chunks compressed with codec as a single gzip member or
+        zstd frame. With no codec the chunks are passed through."""
+        if self._codec is None:
+            yield from chunks
+            return
+        if self._codec == "zstd":
+            compressor = zstandard.ZstdCompressor(level=self._level).compressobj()
+        else:
+            compressor = zlib.compressobj(
+                self._level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    @staticmethod
+    def decompress(chunks, codec: str):
+        """Yield the decompressed content of chunks compressed with codec,
+        which may hold several concatenated gzip members or zstd frames.
+        With no codec the chunks are passed through."""
+        if codec is None:
+            yield from chunks
+            return
+        if codec == "zstd":
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                ChunkReader(chunks), read_across_frames=True
+            )
+            data = reader.read(_ZSTD_READ_SIZE)
+            while data:
+                yield data
+                data = reader.read(_ZSTD_READ_SIZE)
+            return
+        if codec != "gzip":
+            raise ValueError("Unknown compression {}".format(codec))
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            while chunk:
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+                if not decompressor.eof:
+                    break
+                # The rest of the chunk starts the next member
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    @staticmethod
+    def open_source(source_file: str):
+        """Open source_file for reading as a binary stream of its decompressed
+        content, without decompressing it to disk first"""
+        codec = CompressionManager.codec_for(source_file)
+        if codec == "gzip":
+            return gzip.open(source_file, "rb")
+        if codec == "zstd":
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                open(source_file, "rb"), read_across_frames=True, closefd=True
+            )
+            # Buffered for line iteration
+            return io.BufferedReader(reader)
+        return open(source_file, "rb")
@@ -0,0 +1,40 @@
+"""ConnectionPool: A small pool of database connections"""
+from __future__ import print_function
+import contextlib
+import queue
+import threading
+
+
+class ConnectionPool:
+    """Hand out up to size connections from a DBManager, opening them on
+    first use and reusing them after. Connections must be safe to pass
+    between threads, one thread at a time."""
+
+    def __init__(self, db_manager, size: int):
+        self._db_manager = db_manager
+        self._size = size
+        self._idle = queue.LifoQueue()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection, waiting for one when all are in use"""
+        conn = None
+        with self._lock:
+            if self._idle.empty() and len(self._opened) < self._size:
+                conn = self._db_manager.connect_to_db()
+                if conn is None:
+                    raise RuntimeError("Unable to connect to the database")
+                self._opened.append(conn)
+        if conn is None:
+            conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for conn in self._opened:
+            conn.close()
+        self._opened = []
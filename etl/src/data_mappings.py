@@ -1,4 +1,5 @@
 """Mapping source and destination data files"""
+import operator
 
 
 class ColumnMappings:
@@ -10,6 +11,8 @@ class ColumnMappings:
         destination_column_name: str,
         destination_column_type: str,
         destination_column_physical_type: str,
+        destination_column_precision: int = None,
+        destination_column_scale: int = None,
     ):
         self._source_column_name = source_column_name
         self._source_column_type = source_column_type
@@ -18,9 +21,84 @@ class ColumnMappings:
         self._destination_column_name = destination_column_name
         self._destination_column_type = destination_column_type
         self._destination_column_physical_type = destination_column_physical_type
+        # Of Decimal columns, None for the defaults
+        self._destination_column_precision = destination_column_precision
+        self._destination_column_scale = destination_column_scale
+
+    def to_list(self) -> list:
+        return [
+            self._source_column_name,
+            self._source_column_type,
+            self._source_column_physical_type,
+            self._destination_column_name,
+            self._destination_column_type,
+            self._destination_column_physical_type,
+            self._destination_column_precision,
+            self._destination_column_scale,
+        ]
+
+
+class ProjectionPlan:
+    """Compiled projection: source columns to pick and the output header.
+
+    A plan is bound once per source header to a tuple of source indices,
+    then every row is projected with a single itemgetter call. Rows shorter
+    than the header are padded with empty fields first, as pandas reads them.
+    """
+
+    def __init__(self, source_columns, output_header):
+        self._source_columns = tuple(source_columns)
+        self._output_header = tuple(output_header)
+        self._bound = {}
+
+    def __getstate__(self):
+        # Bound projections hold local functions, rebind after unpickling
+        return {
+            "_source_columns": self._source_columns,
+            "_output_header": self._output_header,
+            "_bound": {},
+        }
+
+    def source_indices(self, header) -> tuple:
+        """Index of each mapped source column in header"""
+        return self.bind(header)[0]
+
+    def bind(self, header):
+        """Return (source indices, row projection function) for header"""
+        header = tuple(header)
+        if header not in self._bound:
+            indices = tuple(header.index(column) for column in self._source_columns)
+            if len(indices) == 1:
+
+                def getter(row, index=indices[0]):
+                    return (row[index],)
+
+            else:
+                getter = operator.itemgetter(*indices)
+            self._bound[header] = (indices, self.padded(getter, max(indices) + 1))
+        return self._bound[header]
+
+    @staticmethod
+    def padded(getter, width: int):
+        """getter for rows of at least width fields, padding shorter rows"""
+
+        def project(row):
+            if len(row) < width:
+                row = row + [""] * (width - len(row))
+            return getter(row)
+
+        return project
+
+    def project(self, header, rows):
+        """Lazily project the non-blank rows read from a source with the given
+        header"""
+        return map(self.bind(header)[1], filter(None, rows))
 
 
 class DataMappings:
+    # Bump when to_dict changes, so stale cached plans are not reused
+    _CACHE_VERSION = 4
+
     def __init__(
         self,
         source_data_filename: str,
@@ -29,3 +107,47 @@ class DataMappings:
         self._source_data_filename = source_data_filename
         self._destination_data_filename = destination_data_filename
         self._column_mappings = []
+        self._projection_plan = None
+        # Database sink: table and upsert key, as sink column names
+        self._table_name = None
+        self._key_columns = []
+        # Secondary indexes, each a list of sink column names
+        self._indexes = []
+
+    def compile_plan(self) -> ProjectionPlan:
+        """Compile the column mappings into a reusable ProjectionPlan"""
+        self._projection_plan = ProjectionPlan(
+            [c._source_column_name for c in self._column_mappings],
+            [c._destination_column_name for c in self._column_mappings],
+        )
+        return self._projection_plan
+
+    def table_columns(self) -> list:
+        """(sink column name, sink physical type) for each mapped column"""
+        return [
+            (c._destination_column_name, c._destination_column_physical_type)
+            for c in self._column_mappings
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "source_data_filename": self._source_data_filename,
+            "destination_data_filename": self._destination_data_filename,
+            "column_mappings": [c.to_list() for c in self._column_mappings],
+            "table_name": self._table_name,
+            "key_columns": self._key_columns,
+            "indexes": self._indexes,
+        }
+
+    @staticmethod
+    def from_dict(values: dict):
+        data_mappings = DataMappings(
+            values["source_data_filename"], values["destination_data_filename"]
+        )
+        for column_mapping in values["column_mappings"]:
+            data_mappings._column_mappings.append(ColumnMappings(*column_mapping))
+        data_mappings._table_name = values.get("table_name")
+        data_mappings._key_columns = values.get("key_columns", [])
+        data_mappings._indexes = values.get("indexes", [])
+        data_mappings.compile_plan()
+        return data_mappings
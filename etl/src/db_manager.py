@@ -1,16 +1,20 @@
 """Main driver for application logic"""
 from __future__ import print_function
+import itertools
 import uuid
 import pymssql
 import petl
+from etl.src.bulk_load_manager import BulkLoadManager
 from etl.src.db_manager_interface import DBManagerInterface
 
+from etl.config.general import _BULK_INSERT_COMMIT_EVERY
+
 from etl.config.secrets import (
     _DBPWD,
 )
 
 
-class DBManager(DBManagerInterface):
+class DBManager(BulkLoadManager, DBManagerInterface):
     """class"""
 
     def __init__(self):
@@ -49,18 +53,31 @@ class DBManager(DBManagerInterface):
         except Exception as ex:
             print(ex)
 
-    def insert_data(self, conn, cursor, input_file):
+    def insert_data(
+        self,
+        conn,
+        cursor,
+        input_file,
+        checkpoint=None,
+        commit_every=_BULK_INSERT_COMMIT_EVERY,
+    ):
+        """Insert input_file a row at a time. With a checkpoint, the rows are
+        committed every commit_every rows and the committed row count saved,
+        and a restarted load of the same input_file skips those rows."""
         columns = ["Id", "DATE", "BODYSITE_CODE", "MODALITY_DESCRIPTION"]
         person_table = petl.fromcsv(input_file)
         person_table = petl.cut(person_table, *columns)
 
         insert_statement = "unassigned"
+        row_count = 0
+        committed = 0
         try:
+            if checkpoint is not None:
+                source, committed = self.resume_rows(input_file, checkpoint)
             insert_cols = ",".join(map(str, columns))
-            # Loop through rows
-            print("Number of rows to insert = {}".format(len(person_table)))
-            for i in range(1, len(person_table)):
-                row = person_table[i]
+            # Single pass over the csv: a lazy petl table re-reads the file on
+            # every len() or positional lookup, so never index it by row.
+            for row in itertools.islice(petl.data(person_table), committed, None):
                 query = "INSERT INTO persons ( {}".format(insert_cols)
                 values = ")VALUES('{}',".format(uuid.uuid1())
                 # Loop through columns
@@ -75,16 +92,22 @@ class DBManager(DBManagerInterface):
                 insert_statement = "{} {}".format(query, values)
                 print("{}".format(insert_statement))
                 cursor.execute(insert_statement)
+                row_count += 1
+                if checkpoint is not None and row_count % commit_every == 0:
+                    conn.commit()
+                    checkpoint.save(source=source, rows_committed=committed + row_count)
+            if checkpoint is not None:
+                conn.commit()
+                checkpoint.clear()
+            print("Number of rows inserted = {}".format(row_count))
         except Exception as ex:
             print(ex)
+        return committed + row_count
 
-    def show_data(self, cursor, query):
+    def show_data(self, cursor, query, params=()):
         try:
-            cursor.execute(query)
-            row = cursor.fetchone()
-            while row:
+            for row in self.query_rows(cursor, query, params):
                 print("ID=%s, bodysite_code=%s" % (row[0], row[2]))
-                row = cursor.fetchone()
 
         except Exception as ex:
             print(query)
@@ -15,9 +15,9 @@ class DBManagerInterface(ABC):
         """Create table"""
 
     @abstractmethod
-    def insert_data(self, conn, cursor, input_file):
+    def insert_data(self, conn, cursor, input_file, checkpoint=None):
         """Insert data"""
 
     @abstractmethod
-    def show_data(self, cursor, query):
+    def show_data(self, cursor, query, params=()):
         """Show data"""
@@ -1,14 +1,41 @@
 """Main driver for application logic"""
 from __future__ import print_function
+import csv
+import datetime
+import hashlib
+import json
+import os
 import petl
 import sys
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from petl import fromcsv
 
 from etl.src.blob_manager import BlobManager
+from etl.src.checkpoint_manager import BlobCheckpointManager, CheckpointManager
+from etl.src.compression_manager import CompressionManager
 from etl.src.data_mappings import ColumnMappings, DataMappings
 from etl.src.db_manager import DBManager
 from etl.src.json_manager import JsonManager
-from etl.config.general import _INPUT_FILE, _CONTAINER_NAME
+from etl.src.manifest_cache import BlobManifestCache, ManifestCache
+from etl.src.sink_manager import SinkManager
+from etl.src.transform_manager import TransformManager
+from etl.config.general import (
+    _CONTAINER_NAME,
+    _PLAN_CACHE_DIR,
+    _OUTPUT_FORMAT,
+    _TRANSFER_COMPRESSION,
+    _TRANSFORM_BACKEND,
+    _MANIFEST_IO_WORKERS,
+    _MANIFEST_TRANSFORM_WORKERS,
+)
 from etl.config.secrets import _STORAGE_CONNECTION_STRING
 
 from etl.src.adls2_manager import ADLS2Manager
@@ -19,7 +46,14 @@ class EtlManager:
 
     def __init__(self):
         super().__init__()
-        pass
+        # One BlobManager/ADLS2Manager so clients are reused across transfers
+        self._blob_manager = BlobManager()
+        self._adls2_manager = None
+        # Kept in blob storage, Batch task containers are removed after a run
+        self._manifest_cache = BlobManifestCache(
+            self._blob_manager, _STORAGE_CONNECTION_STRING
+        )
+        self._downloads_lock = threading.Lock()
 
     def download_blob_file(
         self,
@@ -28,28 +62,67 @@ class EtlManager:
         download_file: str,
     ) -> str:
         """Download from blob storage"""
-        blob_manager = BlobManager()
-        input_file = blob_manager.download_blob_file(
+        input_file = self._blob_manager.download_blob_file(
             storage_account_connection_string, container_name, download_file
         )
         return input_file
 
+    def download_blob_shard(
+        self,
+        storage_account_connection_string: str,
+        container_name: str,
+        download_file: str,
+        shard: int,
+        shards: int,
+    ) -> str:
+        """Download one byte-range shard of a csv blob"""
+        return self._blob_manager.download_blob_shard(
+            storage_account_connection_string,
+            container_name,
+            download_file,
+            shard,
+            shards,
+        )
+
+    def get_adls2_manager(self) -> ADLS2Manager:
+        """Connected ADLS2Manager, created on first use"""
+        if self._adls2_manager is None:
+            self._adls2_manager = ADLS2Manager()
+            self._adls2_manager.connect_adls_gen2()
+        return self._adls2_manager
+
     def upload_blob_file(
         self,
         storage_account_connection_string: str,
         container_name: str,
         upload_file: str,
+        raise_errors: bool = False,
     ) -> str:
-        """Download from blob storage"""
-        blob_manager = BlobManager()
-        input_file = blob_manager.upload_blob_file(
-            storage_account_connection_string, container_name, upload_file
+        """Upload to blob storage"""
+        input_file = self._blob_manager.upload_blob_file(
+            storage_account_connection_string,
+            container_name,
+            upload_file,
+            raise_errors,
         )
         return input_file
 
     def parse_mapping_file(self, mapping_file: str):
+        """Parse mapping_file into DataMappings with a compiled ProjectionPlan.
 
+        Parsed mappings are cached in _PLAN_CACHE_DIR keyed by the sha256 of
+        the mapping file, so an unchanged mapping is not parsed again.
+        """
         try:
+            with open(mapping_file, "rb") as f:
+                mapping_hash = hashlib.sha256(f.read()).hexdigest()
+            cache_file = os.path.join(
+                _PLAN_CACHE_DIR,
+                "{}.v{}.json".format(mapping_hash, DataMappings._CACHE_VERSION),
+            )
+            if os.path.exists(cache_file):
+                with open(cache_file) as f:
+                    return DataMappings.from_dict(json.load(f))
 
             json_manager = JsonManager(mapping_file)
             json_manager.load_mapping_file()
@@ -67,8 +140,28 @@ class EtlManager:
                     mappings_array[i]["sink"]["name"],
                     mappings_array[i]["sink"]["type"],
                     mappings_array[i]["sink"]["physicalType"],
+                    mappings_array[i]["sink"].get("precision"),
+                    mappings_array[i]["sink"].get("scale"),
                 )
                 data_mappings._column_mappings.append(column_mappings)
+            # Upsert keys follow the ADF AzureSqlSink upsertSettings, else
+            # the first mapped column. The table defaults to the output name.
+            sink = inputs[0]["typeProperties"].get("sink", {})
+            data_mappings._table_name = sink.get(
+                "tableName", os.path.splitext(destination_file)[0]
+            )
+            data_mappings._key_columns = sink.get("upsertSettings", {}).get(
+                "keys", [mappings_array[0]["sink"]["name"]]
+            )
+            data_mappings._indexes = sink.get("indexes", [])
+            data_mappings.compile_plan()
+
+            # Write then rename, concurrent jobs may parse the same mapping
+            os.makedirs(_PLAN_CACHE_DIR, exist_ok=True)
+            temp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+            with open(temp_file, "w") as f:
+                json.dump(data_mappings.to_dict(), f)
+            os.replace(temp_file, cache_file)
             return data_mappings
         except Exception as ex:
             print(ex)
@@ -84,21 +177,10 @@ class EtlManager:
         try:
             # Open source data file and load
             person_table = fromcsv(source_data_filename)
-            columns_to_cut = []
-            # Loop through source columns to know what to cut
-            for c in data_mappings._column_mappings:
-                columns_to_cut.append(c._source_column_name)
-            person_table = petl.cut(person_table, *columns_to_cut)
-            new_column_names = []
-            # Loop through destination columns to rename them
-            for c in data_mappings._column_mappings:
-                new_column_names.append(c._destination_column_name)
-
-            # Do the renaming of columns
-            for i in range(0, len(columns_to_cut)):
-                person_table = petl.rename(
-                    person_table, columns_to_cut[i], new_column_names[i]
-                )
+            plan = data_mappings._projection_plan
+            # One cut and one header swap, however many columns are mapped
+            person_table = petl.cut(person_table, *plan._source_columns)
+            person_table = petl.setheader(person_table, plan._output_header)
             petl.tocsv(
                 person_table,
                 ".//file_output//{}".format(data_mappings._destination_data_filename),
@@ -107,67 +189,664 @@ class EtlManager:
         except Exception as ex:
             print(ex)
 
-    def transform_and_load(self, input_file: str):
+    def transform_data_streaming(
+        self,
+        data_mappings: DataMappings,
+        progress_callback=None,
+        backend: str = _TRANSFORM_BACKEND,
+        output_format: str = _OUTPUT_FORMAT,
+    ) -> int:
+        """Same output as transform_data, written in fixed-size chunks so
+        memory stays flat regardless of the source file size.
+
+        backend is "csv" (row at a time) or "pandas" (vectorized columns).
+        The csv backend checkpoints its progress (see checkpoint_manager), so
+        a rerun after a crash continues where it stopped. output_format
+        "parquet" writes typed columns with the pandas backend instead.
+        """
 
+        source_data_filename = ".//file_input//{}".format(
+            data_mappings._source_data_filename
+        )
+        destination_data_filename = self.output_file_name(data_mappings, output_format)
         try:
-            db_manager = DBManager()
-            conn = db_manager.connect_to_db()
-            cursor = conn.cursor()
-            db_manager.create_table(conn.cursor())
-            db_manager.insert_data(conn, cursor, input_file)
-            conn.commit()
-            db_manager.show_data(
-                cursor,
-                "SELECT * FROM persons WHERE bodysite_code={}".format("51185008"),
-            )
-
-            conn.close()
+            transform_manager = TransformManager()
+            if output_format == "parquet":
+                return transform_manager.transform_file_parquet(
+                    source_data_filename,
+                    destination_data_filename,
+                    data_mappings._column_mappings,
+                    data_mappings._projection_plan,
+                    progress_callback,
+                )
+            if backend == "pandas":
+                return transform_manager.transform_file_pandas(
+                    source_data_filename,
+                    destination_data_filename,
+                    data_mappings._column_mappings,
+                    data_mappings._projection_plan,
+                    progress_callback,
+                )
+            return transform_manager.transform_file(
+                source_data_filename,
+                destination_data_filename,
+                data_mappings._projection_plan,
+                progress_callback,
+                self.checkpoint_manager(destination_data_filename),
+            )
         except Exception as ex:
             print(ex)
+        return None
 
+    def checkpoint_manager(self, output_file: str) -> CheckpointManager:
+        """Checkpoint of the transform writing output_file, beside it. In a
+        Batch task the container and its files go with the node, so it is
+        kept in blob storage with the output written so far and a task
+        retried on another node continues from it."""
+        if "AZ_BATCH_TASK_ID" not in os.environ:
+            return CheckpointManager("{}.checkpoint".format(output_file))
+        return BlobCheckpointManager(
+            self._blob_manager,
+            _STORAGE_CONNECTION_STRING,
+            "{}.checkpoint".format(os.path.basename(output_file)),
+        )
 
-if __name__ == "__main__":
-    """
-    The EtlManager will download a blob and then process it
-    """
+    def transform_data_parallel(
+        self, data_mappings: DataMappings, workers: int = None
+    ) -> int:
+        """Same output as transform_data, with byte ranges of the source file
+        transformed on all cores of the node"""
 
-    input_file = ".//file_input//{}".format(sys.argv[1])
-    mapping_file = ".//file_input//{}".format(sys.argv[2])
+        try:
+            transform_manager = TransformManager()
+            return transform_manager.transform_file_parallel(
+                ".//file_input//{}".format(data_mappings._source_data_filename),
+                ".//file_output//{}".format(data_mappings._destination_data_filename),
+                data_mappings._projection_plan,
+                workers or os.cpu_count(),
+            )
+        except Exception as ex:
+            print(ex)
+        return None
 
-    try:
-        etl_manager = EtlManager()
+    def transform_and_load(self, input_file: str, data_mappings: DataMappings) -> int:
+        """Upsert the transformed input_file into the table described by
+        data_mappings over parallel connections, creating the table on first
+        use. Returns the rows loaded, a failed load is printed and raised."""
+        try:
+            return DBManager().parallel_upsert_data(data_mappings, input_file)
+        except Exception as ex:
+            print(ex)
+            raise
+
+    def bind_data_file(self, data_mappings: DataMappings, data_file: str):
+        """Point data_mappings at data_file. When it is not the mapping's own
+        source, the output is named after data_file so that many files can
+        share one mapping."""
+        data_name = os.path.basename(data_file)
+        if data_name != data_mappings._source_data_filename:
+            data_mappings._source_data_filename = data_name
+            # person.csv.gz is transformed to person_transformed.csv
+            data_mappings._destination_data_filename = "{}_transformed.csv".format(
+                os.path.splitext(CompressionManager.strip_extension(data_name))[0]
+            )
+        return data_mappings
 
-        # Download person.csv and person_map.csv
-        input_file = etl_manager.download_blob_file(
-            _STORAGE_CONNECTION_STRING, _CONTAINER_NAME, input_file
+    def download_once(self, blob_name: str, downloads: dict):
+        """download_blob_file for blob_name from the input container, once
+        per downloads dict: concurrent calls for the same blob wait for the
+        first and share its result"""
+        with self._downloads_lock:
+            future = downloads.get(blob_name)
+            first = future is None
+            if first:
+                future = downloads[blob_name] = Future()
+        if first:
+            try:
+                future.set_result(
+                    self.download_blob_file(
+                        _STORAGE_CONNECTION_STRING,
+                        _CONTAINER_NAME,
+                        ".//file_input//{}".format(blob_name),
+                    )
+                )
+            except Exception as ex:
+                future.set_exception(ex)
+        return future.result()
+
+    def download_inputs(
+        self, data_file: str, mapping_file: str, mapping_downloads: dict = None
+    ):
+        """Download data_file and mapping_file from the input container.
+        Calls sharing a mapping_downloads dict download each mapping file
+        once, e.g. the jobs of a manifest."""
+        input_file = self.download_blob_file(
+            _STORAGE_CONNECTION_STRING,
+            _CONTAINER_NAME,
+            ".//file_input//{}".format(data_file),
         )
-        mapping_file = etl_manager.download_blob_file(
-            _STORAGE_CONNECTION_STRING, _CONTAINER_NAME, mapping_file
+        if mapping_downloads is None:
+            local_mapping_file = self.download_blob_file(
+                _STORAGE_CONNECTION_STRING,
+                _CONTAINER_NAME,
+                ".//file_input//{}".format(mapping_file),
+            )
+        else:
+            local_mapping_file = self.download_once(mapping_file, mapping_downloads)
+        if input_file is None or local_mapping_file is None:
+            raise RuntimeError(
+                "Unable to download {} or {} from container {}".format(
+                    data_file, mapping_file, _CONTAINER_NAME
+                )
+            )
+        return input_file, local_mapping_file
+
+    def transform_file(self, data_file: str, mapping_file: str):
+        """Parse mapping_file and transform data_file, both local paths.
+        Returns (output file, rows written)."""
+        data_mappings = self.parse_mapping_file(mapping_file)
+        if data_mappings is None:
+            raise RuntimeError("Unable to parse {}".format(mapping_file))
+        self.bind_data_file(data_mappings, data_file)
+        rows = self.transform_data_streaming(data_mappings)
+        if rows is None:
+            raise RuntimeError("Unable to transform {}".format(data_file))
+        return self.output_file_name(data_mappings), rows
+
+    def output_file_name(
+        self, data_mappings: DataMappings, output_format: str = _OUTPUT_FORMAT
+    ) -> str:
+        """Local output file of data_mappings. Parquet output keeps the csv
+        destination name with a .parquet extension."""
+        name = data_mappings._destination_data_filename
+        if output_format == "parquet":
+            name = "{}.parquet".format(os.path.splitext(name)[0])
+        return ".//file_output//{}".format(name)
+
+    def transform_shard(
+        self,
+        data_file: str,
+        mapping_file: str,
+        shard: int,
+        shards: int,
+        split: bool = True,
+    ):
+        """Transform one of shards newline aligned byte ranges of data_file,
+        both local paths, into its own part file with a header, so that Batch
+        tasks can split one large file. With split False, data_file holds
+        only the header and the shard's rows, as download_blob_shard writes
+        it. Returns (output file, rows written)."""
+        data_mappings = self.parse_mapping_file(mapping_file)
+        if data_mappings is None:
+            raise RuntimeError("Unable to parse {}".format(mapping_file))
+        self.bind_data_file(data_mappings, data_file)
+        output_file = ".//file_output//{}_part{:04d}.csv".format(
+            os.path.splitext(data_mappings._destination_data_filename)[0], shard
+        )
+        transform_manager = TransformManager()
+        index = shard if split else 0
+        header_line, ranges = transform_manager.split_ranges(
+            data_file, shards if split else 1
         )
+        # Small files split into fewer ranges than shards
+        start, end = ranges[index] if index < len(ranges) else (0, 0)
+        header = next(csv.reader([header_line.decode("utf-8")]))
+        rows = transform_manager.transform_range(
+            data_file,
+            start,
+            end,
+            header,
+            output_file,
+            data_mappings._projection_plan,
+            write_header=True,
+        )
+        return output_file, rows
 
-        if input_file is None or mapping_file is None:
-            print(
-                "[Failed file {}, Container {}]:[FAILURE] : Unable to download. ".format(
-                    _INPUT_FILE, _CONTAINER_NAME
+    def upload_outputs(self, output_file: str) -> str:
+        """Upload output_file to the output container and ADLS Gen2, raising
+        if either upload fails. Returns the name it is uploaded as."""
+        self.upload_blob_file(
+            _STORAGE_CONNECTION_STRING, "output", output_file, raise_errors=True
+        )
+        self.get_adls2_manager().upload_file(output_file, raise_errors=True)
+        print("[{}]:[INFO] : Transformed file uploaded... ".format(output_file))
+        return self._blob_manager.blob_name(output_file)
+
+    def job_cache_key(self, data_file: str, mapping_file: str):
+        """Manifest cache key for a job, from the content MD5 or ETag of the
+        data and mapping blobs, without downloading them, and the output
+        settings. None when either blob is missing."""
+        fingerprints = [
+            self._blob_manager.blob_fingerprint(
+                _STORAGE_CONNECTION_STRING, _CONTAINER_NAME, name
+            )
+            for name in (data_file, mapping_file)
+        ]
+        if None in fingerprints:
+            return None
+        return ManifestCache.key(
+            data_file,
+            mapping_file,
+            *fingerprints,
+            _OUTPUT_FORMAT,
+            _TRANSFER_COMPRESSION
+        )
+
+    def outputs_exist(self, cached: dict) -> bool:
+        """Whether the output of a cached result is still in the output
+        container and ADLS Gen2"""
+        output_blob = cached.get("output_blob")
+        if output_blob is None:
+            return False
+        fingerprint = self._blob_manager.blob_fingerprint(
+            _STORAGE_CONNECTION_STRING, "output", output_blob
+        )
+        return fingerprint is not None and self.get_adls2_manager().file_exists(
+            output_blob
+        )
+
+    def cached_result(self, data_file: str, mapping_file: str):
+        """(cache key, cached result or None) for a job. A result whose
+        output has since been removed, or a failed lookup, is a miss, so the
+        job runs again."""
+        key = None
+        try:
+            key = self.job_cache_key(data_file, mapping_file)
+            if key is None:
+                return None, None
+            cached = self._manifest_cache.get(key)
+            if cached is not None and not self.outputs_exist(cached):
+                cached = None
+        except Exception as ex:
+            print(ex)
+            return key, None
+        return key, cached
+
+    def record_result(self, key: str, output_file: str, rows: int, output_blob: str):
+        """Store a job's result in the manifest cache. The output is already
+        uploaded, so a failure to store it is only printed."""
+        if key is None:
+            return
+        try:
+            self._manifest_cache.put(
+                key,
+                {"output_file": output_file, "rows": rows, "output_blob": output_blob},
+            )
+        except Exception as ex:
+            print(ex)
+
+    def local_inputs(self, *names: str) -> list:
+        """Paths of the named inputs already staged in file_input, e.g. as
+        Batch resource files"""
+        paths = [".//file_input//{}".format(name) for name in names]
+        for path in paths:
+            if not os.path.exists(path):
+                raise RuntimeError("Input {} is not staged".format(path))
+        os.makedirs(".//file_output", exist_ok=True)
+        return paths
+
+    def run_job(
+        self, data_file: str, mapping_file: str, inputs_local: bool = False
+    ) -> dict:
+        """Download, transform and upload one data file. Returns a result
+        summary for the file.
+
+        With inputs_local the inputs are already in file_input and the output
+        is left in file_output, for Batch resource and output files."""
+        result = {"data_file": data_file, "mapping_file": mapping_file}
+        start = time.perf_counter()
+        try:
+            if inputs_local:
+                # AzureBatchManager only runs jobs without a cached result
+                input_file, local_mapping_file = self.local_inputs(
+                    data_file, mapping_file
                 )
+            else:
+                # Unchanged inputs were already transformed and uploaded
+                key, cached = self.cached_result(data_file, mapping_file)
+                if cached is not None:
+                    result.update(cached, status="cached")
+                    result["seconds"] = round(time.perf_counter() - start, 3)
+                    return result
+                input_file, local_mapping_file = self.download_inputs(
+                    data_file, mapping_file
+                )
+            output_file, rows = self.transform_file(input_file, local_mapping_file)
+            if inputs_local:
+                # Batch uploads the output as it is once the task succeeds.
+                # Until then, or if that fails, the result is not a hit.
+                output_blob = os.path.basename(output_file)
+                try:
+                    key = self.job_cache_key(data_file, mapping_file)
+                except Exception as ex:
+                    print(ex)
+                    key = None
+            else:
+                output_blob = self.upload_outputs(output_file)
+            self.record_result(key, output_file, rows, output_blob)
+            result.update(status="success", output_file=output_file, rows=rows)
+        except Exception as ex:
+            print(ex)
+            result.update(status="failed", error=str(ex))
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def run_job_shard(
+        self,
+        data_file: str,
+        mapping_file: str,
+        shard: int,
+        shards: int,
+        inputs_local: bool = False,
+    ) -> dict:
+        """run_job for one shard of data_file, see transform_shard. Only the
+        shard's byte range of data_file is downloaded; with inputs_local the
+        mapping file is already staged."""
+        result = {"data_file": data_file, "mapping_file": mapping_file}
+        start = time.perf_counter()
+        try:
+            if inputs_local:
+                (mapping_file,) = self.local_inputs(mapping_file)
+            else:
+                mapping_file = self.download_blob_file(
+                    _STORAGE_CONNECTION_STRING,
+                    _CONTAINER_NAME,
+                    ".//file_input//{}".format(mapping_file),
+                )
+            input_file = self.download_blob_shard(
+                _STORAGE_CONNECTION_STRING,
+                _CONTAINER_NAME,
+                ".//file_input//{}".format(data_file),
+                shard,
+                shards,
             )
-            exit()
+            if input_file is None or mapping_file is None:
+                raise RuntimeError(
+                    "Unable to download shard {} of {} or {} from container {}".format(
+                        shard, data_file, result["mapping_file"], _CONTAINER_NAME
+                    )
+                )
+            output_file, rows = self.transform_shard(
+                input_file, mapping_file, shard, shards, split=False
+            )
+            if not inputs_local:
+                self.upload_outputs(output_file)
+            result.update(status="success", output_file=output_file, rows=rows)
+        except Exception as ex:
+            print(ex)
+            result.update(status="failed", error=str(ex))
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def run_job_streaming(self, data_file: str, mapping_file: str) -> dict:
+        """Like run_job, without writing the data to local disk: the blob
+        download feeds the transform directly and the transformed csv is
+        uploaded to the output container and ADLS Gen2 as it is produced.
+        Only the small mapping file is downloaded."""
+        result = {"data_file": data_file, "mapping_file": mapping_file}
+        start = time.perf_counter()
+        try:
+            mapping_file = self.download_blob_file(
+                _STORAGE_CONNECTION_STRING,
+                _CONTAINER_NAME,
+                ".//file_input//{}".format(mapping_file),
+            )
+            data_mappings = self.parse_mapping_file(mapping_file)
+            if data_mappings is None:
+                raise RuntimeError("Unable to parse {}".format(mapping_file))
+            self.bind_data_file(data_mappings, data_file)
+            output_name = data_mappings._destination_data_filename
+
+            rows = []
+            transform_manager = TransformManager()
+            output_chunks = transform_manager.transform_stream(
+                self._blob_manager.iter_blob_chunks(
+                    _STORAGE_CONNECTION_STRING, _CONTAINER_NAME, data_file
+                ),
+                data_mappings._projection_plan,
+                lambda rows_written, bytes_read: rows.append(rows_written),
+            )
+            adls2_manager = self.get_adls2_manager()
+            transform_manager.fan_out(
+                output_chunks,
+                [
+                    lambda chunks: self._blob_manager.upload_blob_stream(
+                        _STORAGE_CONNECTION_STRING, "output", output_name, chunks
+                    ),
+                    lambda chunks: adls2_manager.upload_stream(output_name, chunks),
+                ],
+            )
+            print("[{}]:[INFO] : Transformed file uploaded... ".format(output_name))
+            result.update(
+                status="success", output_file=output_name, rows=rows[-1] if rows else 0
+            )
+        except Exception as ex:
+            print(ex)
+            result.update(status="failed", error=str(ex))
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
 
-        data_mappings = etl_manager.parse_mapping_file(mapping_file)
-        etl_manager.transform_data(data_mappings)
+    def transform_fan_out(
+        self, data_mappings: DataMappings, source_chunks, db_manager=None, upload=True
+    ) -> int:
+        """Parse the source once and tee the transformed rows, concurrently, to
+        the local output csv, the mapped table (when db_manager is given) and
+        the output container and ADLS Gen2 (when upload is set).
 
-        output_file = ".//file_output//{}".format("person_transformed.csv")
-        result = etl_manager.upload_blob_file(
-            _STORAGE_CONNECTION_STRING, "output", output_file
+        source_chunks is the source csv as an iterable of byte strings. Bounded
+        queues between the parser and the sinks keep memory flat: the slowest
+        sink sets the pace. Returns the number of rows transformed.
+        """
+        output_name = data_mappings._destination_data_filename
+        sink_manager = SinkManager()
+        sinks = [sink_manager.csv_file_sink(".//file_output//{}".format(output_name))]
+        if db_manager is not None:
+            sinks.append(sink_manager.db_sink(db_manager, data_mappings))
+        if upload:
+            sinks.append(
+                sink_manager.blob_sink(
+                    self._blob_manager, _STORAGE_CONNECTION_STRING, "output", output_name
+                )
+            )
+            sinks.append(sink_manager.adls_sink(self.get_adls2_manager(), output_name))
+
+        rows = []
+        transform_manager = TransformManager()
+        transform_manager.fan_out(
+            transform_manager.project_chunks(
+                source_chunks,
+                data_mappings._projection_plan,
+                lambda rows_written, bytes_read: rows.append(rows_written),
+            ),
+            sinks,
         )
+        return rows[-1] if rows else 0
+
+    def run_job_fan_out(self, data_file: str, mapping_file: str) -> dict:
+        """Stream data_file from blob storage through one transform pass into
+        the local csv, the database, the output container and ADLS Gen2"""
+        result = {"data_file": data_file, "mapping_file": mapping_file}
+        start = time.perf_counter()
+        try:
+            mapping_file = self.download_blob_file(
+                _STORAGE_CONNECTION_STRING,
+                _CONTAINER_NAME,
+                ".//file_input//{}".format(mapping_file),
+            )
+            data_mappings = self.parse_mapping_file(mapping_file)
+            if data_mappings is None:
+                raise RuntimeError("Unable to parse {}".format(mapping_file))
+            self.bind_data_file(data_mappings, data_file)
+            rows = self.transform_fan_out(
+                data_mappings,
+                self._blob_manager.iter_blob_chunks(
+                    _STORAGE_CONNECTION_STRING, _CONTAINER_NAME, data_file
+                ),
+                DBManager(),
+            )
+            result.update(
+                status="success",
+                output_file=data_mappings._destination_data_filename,
+                rows=rows,
+            )
+        except Exception as ex:
+            print(ex)
+            result.update(status="failed", error=str(ex))
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
 
-        adls2_manager = ADLS2Manager()
-        adls2_manager.connect_adls_gen2()
-        file_name = "./file_output/person_transformed.csv"
-        adls2_manager.upload_file(file_name)
+    def expand_manifest(self, entries: list) -> list:
+        """Expand manifest entries into (data_file, mapping_file) pairs.
 
-        print("[{}]:[INFO] : Transformed file uploaded... ".format(output_file))
-    except Exception as e:
-        print(e)
+        An entry is {"data_file": ..., "mapping_file": ...}; a data_file with
+        glob characters is matched against the blobs in the input container.
+        """
+        pairs = []
+        for entry in entries:
+            data_file = entry["data_file"]
+            if any(char in data_file for char in "*?["):
+                data_files = self._blob_manager.list_blob_names(
+                    _STORAGE_CONNECTION_STRING, _CONTAINER_NAME, data_file
+                )
+            else:
+                data_files = [data_file]
+            pairs.extend((name, entry["mapping_file"]) for name in data_files)
+        return pairs
+
+    def run_manifest(
+        self,
+        pairs: list,
+        io_workers: int = _MANIFEST_IO_WORKERS,
+        transform_workers: int = _MANIFEST_TRANSFORM_WORKERS,
+    ) -> list:
+        """Run many (data_file, mapping_file) pairs in one process.
+
+        Downloads and uploads run on a thread pool, transforms on a process
+        pool, and each file moves to its next stage as soon as the previous
+        one finishes. Pairs whose inputs are unchanged since a successful run
+        are not run again. Returns one result summary per pair, in input order.
+        """
+        results = [
+            {"data_file": data_file, "mapping_file": mapping_file, "status": "pending"}
+            for data_file, mapping_file in pairs
+        ]
+        started = [time.perf_counter()] * len(pairs)
+        cache_keys = [None] * len(pairs)
+        # Pairs often share a mapping file, download it once for all of them
+        mapping_downloads = {}
+        io_pool = ThreadPoolExecutor(max_workers=io_workers)
+        transform_pool = ProcessPoolExecutor(max_workers=transform_workers)
+        with io_pool, transform_pool:
+            pending = {}
+            for i, (data_file, mapping_file) in enumerate(pairs):
+                started[i] = time.perf_counter()
+                future = io_pool.submit(self.cached_result, data_file, mapping_file)
+                pending[future] = ("check", i)
 
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, i = pending.pop(future)
+                    result = results[i]
+                    try:
+                        value = future.result()
+                    except Exception as ex:
+                        print(ex)
+                        result.update(status="failed", stage=stage, error=str(ex))
+                        result["seconds"] = round(time.perf_counter() - started[i], 3)
+                        continue
+                    if stage == "check":
+                        cache_keys[i], cached = value
+                        if cached is not None:
+                            result.update(cached, status="cached")
+                            result["seconds"] = round(
+                                time.perf_counter() - started[i], 3
+                            )
+                            continue
+                        next_future = io_pool.submit(
+                            self.download_inputs, *pairs[i], mapping_downloads
+                        )
+                        pending[next_future] = ("download", i)
+                    elif stage == "download":
+                        next_future = transform_pool.submit(_transform_file, *value)
+                        pending[next_future] = ("transform", i)
+                    elif stage == "transform":
+                        result["output_file"], result["rows"] = value
+                        next_future = io_pool.submit(
+                            self.upload_outputs, result["output_file"]
+                        )
+                        pending[next_future] = ("upload", i)
+                    else:
+                        result["status"] = "success"
+                        result["seconds"] = round(time.perf_counter() - started[i], 3)
+                        self.record_result(
+                            cache_keys[i], result["output_file"], result["rows"], value
+                        )
+        return results
+
+    def print_results(self, results: list):
+        """Print a one line summary per file"""
+        for result in results:
+            print(
+                "[{}]:[{}] : {} ({} rows, {}s) {}".format(
+                    datetime.datetime.utcnow(),
+                    result["status"].upper(),
+                    result["data_file"],
+                    result.get("rows", 0),
+                    result.get("seconds", 0),
+                    result.get("error", ""),
+                )
+            )
 
+
+def _transform_file(data_file: str, mapping_file: str):
+    """Process pool entry point for EtlManager.transform_file"""
+    return EtlManager().transform_file(data_file, mapping_file)
+
+
+if __name__ == "__main__":
+    """
+    The EtlManager will download a blob and then process it
+
+    etl_manager.py <data_file> <mapping_file>
+    etl_manager.py --stream <data_file> <mapping_file>
+    etl_manager.py --fan-out <data_file> <mapping_file>
+    etl_manager.py --shard <shard> <shards> <data_file> <mapping_file>
+    etl_manager.py --manifest <manifest.json>
+
+    With --local first, e.g. etl_manager.py --local <data_file> <mapping_file>,
+    the inputs are read from file_input and the output left in file_output,
+    both in the Batch task working directory when there is one.
+    """
+
+    try:
+        etl_manager = EtlManager()
+        args = sys.argv[1:]
+        inputs_local = args[0] == "--local"
+        if inputs_local:
+            args = args[1:]
+            # Batch resource and output files live in the task directory
+            os.chdir(os.environ.get("AZ_BATCH_TASK_WORKING_DIR", "."))
+
+        if args[0] == "--manifest":
+            with open(args[1]) as f:
+                pairs = etl_manager.expand_manifest(json.load(f))
+            results = etl_manager.run_manifest(pairs)
+        elif args[0] == "--shard":
+            results = [
+                etl_manager.run_job_shard(
+                    args[3], args[4], int(args[1]), int(args[2]), inputs_local
+                )
+            ]
+        elif args[0] == "--fan-out":
+            results = [etl_manager.run_job_fan_out(args[1], args[2])]
+        elif args[0] == "--stream":
+            results = [etl_manager.run_job_streaming(args[1], args[2])]
+        else:
+            results = [etl_manager.run_job(args[0], args[1], inputs_local)]
+        etl_manager.print_results(results)
+        if inputs_local and any(r["status"] != "success" for r in results):
+            # A failed task must not have its outputs uploaded
+            sys.exit(1)
+    except Exception as e:
+        print(e)
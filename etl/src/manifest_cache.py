@@ -0,0 +1,142 @@
+"""ManifestCache: Results of jobs whose inputs have not changed"""
+from __future__ import print_function
+import hashlib
+import json
+import os
+import threading
+import time
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from etl.config.general import (
+    _MANIFEST_CACHE_CONTAINER,
+    _MANIFEST_CACHE_DIR,
+    _MANIFEST_CACHE_MAX_ENTRIES,
+    _MANIFEST_CACHE_TTL_SECONDS,
+)
+
+
+class ManifestCache:
+    """Job results keyed by fingerprints of the job inputs, one json file
+    per entry in cache_dir.
+
+    Entries expire ttl_seconds after they were stored. Beyond max_entries
+    the least recently used are evicted, a hit refreshes the entry's
+    modification time.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = _MANIFEST_CACHE_DIR,
+        max_entries: int = _MANIFEST_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = _MANIFEST_CACHE_TTL_SECONDS,
+    ):
+        super().__init__()
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Cache key for the given input names and fingerprints"""
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, "{}.json".format(key))
+
+    def get(self, key: str):
+        """The value stored for key, or None if missing or expired"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["stored_at"] > self._ttl_seconds:
+            self._remove(path)
+            return None
+        # Recently used entries are evicted last
+        os.utime(path)
+        return entry["value"]
+
+    def put(self, key: str, value):
+        """Store value for key, evicting old entries"""
+        os.makedirs(self._cache_dir, exist_ok=True)
+        path = self._path(key)
+        # Write then rename, concurrent jobs may store the same key
+        temp_file = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(temp_file, "w") as f:
+            json.dump({"stored_at": time.time(), "value": value}, f)
+        os.replace(temp_file, path)
+        self.evict()
+
+    def evict(self):
+        """Drop entries unused for ttl_seconds, then the least recently used
+        beyond max_entries. Entries used since they expired are dropped by
+        get."""
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self._cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                used_at = entry.stat().st_mtime
+            except OSError:
+                continue
+            if now - used_at > self._ttl_seconds:
+                self._remove(entry.path)
+            else:
+                entries.append((used_at, entry.path))
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self._max_entries)]:
+            self._remove(path)
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class BlobManifestCache(ManifestCache):
+    """ManifestCache with one json blob per entry in container_name, shared
+    by the machines that submit jobs and the Batch tasks that run them.
+
+    Entries expire ttl_seconds after they were stored. Expired blobs are
+    overwritten by the next put, or left to the container's lifecycle
+    management policy.
+    """
+
+    def __init__(
+        self,
+        blob_manager,
+        storage_account_connection_string: str,
+        container_name: str = _MANIFEST_CACHE_CONTAINER,
+        ttl_seconds: float = _MANIFEST_CACHE_TTL_SECONDS,
+    ):
+        super().__init__(ttl_seconds=ttl_seconds)
+        self._blob_manager = blob_manager
+        self._storage_account_connection_string = storage_account_connection_string
+        self._container_name = container_name
+
+    def _blob_client(self, key: str):
+        return self._blob_manager.get_container_client(
+            self._storage_account_connection_string, self._container_name, create=True
+        ).get_blob_client("{}.json".format(key))
+
+    def get(self, key: str):
+        """The value stored for key, or None if missing or expired"""
+        try:
+            entry = json.loads(self._blob_client(key).download_blob().readall())
+        except (ResourceNotFoundError, ValueError):
+            return None
+        if time.time() - entry["stored_at"] > self._ttl_seconds:
+            return None
+        return entry["value"]
+
+    def put(self, key: str, value):
+        """Store value for key"""
+        self._blob_client(key).upload_blob(
+            json.dumps({"stored_at": time.time(), "value": value}).encode("utf-8"),
+            overwrite=True,
+        )
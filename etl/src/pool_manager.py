@@ -0,0 +1,228 @@
+"""PoolManager: Sizing the Batch pool to the pending work"""
+from __future__ import print_function
+import datetime
+import json
+import math
+import os
+import time
+
+import azure.batch.models as batchmodels
+
+from etl.config.general import (
+    _POOL_DEFAULT_TASK_SECONDS,
+    _POOL_IDLE_MINUTES,
+    _POOL_LOW_PRIORITY_RATIO,
+    _POOL_MAX_DEDICATED_NODES,
+    _POOL_MAX_LOW_PRIORITY_NODES,
+    _POOL_RESIZE_POLL_SECONDS,
+    _POOL_RESIZE_WAIT_SECONDS,
+    _POOL_TARGET_SECONDS,
+    _POOL_TASK_SLOTS_PER_NODE,
+    _POOL_TIMINGS_FILE,
+    _POOL_TIMINGS_KEPT,
+)
+
+
+class PoolManager:
+    """Compute pool node targets from the pending task count and observed
+    task durations, and apply them to a new or warm pool.
+
+    Enough nodes are requested to finish the pending tasks within
+    target_seconds, never more than the tasks can fill. A share of them,
+    low_priority_ratio, is requested as cheaper low-priority nodes.
+    """
+
+    def __init__(
+        self,
+        task_slots_per_node: int = _POOL_TASK_SLOTS_PER_NODE,
+        max_dedicated_nodes: int = _POOL_MAX_DEDICATED_NODES,
+        max_low_priority_nodes: int = _POOL_MAX_LOW_PRIORITY_NODES,
+        low_priority_ratio: float = _POOL_LOW_PRIORITY_RATIO,
+        target_seconds: float = _POOL_TARGET_SECONDS,
+        task_seconds: list = None,
+    ):
+        super().__init__()
+        self._task_slots_per_node = task_slots_per_node
+        self._max_dedicated_nodes = max_dedicated_nodes
+        self._max_low_priority_nodes = max_low_priority_nodes
+        self._low_priority_ratio = low_priority_ratio
+        self._target_seconds = target_seconds
+        self._task_seconds = list(task_seconds or [])
+
+    def load_timings(self, timings_file: str = _POOL_TIMINGS_FILE):
+        """Load task durations recorded by earlier runs"""
+        if os.path.exists(timings_file):
+            with open(timings_file) as f:
+                self._task_seconds = json.load(f)[-_POOL_TIMINGS_KEPT:]
+        return self
+
+    def save_timings(self, timings_file: str = _POOL_TIMINGS_FILE):
+        with open(timings_file, "w") as f:
+            json.dump(self._task_seconds[-_POOL_TIMINGS_KEPT:], f)
+
+    def record_task(self, task):
+        """Record the duration of a completed task, usable as the
+        on_task_completed callback of wait_for_tasks_to_complete"""
+        info = task.execution_info
+        if info is not None and info.start_time and info.end_time:
+            seconds = (info.end_time - info.start_time).total_seconds()
+            self._task_seconds.append(seconds)
+
+    def mean_task_seconds(self) -> float:
+        if not self._task_seconds:
+            return _POOL_DEFAULT_TASK_SECONDS
+        return sum(self._task_seconds) / len(self._task_seconds)
+
+    def target_nodes(self, pending_tasks: int):
+        """Return (dedicated, low-priority) nodes for pending_tasks, (0, 0)
+        when idle"""
+        nodes = min(
+            math.ceil(
+                pending_tasks
+                * self.mean_task_seconds()
+                / (self._target_seconds * self._task_slots_per_node)
+            ),
+            math.ceil(pending_tasks / self._task_slots_per_node),
+        )
+        low_priority = min(
+            math.floor(nodes * self._low_priority_ratio), self._max_low_priority_nodes
+        )
+        dedicated = min(nodes - low_priority, self._max_dedicated_nodes)
+        return dedicated, low_priority
+
+    def autoscale_formula(self) -> str:
+        """The same sizing as an autoscale formula over $PendingTasks, which
+        the Batch service evaluates as the queue changes"""
+        return (
+            "$samples = $PendingTasks.GetSamplePercent(TimeInterval_Minute * 5);\n"
+            "$tasks = $samples < 70 ? max(0, $PendingTasks.GetSample(1)) : "
+            "max($PendingTasks.GetSample(1), "
+            "avg($PendingTasks.GetSample(TimeInterval_Minute * 5)));\n"
+            "$nodes = min(ceil($tasks * {seconds} / ({target} * {slots})), "
+            "ceil($tasks / {slots}));\n"
+            "$lowPriority = min({max_low_priority}, floor($nodes * {ratio}));\n"
+            "$TargetLowPriorityNodes = $lowPriority;\n"
+            "$TargetDedicatedNodes = min({max_dedicated}, $nodes - $lowPriority);\n"
+            "$NodeDeallocationOption = taskcompletion;"
+        ).format(
+            seconds=round(self.mean_task_seconds(), 3),
+            target=self._target_seconds,
+            slots=self._task_slots_per_node,
+            max_low_priority=self._max_low_priority_nodes,
+            ratio=self._low_priority_ratio,
+            max_dedicated=self._max_dedicated_nodes,
+        )
+
+    def idle_formula(self, target: tuple, idle_minutes: int = _POOL_IDLE_MINUTES):
+        """Autoscale formula keeping the (dedicated, low-priority) target
+        while tasks are pending, and scaling to zero once none have been for
+        idle_minutes"""
+        return (
+            "$samples = "
+            "$PendingTasks.GetSamplePercent(TimeInterval_Minute * {minutes});\n"
+            "$busy = $samples < 70 ? 1 : "
+            "max($PendingTasks.GetSample(TimeInterval_Minute * {minutes}));\n"
+            "$TargetDedicatedNodes = $busy > 0 ? {dedicated} : 0;\n"
+            "$TargetLowPriorityNodes = $busy > 0 ? {low_priority} : 0;\n"
+            "$NodeDeallocationOption = taskcompletion;"
+        ).format(
+            minutes=idle_minutes, dedicated=target[0], low_priority=target[1]
+        )
+
+    def wait_until_steady(
+        self,
+        batch_service_client,
+        pool_id: str,
+        timeout_seconds: float = _POOL_RESIZE_WAIT_SECONDS,
+    ):
+        """The pool once its allocation state is steady, polling every
+        _POOL_RESIZE_POLL_SECONDS, or None after timeout_seconds"""
+        pool = batch_service_client.pool.get(pool_id)
+        waited = 0
+        while pool.allocation_state != batchmodels.AllocationState.steady:
+            if waited >= timeout_seconds:
+                return None
+            print("Pool [{}] is still resizing...".format(pool_id))
+            time.sleep(_POOL_RESIZE_POLL_SECONDS)
+            waited += _POOL_RESIZE_POLL_SECONDS
+            pool = batch_service_client.pool.get(pool_id)
+        return pool
+
+    def scale_down_when_idle(
+        self, batch_service_client, pool_id: str, idle_minutes: int = _POOL_IDLE_MINUTES
+    ):
+        """Leave the pool at its current size for the next run, with an
+        autoscale formula that removes its nodes after idle_minutes without
+        tasks. The next apply replaces the formula."""
+        pool = self.wait_until_steady(batch_service_client, pool_id)
+        if pool is None:
+            print(
+                "[WARNING] : Pool [{}] did not become steady, "
+                "not scheduling its scale down".format(pool_id)
+            )
+            return False
+        if pool.enable_auto_scale:
+            # A formula sized by pending tasks scales down by itself
+            return True
+        print(
+            "Pool [{}] scales down after {} idle minutes...".format(
+                pool_id, idle_minutes
+            )
+        )
+        batch_service_client.pool.enable_auto_scale(
+            pool_id,
+            auto_scale_formula=self.idle_formula(
+                (pool.target_dedicated_nodes, pool.target_low_priority_nodes),
+                idle_minutes,
+            ),
+            auto_scale_evaluation_interval=datetime.timedelta(minutes=5),
+        )
+        return True
+
+    def apply(
+        self, batch_service_client, pool_id: str, pending_tasks: int, autoscale=False
+    ):
+        """Size an existing pool for pending_tasks, by autoscale formula or
+        by resizing. A pool that is resizing is waited for first. Returns the
+        (dedicated, low-priority) target, or None when the pool is left to
+        its autoscale formula or did not become steady."""
+        pool = batch_service_client.pool.get(pool_id)
+        if autoscale:
+            print("Enabling autoscale on pool [{}]...".format(pool_id))
+            batch_service_client.pool.enable_auto_scale(
+                pool_id,
+                auto_scale_formula=self.autoscale_formula(),
+                auto_scale_evaluation_interval=datetime.timedelta(minutes=5),
+            )
+            return None
+
+        if pool.enable_auto_scale:
+            batch_service_client.pool.disable_auto_scale(pool_id)
+        target = self.target_nodes(pending_tasks)
+        if target == (pool.target_dedicated_nodes, pool.target_low_priority_nodes):
+            return target
+        if pool.allocation_state != batchmodels.AllocationState.steady:
+            # Only a steady pool can be resized
+            if self.wait_until_steady(batch_service_client, pool_id) is None:
+                print(
+                    "[WARNING] : Pool [{}] is still resizing, not resized to {} "
+                    "dedicated, {} low-priority nodes".format(pool_id, *target)
+                )
+                return None
+        print(
+            "Resizing pool [{}] to {} dedicated, {} low-priority nodes...".format(
+                pool_id, *target
+            )
+        )
+        batch_service_client.pool.resize(
+            pool_id,
+            batchmodels.PoolResizeParameter(
+                target_dedicated_nodes=target[0],
+                target_low_priority_nodes=target[1],
+                # Let running tasks finish on nodes being removed
+                node_deallocation_option=(
+                    batchmodels.ComputeNodeDeallocationOption.task_completion
+                ),
+            ),
+        )
+        return target
@@ -0,0 +1,81 @@
+"""SinkManager: Destinations for one pass of transformed rows"""
+from __future__ import print_function
+
+
+class SinkManager:
+    """Build consumers for TransformManager.fan_out.
+
+    Each sink takes an iterable of (projected rows, csv bytes) pairs, as
+    produced by TransformManager.project_chunks, and returns a count.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def csv_file_sink(self, output_file: str):
+        """Write the csv bytes to output_file"""
+
+        def sink(items):
+            bytes_written = 0
+            with open(output_file, "wb") as f:
+                for _, data in items:
+                    f.write(data)
+                    bytes_written += len(data)
+            return bytes_written
+
+        return sink
+
+    def blob_sink(
+        self,
+        blob_manager,
+        storage_account_connection_string: str,
+        container_name: str,
+        blob_name: str,
+    ):
+        """Stream the csv bytes to a blob"""
+
+        def sink(items):
+            return blob_manager.upload_blob_stream(
+                storage_account_connection_string,
+                container_name,
+                blob_name,
+                (data for _, data in items),
+            )
+
+        return sink
+
+    def adls_sink(self, adls2_manager, file_name: str):
+        """Stream the csv bytes to ADLS Gen2"""
+
+        def sink(items):
+            return adls2_manager.upload_stream(file_name, (data for _, data in items))
+
+        return sink
+
+    def db_sink(self, db_manager, data_mappings):
+        """Upsert the projected rows into the table described by data_mappings,
+        then build its declared indexes.
+
+        The connection is opened on the sink's own thread, as database
+        connections (sqlite3 in particular) are tied to the creating thread.
+        """
+
+        def sink(items):
+            conn = db_manager.connect_to_db()
+            try:
+                cursor = conn.cursor()
+                db_manager.create_mapped_table(cursor, data_mappings)
+                row_count = db_manager.upsert_rows(
+                    conn,
+                    cursor,
+                    data_mappings._table_name,
+                    list(data_mappings._projection_plan._output_header),
+                    data_mappings._key_columns,
+                    (row for rows, _ in items for row in rows),
+                )
+                db_manager.create_mapped_indexes(conn, cursor, data_mappings)
+                return row_count
+            finally:
+                conn.close()
+
+        return sink
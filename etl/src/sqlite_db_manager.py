@@ -0,0 +1,161 @@
+"""Local SQLite stand-in for the Azure SQL database"""
+from __future__ import print_function
+import sqlite3
+
+from etl.config.general import _BULK_INSERT_BATCH_SIZE, _BULK_INSERT_COMMIT_EVERY
+from etl.src.bulk_load_manager import BulkLoadManager
+from etl.src.db_manager_interface import DBManagerInterface
+
+
+class SqliteDBManager(BulkLoadManager, DBManagerInterface):
+    """Run DBManager workloads against SQLite, without Azure SQL"""
+
+    _PLACEHOLDER = "?"
+    _MAX_PARAMETERS = 999
+    _USE_EXECUTEMANY = True
+    _PHYSICAL_TYPES = {
+        "string": "TEXT",
+        "nvarchar": "TEXT",
+        "varchar": "TEXT",
+        "guid": "TEXT",
+        "uniqueidentifier": "TEXT",
+        "datetime": "TEXT",
+        "datetime2": "TEXT",
+        "date": "TEXT",
+        "datetimeoffset": "TEXT",
+        "byte": "INTEGER",
+        "tinyint": "INTEGER",
+        "int16": "INTEGER",
+        "smallint": "INTEGER",
+        "int32": "INTEGER",
+        "int": "INTEGER",
+        "int64": "INTEGER",
+        "bigint": "INTEGER",
+        "single": "REAL",
+        "real": "REAL",
+        "double": "REAL",
+        "float": "REAL",
+        "decimal": "NUMERIC",
+        "numeric": "NUMERIC",
+        "money": "NUMERIC",
+        "boolean": "INTEGER",
+        "bit": "INTEGER",
+    }
+    _CREATE_TABLE_IF_MISSING = "CREATE TABLE IF NOT EXISTS {table} ({columns})"
+    _CREATE_INDEX_IF_MISSING = "CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+
+    # Seconds a connection waits for another's write lock, SQLite runs one
+    # writer at a time
+    _BUSY_TIMEOUT = 60
+
+    def __init__(self, database: str = ":memory:"):
+        super().__init__()
+        self._database = database
+
+    def connect_to_db(self):
+        try:
+            # Pooled connections move between loader threads, one at a time.
+            # Each connection to ":memory:" is a separate database, so
+            # parallel loads need a database file.
+            conn = sqlite3.connect(
+                self._database, timeout=self._BUSY_TIMEOUT, check_same_thread=False
+            )
+            print("Connected to {}!".format(self._database))
+            return conn
+        except Exception as ex:
+            print(ex)
+
+    def create_table(self, cursor):
+        try:
+            cursor.execute("DROP TABLE IF EXISTS persons")
+            cursor.execute(
+                """
+                CREATE TABLE persons (
+                        id varchar(40),
+                        date datetime,
+                        bodysite_code varchar(50),
+                        modality_description VARCHAR(100),
+                        PRIMARY KEY(id)
+                )
+                """
+            )
+            print("Table created...")
+        except Exception as ex:
+            print(ex)
+
+    def insert_data(self, conn, cursor, input_file, checkpoint=None):
+        # One bound statement per row, the unbatched baseline
+        return self.bulk_insert_data(
+            conn, cursor, input_file, batch_size=1, checkpoint=checkpoint
+        )
+
+    def upsert_rows(
+        self,
+        conn,
+        cursor,
+        table_name,
+        columns,
+        key_columns,
+        rows,
+        batch_size=_BULK_INSERT_BATCH_SIZE,
+        commit_every=_BULK_INSERT_COMMIT_EVERY,
+    ):
+        """Upsert with INSERT ... ON CONFLICT, SQLite has no MERGE"""
+        updates = [c for c in columns if c not in key_columns]
+        if updates:
+            action = "DO UPDATE SET {}".format(
+                ",".join("{0} = excluded.{0}".format(c) for c in updates)
+            )
+        else:
+            action = "DO NOTHING"
+        return self.bulk_insert_rows(
+            conn,
+            cursor,
+            table_name,
+            columns,
+            rows,
+            batch_size,
+            commit_every,
+            statement_suffix=" ON CONFLICT ({}) {}".format(
+                ",".join(key_columns), action
+            ),
+        )
+
+    def create_staging_table(self, cursor, staging_table, table_name, columns):
+        """Staged rows keep their load order in rowid"""
+        cursor.execute(
+            "CREATE TABLE {} AS SELECT {} FROM {} WHERE 0".format(
+                staging_table, ",".join(columns), table_name
+            )
+        )
+
+    def merge_staging_table(
+        self, cursor, staging_table, table_name, columns, key_columns
+    ):
+        updates = [c for c in columns if c not in key_columns]
+        if updates:
+            action = "DO UPDATE SET {}".format(
+                ",".join("{0} = excluded.{0}".format(c) for c in updates)
+            )
+        else:
+            action = "DO NOTHING"
+        # WHERE true keeps ON CONFLICT from parsing as part of the SELECT
+        cursor.execute(
+            "INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+            "WHERE true ORDER BY rowid ON CONFLICT ({keys}) {action}".format(
+                table=table_name,
+                staging=staging_table,
+                columns=",".join(columns),
+                keys=",".join(key_columns),
+                action=action,
+            )
+        )
+
+    def show_data(self, cursor, query, params=()):
+        try:
+            for row in self.query_rows(cursor, query, params):
+                print("ID=%s, bodysite_code=%s" % (row[0], row[2]))
+
+        except Exception as ex:
+            print(query)
+            print(ex)
@@ -0,0 +1,608 @@
+"""TransformManager: Streaming csv column projection"""
+from __future__ import print_function
+import csv
+import decimal
+import io
+import os
+import queue
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy
+import pandas
+import pyarrow
+import pyarrow.parquet
+
+from etl.config.general import (
+    _PARQUET_COMPRESSION,
+    _PARQUET_ROW_GROUP_ROWS,
+    _TRANSFORM_CHUNK_ROWS,
+    _TRANSFORM_MAX_CHUNK_BYTES,
+)
+from etl.src.checkpoint_manager import CheckpointManager
+from etl.src.compression_manager import CompressionManager
+from etl.src.data_mappings import ProjectionPlan
+
+
+# Data factory column types to pandas dtypes. DateTime types are parsed
+# with pandas.to_datetime and Decimal to decimal.Decimal values instead.
+_PANDAS_DTYPES = {
+    "String": "string",
+    "Guid": "string",
+    "Boolean": "boolean",
+    "Byte": "UInt8",
+    "Int16": "Int16",
+    "Int32": "Int32",
+    "Int64": "Int64",
+    "Single": "float32",
+    "Double": "float64",
+}
+_DATETIME_TYPES = {"DateTime", "DateTimeOffset", "datetime", "datetime2"}
+# The same column types to Parquet types
+_ARROW_TYPES = {
+    "String": pyarrow.string(),
+    "Guid": pyarrow.string(),
+    "Boolean": pyarrow.bool_(),
+    "Byte": pyarrow.uint8(),
+    "Int16": pyarrow.int16(),
+    "Int32": pyarrow.int32(),
+    "Int64": pyarrow.int64(),
+    "Single": pyarrow.float32(),
+    "Double": pyarrow.float64(),
+}
+_ARROW_DATETIME = pyarrow.timestamp("us", tz="UTC")
+# Decimal columns without a precision and scale in their mapping, as the
+# decimal(38, 18) of the SQL tables
+_DECIMAL_PRECISION = 38
+_DECIMAL_SCALE = 18
+
+
+class LineReader:
+    """Iterate decoded lines of a binary stream, counting the bytes consumed"""
+
+    def __init__(self, binary_stream, encoding: str = "utf-8", limit: int = None):
+        self._binary_stream = binary_stream
+        self._encoding = encoding
+        self._limit = limit
+        self.bytes_read = 0
+
+    def __iter__(self):
+        for line in self._binary_stream:
+            self.bytes_read += len(line)
+            yield line.decode(self._encoding)
+            # Lines are whole, so a range ends on the line that reaches limit
+            if self._limit is not None and self.bytes_read >= self._limit:
+                return
+
+
+class TransformManager:
+    """Project and rename csv columns in fixed-size chunks"""
+
+    def __init__(
+        self,
+        chunk_rows: int = _TRANSFORM_CHUNK_ROWS,
+        max_chunk_bytes: int = _TRANSFORM_MAX_CHUNK_BYTES,
+        encoding: str = "utf-8",
+    ):
+        super().__init__()
+        self._chunk_rows = chunk_rows
+        self._max_chunk_bytes = max_chunk_bytes
+        self._encoding = encoding
+
+    def read_chunks(self, reader, lines: LineReader):
+        """Yield lists of csv rows, at most chunk_rows rows or max_chunk_bytes
+        of source text each, so memory use does not depend on file size.
+        Blank lines are skipped, as pandas skips them."""
+        chunk = []
+        chunk_start = lines.bytes_read
+        for row in reader:
+            if not row:
+                continue
+            chunk.append(row)
+            if (
+                len(chunk) >= self._chunk_rows
+                or lines.bytes_read - chunk_start >= self._max_chunk_bytes
+            ):
+                yield chunk
+                chunk = []
+                chunk_start = lines.bytes_read
+        if chunk:
+            yield chunk
+
+    def transform_file(
+        self,
+        source_file: str,
+        destination_file: str,
+        plan: ProjectionPlan,
+        progress_callback=None,
+        checkpoint: CheckpointManager = None,
+    ) -> int:
+        """Write the projection of source_file described by plan to
+        destination_file, one chunk at a time.
+
+        A gzip or zstd source_file (by extension) is decompressed as it is
+        read. progress_callback(rows_written, bytes_read) is called after each
+        chunk, bytes_read counting decompressed bytes.
+        With a checkpoint, the source and output offsets are saved after a
+        chunk when due, and a restarted transform of the same source continues
+        from the last save. Returns the number of data rows written.
+        """
+        if CompressionManager.codec_for(source_file) is not None:
+            # Offsets in the decompressed stream cannot be sought to cheaply
+            checkpoint = None
+        state = self.resume_state(source_file, destination_file, checkpoint)
+        rows_written = 0
+        mode = "wb" if state is None else "r+b"
+        with CompressionManager.open_source(source_file) as source, open(
+            destination_file, mode
+        ) as dest:
+            lines = LineReader(source, self._encoding)
+            reader = csv.reader(lines)
+            header = next(reader)
+            project = plan.bind(header)[1]
+            if state is not None:
+                # Rows written after the last checkpoint are written again
+                source.seek(state["source_offset"])
+                lines.bytes_read = state["source_offset"]
+                dest.truncate(state["output_offset"])
+                dest.seek(state["output_offset"])
+                rows_written = state["rows"]
+
+            output = io.TextIOWrapper(dest, encoding=self._encoding, newline="")
+            try:
+                writer = csv.writer(output)
+                if state is None:
+                    writer.writerow(plan._output_header)
+                for chunk in self.read_chunks(reader, lines):
+                    writer.writerows(map(project, chunk))
+                    output.flush()
+                    rows_written += len(chunk)
+                    if checkpoint is not None and checkpoint.due():
+                        self.save_checkpoint(
+                            checkpoint, source_file, lines.bytes_read, dest, rows_written
+                        )
+                    if progress_callback is not None:
+                        progress_callback(rows_written, lines.bytes_read)
+            finally:
+                output.detach()
+        if checkpoint is not None:
+            checkpoint.clear()
+        return rows_written
+
+    def resume_state(
+        self, source_file: str, destination_file: str, checkpoint: CheckpointManager
+    ):
+        """The checkpoint state to continue transform_file from, or None to
+        start over because there is none or it was made from another source"""
+        state = checkpoint.load() if checkpoint is not None else None
+        if state is None:
+            return None
+        source = CheckpointManager.source_fingerprint(
+            source_file, state["source_offset"]
+        )
+        if state.get("source") != source:
+            print("[INFO] : {} changed, ignoring its checkpoint".format(source_file))
+            return None
+        if not checkpoint.restore_output(destination_file, state["output_offset"]):
+            return None
+        print(
+            "[INFO] : Resuming {} after {} rows".format(source_file, state["rows"])
+        )
+        return state
+
+    def save_checkpoint(
+        self,
+        checkpoint: CheckpointManager,
+        source_file: str,
+        source_offset: int,
+        dest,
+        rows_written: int,
+    ):
+        """Save transform_file progress once the output up to it is on disk,
+        and kept by the checkpoint"""
+        dest.flush()
+        os.fsync(dest.fileno())
+        output_offset = dest.tell()
+        checkpoint.save_output(dest.name, output_offset)
+        checkpoint.save(
+            source=CheckpointManager.source_fingerprint(source_file, source_offset),
+            source_offset=source_offset,
+            output_offset=output_offset,
+            rows=rows_written,
+        )
+
+    def iter_lines(self, chunks):
+        """Regroup an iterable of byte strings into lines"""
+        pending = b""
+        for chunk in chunks:
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+        if pending:
+            yield pending
+
+    def project_chunks(self, chunks, plan: ProjectionPlan, progress_callback=None):
+        """Parse the source csv from an iterable of byte strings and yield
+        (projected rows, output csv bytes) for each chunk of rows. The first
+        item's bytes start with the output header."""
+        lines = LineReader(self.iter_lines(chunks), self._encoding)
+        reader = csv.reader(lines)
+        header = next(reader)
+        project = plan.bind(header)[1]
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(plan._output_header)
+        rows_written = 0
+        for chunk in self.read_chunks(reader, lines):
+            rows = list(map(project, chunk))
+            writer.writerows(rows)
+            yield rows, buffer.getvalue().encode(self._encoding)
+            buffer.seek(0)
+            buffer.truncate()
+            rows_written += len(rows)
+            if progress_callback is not None:
+                progress_callback(rows_written, lines.bytes_read)
+        if buffer.tell():
+            yield [], buffer.getvalue().encode(self._encoding)
+
+    def transform_stream(self, chunks, plan: ProjectionPlan, progress_callback=None):
+        """Generator version of transform_file: take the source csv as an
+        iterable of byte strings (e.g. a blob download) and yield the output
+        csv as byte strings, one per chunk of rows."""
+        for _, data in self.project_chunks(chunks, plan, progress_callback):
+            yield data
+
+    def fan_out(self, chunks, consumers: list, max_queued: int = 4) -> list:
+        """Feed every item of chunks to each consumer, each running on its own
+        thread and taking an iterable. At most max_queued items wait for any
+        consumer, so a slow consumer slows the producer instead of growing
+        memory. Returns the consumers' results in order.
+
+        If the producer or a consumer fails, the other consumers see an error
+        from their iterable rather than a short, apparently complete stream.
+        """
+        end, abort = object(), object()
+        queues = [queue.Queue(maxsize=max_queued) for _ in consumers]
+
+        def drain(items):
+            while True:
+                item = items.get()
+                if item is end:
+                    return
+                if item is abort:
+                    raise RuntimeError("fan out aborted")
+                yield item
+
+        def put(items, future, item):
+            while not future.done():
+                try:
+                    items.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            # A consumer that stopped early has failed, surface its error
+            future.result()
+
+        with ThreadPoolExecutor(max_workers=len(consumers)) as executor:
+            futures = [
+                executor.submit(consumer, drain(items))
+                for consumer, items in zip(consumers, queues)
+            ]
+            marker = abort
+            try:
+                for chunk in chunks:
+                    for items, future in zip(queues, futures):
+                        put(items, future, chunk)
+                marker = end
+            finally:
+                for items, future in zip(queues, futures):
+                    try:
+                        put(items, future, marker)
+                    except Exception:
+                        # Reported by future.result() below
+                        pass
+            return [future.result() for future in futures]
+
+    def split_ranges(self, source_file: str, parts: int):
+        """Split the data rows of source_file into at most parts byte ranges
+        that start and end on line boundaries.
+
+        Returns (header line, [(start, end), ...]). Records must not contain
+        embedded newlines, which holds for data factory delimited extracts.
+        """
+        size = os.path.getsize(source_file)
+        with open(source_file, "rb") as source:
+            header_line = source.readline()
+            data_start = source.tell()
+            boundaries = [data_start]
+            for part in range(1, parts):
+                source.seek(data_start + (size - data_start) * part // parts)
+                # Move to the start of the next line
+                source.readline()
+                boundary = min(source.tell(), size)
+                if boundary > boundaries[-1]:
+                    boundaries.append(boundary)
+        if size > boundaries[-1]:
+            boundaries.append(size)
+        ranges = list(zip(boundaries[:-1], boundaries[1:]))
+        return header_line, ranges
+
+    def read_range(self, source_file: str, start: int, end: int):
+        """Yield the csv rows in bytes [start, end) of source_file, as split
+        by split_ranges"""
+        with open(source_file, "rb") as source:
+            source.seek(start)
+            yield from csv.reader(LineReader(source, self._encoding, end - start))
+
+    def transform_range(
+        self,
+        source_file: str,
+        start: int,
+        end: int,
+        header: list,
+        part_file: str,
+        plan: ProjectionPlan,
+        write_header: bool = False,
+    ) -> int:
+        """Write the projected rows in bytes [start, end) of source_file to
+        part_file, preceded by the output header when write_header is set.
+        Returns the number of rows written."""
+        project = plan.bind(header)[1]
+        rows_written = 0
+        with open(source_file, "rb") as source, open(part_file, "wb") as dest:
+            source.seek(start)
+            lines = LineReader(source, self._encoding, end - start)
+            output = io.TextIOWrapper(dest, encoding=self._encoding, newline="")
+            try:
+                writer = csv.writer(output)
+                if write_header:
+                    writer.writerow(plan._output_header)
+                for chunk in self.read_chunks(csv.reader(lines), lines):
+                    writer.writerows(map(project, chunk))
+                    rows_written += len(chunk)
+                output.flush()
+            finally:
+                output.detach()
+        return rows_written
+
+    def transform_file_parallel(
+        self,
+        source_file: str,
+        destination_file: str,
+        plan: ProjectionPlan,
+        workers: int,
+    ) -> int:
+        """Same output as transform_file, with the source split into newline
+        aligned byte ranges transformed by a pool of worker processes and
+        merged in order. Returns the number of data rows written."""
+        # Compressed sources cannot be split into byte ranges
+        if workers <= 1 or CompressionManager.codec_for(source_file) is not None:
+            return self.transform_file(source_file, destination_file, plan)
+
+        header_line, ranges = self.split_ranges(source_file, workers)
+        header = next(csv.reader([header_line.decode(self._encoding)]))
+        part_files = [
+            "{}.part{}".format(destination_file, part) for part in range(len(ranges))
+        ]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        self.transform_range,
+                        source_file,
+                        start,
+                        end,
+                        header,
+                        part_file,
+                        plan,
+                    )
+                    for (start, end), part_file in zip(ranges, part_files)
+                ]
+                rows_written = sum(future.result() for future in futures)
+
+            # The header is written once, then the parts in source order
+            with open(destination_file, "wb") as dest:
+                output = io.TextIOWrapper(dest, encoding=self._encoding, newline="")
+                csv.writer(output).writerow(plan._output_header)
+                output.flush()
+                output.detach()
+                for part_file in part_files:
+                    with open(part_file, "rb") as part:
+                        shutil.copyfileobj(part, dest)
+        finally:
+            for part_file in part_files:
+                if os.path.exists(part_file):
+                    os.remove(part_file)
+        return rows_written
+
+    def coerce_frame(self, frame, column_mappings: list):
+        """Return a copy of frame with each column converted to the type of its
+        mapping, printing how many non-empty values could not be converted"""
+        typed = {}
+        for mapping in column_mappings:
+            name = mapping._destination_column_name
+            column = frame[name]
+            column_type = mapping._destination_column_type
+            physical_type = mapping._destination_column_physical_type
+            if column_type in _DATETIME_TYPES or physical_type in _DATETIME_TYPES:
+                converted = pandas.to_datetime(column, errors="coerce", utc=True)
+            elif column_type == "Boolean":
+                converted = column.str.lower().map({"true": True, "false": False})
+                converted = converted.astype("boolean")
+            elif column_type == "Decimal":
+                converted = self.to_decimals(column, *self.decimal_digits(mapping))
+            elif _PANDAS_DTYPES.get(column_type, "string") != "string":
+                converted = pandas.to_numeric(column, errors="coerce")
+                converted = converted.astype(_PANDAS_DTYPES[column_type])
+            else:
+                # Already read as text
+                typed[name] = column
+                continue
+            invalid = int((converted.isna() & (column != "")).sum())
+            if invalid:
+                print(
+                    "[WARNING] : {} values in {} are not {}".format(
+                        invalid, name, column_type
+                    )
+                )
+            typed[name] = converted
+        return pandas.DataFrame(typed, index=frame.index)
+
+    def decimal_digits(self, mapping) -> tuple:
+        """(precision, scale) of a Decimal column mapping"""
+        precision = mapping._destination_column_precision
+        scale = mapping._destination_column_scale
+        return (
+            _DECIMAL_PRECISION if precision is None else int(precision),
+            _DECIMAL_SCALE if scale is None else int(scale),
+        )
+
+    def to_decimals(self, column, precision: int, scale: int):
+        """column as decimal.Decimal values rounded to scale as SQL Server
+        rounds them, exactly as written rather than through a float. None
+        where a value is not a number or does not fit in precision digits."""
+        quantum = decimal.Decimal(1).scaleb(-scale)
+        context = decimal.Context(
+            prec=precision,
+            rounding=decimal.ROUND_HALF_UP,
+            traps=[decimal.InvalidOperation],
+        )
+
+        def convert(value):
+            try:
+                number = decimal.Decimal(value).quantize(quantum, context=context)
+            except (decimal.InvalidOperation, TypeError, ValueError):
+                return None
+            return number if number.is_finite() else None
+
+        return column.map(convert).astype(object)
+
+    def quote_column(self, column):
+        """Quote a text column the way csv.writer does (QUOTE_MINIMAL), as a
+        numpy object array"""
+        needs_quotes = column.str.contains('[",\r\n]', regex=True)
+        if needs_quotes.any():
+            quoted = '"' + column.str.replace('"', '""', regex=False) + '"'
+            column = column.where(~needs_quotes, quoted)
+        return column.to_numpy(dtype=object)
+
+    def write_frame(self, output, frame):
+        """Write frame as csv lines, joining quoted columns with vectorized
+        string concatenation (much faster than DataFrame.to_csv)"""
+        columns = [self.quote_column(frame[name]) for name in frame.columns]
+        lines = columns[0]
+        if len(columns) == 1:
+            # csv.writer quotes a lone empty field so the row is not blank
+            lines = numpy.where(lines == "", '""', lines)
+        for column in columns[1:]:
+            lines = lines + "," + column
+        if len(lines):
+            output.write("\r\n".join(lines.tolist()))
+            output.write("\r\n")
+
+    def read_frames(self, source, plan: ProjectionPlan, chunk_rows: int = None):
+        """Yield projected and renamed DataFrame chunks of the source csv,
+        chunk_rows (default the manager's chunk_rows) rows each.
+
+        Every value is read as text, so writing a chunk back out reproduces the
+        source fields exactly.
+        """
+        reader = pandas.read_csv(
+            source,
+            usecols=list(plan._source_columns),
+            dtype=str,
+            keep_default_na=False,
+            na_filter=False,
+            encoding=self._encoding,
+            chunksize=chunk_rows or self._chunk_rows,
+        )
+        for frame in reader:
+            # usecols keeps file order, select to get mapping order
+            frame = frame[list(plan._source_columns)]
+            frame.columns = list(plan._output_header)
+            yield frame
+
+    def transform_file_pandas(
+        self,
+        source_file: str,
+        destination_file: str,
+        column_mappings: list,
+        plan: ProjectionPlan,
+        progress_callback=None,
+        validate: bool = False,
+    ) -> int:
+        """Columnar version of transform_file: projection and rename run as
+        vectorized pandas operations on each chunk. The csv written is
+        byte-identical to transform_file. With validate, each chunk is also
+        coerced to the mapped column types to report values that do not
+        convert; the csv is text either way, so this only costs time."""
+        rows_written = 0
+        with CompressionManager.open_source(source_file) as source, open(
+            destination_file, "wb"
+        ) as dest:
+            output = io.TextIOWrapper(dest, encoding=self._encoding, newline="")
+            try:
+                csv.writer(output).writerow(plan._output_header)
+                for frame in self.read_frames(source, plan):
+                    if validate:
+                        self.coerce_frame(frame, column_mappings)
+                    self.write_frame(output, frame)
+                    output.flush()
+                    rows_written += len(frame)
+                    if progress_callback is not None:
+                        progress_callback(rows_written, source.tell())
+            finally:
+                output.detach()
+        return rows_written
+
+    def arrow_schema(self, column_mappings: list):
+        """Parquet schema with each column typed as coerce_frame converts it"""
+        fields = []
+        for mapping in column_mappings:
+            column_type = mapping._destination_column_type
+            physical_type = mapping._destination_column_physical_type
+            if column_type in _DATETIME_TYPES or physical_type in _DATETIME_TYPES:
+                arrow_type = _ARROW_DATETIME
+            elif column_type == "Decimal":
+                arrow_type = pyarrow.decimal128(*self.decimal_digits(mapping))
+            else:
+                arrow_type = _ARROW_TYPES.get(column_type, pyarrow.string())
+            fields.append(pyarrow.field(mapping._destination_column_name, arrow_type))
+        return pyarrow.schema(fields)
+
+    def transform_file_parquet(
+        self,
+        source_file: str,
+        destination_file: str,
+        column_mappings: list,
+        plan: ProjectionPlan,
+        progress_callback=None,
+        row_group_rows: int = _PARQUET_ROW_GROUP_ROWS,
+        compression: str = _PARQUET_COMPRESSION,
+    ) -> int:
+        """Parquet version of transform_file_pandas: each chunk of
+        row_group_rows rows is coerced to the column types of its mapping and
+        written as one row group, so readers get typed columns instead of
+        text. Returns the number of data rows written."""
+        schema = self.arrow_schema(column_mappings)
+        rows_written = 0
+        with CompressionManager.open_source(
+            source_file
+        ) as source, pyarrow.parquet.ParquetWriter(
+            destination_file, schema, compression=compression
+        ) as writer:
+            for frame in self.read_frames(source, plan, row_group_rows):
+                # Sub-microsecond timestamps are truncated
+                table = pyarrow.Table.from_pandas(
+                    self.coerce_frame(frame, column_mappings),
+                    schema=schema,
+                    preserve_index=False,
+                    safe=False,
+                )
+                writer.write_table(table, row_group_size=len(frame))
+                rows_written += len(frame)
+                if progress_callback is not None:
+                    progress_callback(rows_written, source.tell())
+        return rows_written
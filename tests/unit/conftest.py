@@ -0,0 +1,70 @@
+import os
+import shutil
+import types
+
+import pytest
+
+from etl.src.adls2_manager import ADLS2Manager
+from etl.src.blob_manager import BlobManager
+from etl.src.etl_manager import EtlManager
+from etl.src.manifest_cache import ManifestCache
+from etl.src.transform_manager import TransformManager
+from tests.unit.fake_blob_service import FakeBlobServiceClient
+from tests.unit.fake_datalake_service import FakeDataLakeServiceClient
+
+
+@pytest.fixture()
+def etl_manager(tmp_path):
+    """Return main ETL Manager"""
+    manager = EtlManager()
+    manager._manifest_cache = ManifestCache(str(tmp_path / "manifest_cache"))
+    return manager
+
+
+@pytest.fixture()
+def etl_workspace(etl_manager, tmp_path, monkeypatch):
+    """etl_manager working in tmp_path/work, with empty file_input and
+    file_output directories and a plan cache of its own.
+
+    Its blob and ADLS Gen2 clients are fakes over tmp_path/store, whose
+    input container holds person.csv and person_map.json, and over
+    tmp_path/lake. data_dir is the repository's file_input directory and
+    expected the transformed person.csv.
+    """
+    data_dir = os.path.abspath("./file_input")
+    store = tmp_path / "store"
+    (store / "input").mkdir(parents=True)
+    for name in ("person.csv", "person_map.json"):
+        shutil.copy(os.path.join(data_dir, name), str(store / "input" / name))
+    (tmp_path / "lake").mkdir()
+    work = tmp_path / "work"
+    for name in ("file_input", "file_output"):
+        (work / name).mkdir(parents=True)
+    monkeypatch.setattr("etl.src.etl_manager._PLAN_CACHE_DIR", str(tmp_path / "cache"))
+
+    data_mappings = etl_manager.parse_mapping_file(
+        os.path.join(data_dir, "person_map.json")
+    )
+    expected = tmp_path / "expected.csv"
+    TransformManager().transform_file(
+        os.path.join(data_dir, "person.csv"),
+        str(expected),
+        data_mappings._projection_plan,
+    )
+
+    monkeypatch.chdir(str(work))
+    blob_service = FakeBlobServiceClient(str(store))
+    lake_service = FakeDataLakeServiceClient(str(tmp_path / "lake"))
+    etl_manager._blob_manager = BlobManager(blob_service)
+    etl_manager._adls2_manager = ADLS2Manager(lake_service)
+    return types.SimpleNamespace(
+        etl_manager=etl_manager,
+        data_dir=data_dir,
+        data_mappings=data_mappings,
+        expected=expected,
+        work=work,
+        store=store,
+        lake=tmp_path / "lake",
+        blob_service=blob_service,
+        lake_service=lake_service,
+    )
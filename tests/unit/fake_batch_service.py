@@ -0,0 +1,242 @@
+"""In-memory stand-in for azure.batch's BatchServiceClient.
+
+Pools, jobs and tasks are kept in dictionaries and every service call is
+recorded in calls, so tests can check how many requests an operation costs
+and with what arguments. server_errors names task ids whose next add is
+rejected with a server error. latency adds a delay to each file request.
+"""
+import collections
+import datetime
+import threading
+import time
+
+import azure.batch.models as batchmodels
+
+
+def batch_error(code, message):
+    """BatchErrorException without an HTTP response"""
+    error = batchmodels.BatchErrorException.__new__(batchmodels.BatchErrorException)
+    Exception.__init__(error, message)
+    error.error = batchmodels.BatchError(
+        code=code, message=batchmodels.ErrorMessage(value=message)
+    )
+    return error
+
+
+class FakePoolOperations:
+    def __init__(self, service):
+        self._service = service
+
+    def exists(self, pool_id, **kwargs):
+        self._service.call("pool.exists", pool_id)
+        return pool_id in self._service.pools
+
+    def add(self, pool, **kwargs):
+        self._service.call("pool.add", pool.id)
+        self._service.pools[pool.id] = batchmodels.CloudPool(
+            id=pool.id,
+            vm_size=pool.vm_size,
+            target_dedicated_nodes=pool.target_dedicated_nodes,
+            target_low_priority_nodes=pool.target_low_priority_nodes,
+            enable_auto_scale=bool(pool.enable_auto_scale),
+            auto_scale_formula=pool.auto_scale_formula,
+            task_slots_per_node=pool.task_slots_per_node,
+            allocation_state=batchmodels.AllocationState.steady,
+        )
+
+    def get(self, pool_id, **kwargs):
+        self._service.call("pool.get", pool_id)
+        return self._service.pools[pool_id]
+
+    def resize(self, pool_id, pool_resize_parameter, **kwargs):
+        self._service.call(
+            "pool.resize",
+            pool_id,
+            pool_resize_parameter.target_dedicated_nodes,
+            pool_resize_parameter.target_low_priority_nodes,
+        )
+        pool = self._service.pools[pool_id]
+        if pool.enable_auto_scale:
+            raise batch_error("AutoScalingEnabled", "The pool has autoscale enabled.")
+        pool.target_dedicated_nodes = pool_resize_parameter.target_dedicated_nodes
+        pool.target_low_priority_nodes = pool_resize_parameter.target_low_priority_nodes
+        pool.allocation_state = batchmodels.AllocationState.resizing
+
+    def enable_auto_scale(self, pool_id, auto_scale_formula=None, **kwargs):
+        self._service.call("pool.enable_auto_scale", pool_id)
+        pool = self._service.pools[pool_id]
+        pool.enable_auto_scale = True
+        pool.auto_scale_formula = auto_scale_formula
+
+    def disable_auto_scale(self, pool_id, **kwargs):
+        self._service.call("pool.disable_auto_scale", pool_id)
+        self._service.pools[pool_id].enable_auto_scale = False
+
+
+class FakeJobOperations:
+    def __init__(self, service):
+        self._service = service
+
+    def get_task_counts(self, job_id, **kwargs):
+        self._service.call("job.get_task_counts", job_id)
+        tasks = self._service.tasks[job_id].values()
+        states = collections.Counter(task.state for task in tasks)
+        results = collections.Counter(
+            task.execution_info.result for task in tasks if task.execution_info
+        )
+        return batchmodels.TaskCountsResult(
+            task_counts=batchmodels.TaskCounts(
+                active=states[batchmodels.TaskState.active],
+                running=states[batchmodels.TaskState.running],
+                completed=states[batchmodels.TaskState.completed],
+                succeeded=results[batchmodels.TaskExecutionResult.success],
+                failed=results[batchmodels.TaskExecutionResult.failure],
+            ),
+            task_slot_counts=None,
+        )
+
+    def add(self, job, **kwargs):
+        self._service.call("job.add", job.id)
+        self._service.jobs[job.id] = job
+        self._service.tasks[job.id] = collections.OrderedDict()
+        self._service.added[job.id] = {}
+
+
+class FakeTaskOperations:
+    def __init__(self, service):
+        self._service = service
+
+    def add(self, job_id, task, **kwargs):
+        self._service.call("task.add", job_id, task.id)
+        self._service.tasks[job_id][task.id] = self._service.new_task(task)
+
+    def list(self, job_id, task_list_options=None, **kwargs):
+        task_filter = task_list_options.filter if task_list_options else None
+        select = task_list_options.select if task_list_options else None
+        self._service.call("task.list", job_id, task_filter, select)
+        tasks = list(self._service.tasks[job_id].values())
+        # Only "state eq|ne '<state>'" and "stateTransitionTime ge
+        # datetime'<time>'" clauses joined with "and" are supported
+        for clause in task_filter.split(" and ") if task_filter else []:
+            name, operator, value = clause.split()
+            if name == "stateTransitionTime":
+                since = datetime.datetime.strptime(
+                    value, "datetime'%Y-%m-%dT%H:%M:%SZ'"
+                ).replace(tzinfo=datetime.timezone.utc)
+                tasks = [task for task in tasks if task.state_transition_time >= since]
+                continue
+            state = value.strip("'")
+            tasks = [
+                task for task in tasks if (task.state.value == state) == (operator == "eq")
+            ]
+        return iter(tasks)
+
+    def add_collection(self, job_id, value, **kwargs):
+        self._service.call("task.add_collection", job_id, [task.id for task in value])
+        if len(value) > 100:
+            raise batchmodels.BatchErrorException(None, None)
+        results = []
+        tasks = self._service.tasks[job_id]
+        for task in value:
+            if task.id in self._service.server_errors:
+                self._service.server_errors.remove(task.id)
+                status, error = batchmodels.TaskAddStatus.server_error, None
+            elif task.id in tasks:
+                status = batchmodels.TaskAddStatus.client_error
+                error = batchmodels.BatchError(code="TaskExists")
+            else:
+                tasks[task.id] = self._service.new_task(task)
+                self._service.added[job_id][task.id] = task
+                status, error = batchmodels.TaskAddStatus.success, None
+            results.append(
+                batchmodels.TaskAddResult(status=status, task_id=task.id, error=error)
+            )
+        return batchmodels.TaskAddCollectionResult(value=results)
+
+
+class FakeRawResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class FakeFileOperations:
+    def __init__(self, service):
+        self._service = service
+
+    def _content(self, job_id, task_id, file_path):
+        time.sleep(self._service.latency)
+        try:
+            return self._service.files[(job_id, task_id, file_path)]
+        except KeyError:
+            raise batch_error("FileNotFound", "The specified file does not exist.")
+
+    def get_properties_from_task(self, job_id, task_id, file_path, raw=False, **kwargs):
+        self._service.call("file.get_properties_from_task", job_id, task_id, file_path)
+        content = self._content(job_id, task_id, file_path)
+        return FakeRawResponse({"Content-Length": len(content)}) if raw else None
+
+    def get_from_task(
+        self, job_id, task_id, file_path, file_get_from_task_options=None, **kwargs
+    ):
+        ocp_range = getattr(file_get_from_task_options, "ocp_range", None)
+        self._service.call("file.get_from_task", job_id, task_id, file_path, ocp_range)
+        content = self._content(job_id, task_id, file_path)
+        if ocp_range:
+            start, end = ocp_range[len("bytes=") :].split("-")
+            content = content[int(start) : int(end) + 1]
+        # Served in small pieces, as the SDK streams the response
+        return (content[i : i + 64] for i in range(0, len(content), 64))
+
+
+class FakeBatchServiceClient:
+    def __init__(self, latency=0.0):
+        self.pools = {}
+        self.jobs = {}
+        self.tasks = {}
+        # The TaskAddParameters as submitted, by job and task id
+        self.added = {}
+        self.server_errors = set()
+        self.files = {}
+        self.latency = latency
+        self.calls = []
+        self.lock = threading.Lock()
+        self.pool = FakePoolOperations(self)
+        self.job = FakeJobOperations(self)
+        self.task = FakeTaskOperations(self)
+        self.file = FakeFileOperations(self)
+
+    def new_task(self, task):
+        return batchmodels.CloudTask(
+            id=task.id,
+            command_line=task.command_line,
+            state=batchmodels.TaskState.active,
+            state_transition_time=datetime.datetime.now(datetime.timezone.utc),
+        )
+
+    def complete(
+        self, job_id, task_id, exit_code=0, stdout=None, stderr=None, seconds=60
+    ):
+        task = self.tasks[job_id][task_id]
+        task.state = batchmodels.TaskState.completed
+        task.state_transition_time = datetime.datetime.now(datetime.timezone.utc)
+        task.node_info = batchmodels.ComputeNodeInformation(node_id="node-0")
+        for file_name, content in (("stdout.txt", stdout), ("stderr.txt", stderr)):
+            if content is not None:
+                self.files[(job_id, task_id, file_name)] = content
+        task.execution_info = batchmodels.TaskExecutionInformation(
+            retry_count=0,
+            requeue_count=0,
+            exit_code=exit_code,
+            start_time=datetime.datetime(2021, 1, 1),
+            end_time=datetime.datetime(2021, 1, 1) + datetime.timedelta(seconds=seconds),
+            result=batchmodels.TaskExecutionResult.success
+            if exit_code == 0
+            else batchmodels.TaskExecutionResult.failure,
+        )
+
+    def call(self, name, *args):
+        with self.lock:
+            self.calls.append((name,) + args)
+
+    def calls_to(self, name):
+        return [call[1:] for call in self.calls if call[0] == name]
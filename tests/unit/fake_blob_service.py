@@ -0,0 +1,232 @@
+"""Filesystem-backed stand-in for azure.storage.blob's BlobServiceClient.
+
+Containers are directories and blobs are files under root_dir. Every
+service call is counted in calls, so tests and benchmarks can measure how
+many round trips an operation costs. latency adds a delay to each call, and
+fail_downloads makes the next ranged downloads fail as a dropped connection
+would.
+"""
+import collections
+import hashlib
+import os
+import shutil
+import threading
+import time
+import types
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ServiceResponseError,
+)
+
+
+class FakeDownloader:
+    """Subset of StorageStreamDownloader"""
+
+    def __init__(self, path, offset, length, metadata=None):
+        self._path = path
+        self.properties = types.SimpleNamespace(metadata=metadata or {})
+        self.size = os.path.getsize(path)
+        self._offset = offset or 0
+        end = self.size if length is None else min(self.size, self._offset + length)
+        self._length = max(0, end - self._offset)
+
+    def chunks(self, chunk_size=4 * 1024 * 1024):
+        with open(self._path, "rb") as f:
+            f.seek(self._offset)
+            remaining = self._length
+            while remaining:
+                data = f.read(min(chunk_size, remaining))
+                remaining -= len(data)
+                yield data
+
+    def readall(self):
+        return b"".join(self.chunks())
+
+    def readinto(self, stream):
+        for data in self.chunks():
+            stream.write(data)
+        return self._length
+
+
+class FakeBlobClient:
+    def __init__(self, service, container_name, blob_name):
+        self._service = service
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self._path = os.path.join(service.root_dir, container_name, blob_name)
+
+    def exists(self, **kwargs):
+        self._service.call("blob_exists")
+        return os.path.exists(self._path)
+
+    def get_blob_properties(self, **kwargs):
+        self._service.call("get_blob_properties")
+        if not os.path.exists(self._path):
+            raise ResourceNotFoundError("The specified blob does not exist.")
+        stat = os.stat(self._path)
+        with open(self._path, "rb") as f:
+            content_md5 = bytearray(hashlib.md5(f.read()).digest())
+        return {
+            "name": self.blob_name,
+            "size": stat.st_size,
+            "etag": self.etag(),
+            "content_settings": {
+                "content_md5": content_md5,
+                "content_type": self._service.content_types.get(self._path),
+            },
+            "metadata": self._service.metadata.get(self._path) or {},
+        }
+
+    def etag(self):
+        return '"0x{:x}"'.format(os.stat(self._path).st_mtime_ns)
+
+    def download_blob(
+        self, offset=None, length=None, etag=None, match_condition=None, **kwargs
+    ):
+        self._service.call("download_blob")
+        if self._service.take_failure():
+            raise ServiceResponseError("Connection reset by peer")
+        if not os.path.exists(self._path):
+            raise ResourceNotFoundError("The specified blob does not exist.")
+        if match_condition == MatchConditions.IfNotModified and etag != self.etag():
+            raise ResourceModifiedError("The condition specified was not met.")
+        return FakeDownloader(
+            self._path, offset, length, self._service.metadata.get(self._path)
+        )
+
+    def upload_blob(
+        self, data, overwrite=False, content_settings=None, metadata=None, **kwargs
+    ):
+        self._service.call("upload_blob")
+        if os.path.exists(self._path) and not overwrite:
+            raise ResourceExistsError("The specified blob already exists.")
+        self._service.set_settings(self._path, content_settings, metadata)
+        with self._service.lock:
+            self._service.committed.pop(self._path, None)
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(self._path, "wb") as f:
+            if isinstance(data, (bytes, bytearray)):
+                f.write(data)
+            elif hasattr(data, "read"):
+                shutil.copyfileobj(data, f)
+            else:
+                for chunk in data:
+                    f.write(chunk)
+
+    def stage_block(self, block_id, data, length=None, **kwargs):
+        self._service.call("stage_block")
+        if hasattr(data, "read"):
+            data = data.read()
+        with self._service.lock:
+            self._service.staged[self._path][block_id] = bytes(data)
+
+    def commit_block_list(
+        self, block_list, content_settings=None, metadata=None, **kwargs
+    ):
+        self._service.call("commit_block_list")
+        self._service.set_settings(self._path, content_settings, metadata)
+        with self._service.lock:
+            # The latest of a block: staged, or else committed before
+            blocks = dict(self._service.committed.get(self._path, {}))
+            blocks.update(self._service.staged.pop(self._path, {}))
+            self._service.committed[self._path] = {
+                block.id: blocks[block.id] for block in block_list
+            }
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(self._path, "wb") as f:
+            for block in block_list:
+                f.write(blocks[block.id])
+
+    def delete_blob(self, **kwargs):
+        self._service.call("delete_blob")
+        if not os.path.exists(self._path):
+            raise ResourceNotFoundError("The specified blob does not exist.")
+        os.remove(self._path)
+        with self._service.lock:
+            self._service.committed.pop(self._path, None)
+
+
+class FakeContainerClient:
+    def __init__(self, service, container_name):
+        self._service = service
+        self.container_name = container_name
+        self._path = os.path.join(service.root_dir, container_name)
+
+    def exists(self, **kwargs):
+        self._service.call("container_exists")
+        return os.path.isdir(self._path)
+
+    def create_container(self, **kwargs):
+        self._service.call("create_container")
+        try:
+            os.makedirs(self._path)
+        except FileExistsError:
+            raise ResourceExistsError("The specified container already exists.")
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        self._service.call("list_blobs")
+        for name in sorted(os.listdir(self._path)):
+            if name_starts_with is None or name.startswith(name_starts_with):
+                self._service.calls["blobs_listed"] += 1
+                size = os.path.getsize(os.path.join(self._path, name))
+                yield {"name": name, "size": size}
+
+    def get_blob_client(self, blob):
+        return FakeBlobClient(self._service, self.container_name, blob)
+
+    def upload_blob(self, name, data, overwrite=False, **kwargs):
+        blob_client = self.get_blob_client(name)
+        return blob_client.upload_blob(data, overwrite=overwrite, **kwargs)
+
+
+class FakeBlobServiceClient:
+    def __init__(self, root_dir, latency=0.0, fail_downloads=0):
+        self.root_dir = root_dir
+        self.latency = latency
+        self.fail_downloads = fail_downloads
+        self.calls = collections.Counter()
+        self.staged = collections.defaultdict(dict)
+        self.committed = {}
+        self.content_types = {}
+        self.metadata = {}
+        self.lock = threading.Lock()
+
+    def call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def set_settings(self, path, content_settings, metadata):
+        with self.lock:
+            self.content_types[path] = (
+                content_settings.content_type if content_settings else None
+            )
+            self.metadata[path] = metadata
+
+    def take_failure(self):
+        with self.lock:
+            if self.fail_downloads:
+                self.fail_downloads -= 1
+                return True
+        return False
+
+    def list_containers(self, **kwargs):
+        self.call("list_containers")
+        for name in sorted(os.listdir(self.root_dir)):
+            yield {"name": name}
+
+    def get_container_client(self, container):
+        return FakeContainerClient(self, container)
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self, container, blob)
+
+    def create_container(self, name, **kwargs):
+        client = self.get_container_client(name)
+        client.create_container()
+        return client
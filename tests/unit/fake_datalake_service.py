@@ -0,0 +1,99 @@
+"""Filesystem-backed stand-in for azure.storage.filedatalake's
+DataLakeServiceClient.
+
+File systems are directories under root_dir. Appended data is held until
+flush_data, which requires it to be contiguous, as the service does. Calls
+are counted in calls and the peak number of concurrent appends is kept in
+max_concurrent_appends.
+"""
+import collections
+import os
+import threading
+import time
+
+
+class FakeDataLakeFileClient:
+    def __init__(self, service, path):
+        self._service = service
+        self._path = path
+        self._pending = {}
+
+    def exists(self, **kwargs):
+        self._service.call("file_exists")
+        return os.path.exists(self._path)
+
+    def create_file(self, metadata=None, **kwargs):
+        self._service.call("create_file")
+        with self._service.lock:
+            self._service.metadata[self._path] = metadata
+        self._pending = {}
+        with open(self._path, "wb"):
+            pass
+
+    def append_data(self, data, offset, length=None, **kwargs):
+        service = self._service
+        with service.lock:
+            service.active_appends += 1
+            service.max_concurrent_appends = max(
+                service.max_concurrent_appends, service.active_appends
+            )
+        try:
+            service.call("append_data")
+            with service.lock:
+                self._pending[offset] = bytes(data)
+        finally:
+            with service.lock:
+                service.active_appends -= 1
+
+    def flush_data(self, offset, content_settings=None, **kwargs):
+        self._service.call("flush_data")
+        with self._service.lock:
+            self._service.content_types[self._path] = (
+                content_settings.content_type if content_settings else None
+            )
+        position = 0
+        with open(self._path, "wb") as f:
+            while position < offset:
+                data = self._pending.pop(position)  # KeyError if not contiguous
+                f.write(data)
+                position += len(data)
+        if position != offset:
+            raise ValueError("flush offset does not match appended data")
+
+
+class FakeFileSystemClient:
+    def __init__(self, service, name):
+        self._service = service
+        self._path = os.path.join(service.root_dir, name)
+
+    def exists(self, **kwargs):
+        self._service.call("file_system_exists")
+        return os.path.isdir(self._path)
+
+    def create_file_system(self, **kwargs):
+        self._service.call("create_file_system")
+        os.makedirs(self._path)
+
+    def get_file_client(self, file_path):
+        return FakeDataLakeFileClient(self._service, os.path.join(self._path, file_path))
+
+
+class FakeDataLakeServiceClient:
+    def __init__(self, root_dir, latency=0.0):
+        self.root_dir = root_dir
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+        self.active_appends = 0
+        self.max_concurrent_appends = 0
+        self.content_types = {}
+        self.metadata = {}
+
+    def call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_file_system_client(self, file_system):
+        return FakeFileSystemClient(self, file_system)
@@ -0,0 +1,169 @@
+import asyncio
+import gzip
+import shutil
+import time
+
+from azure.core.exceptions import ResourceExistsError
+
+from etl.src.adls2_manager import ADLS2Manager
+from etl.src.async_etl_manager import AsyncEtlManager
+from etl.src.blob_manager import BlobManager
+from etl.src.manifest_cache import ManifestCache
+from tests.unit.fake_blob_service import FakeBlobServiceClient
+from tests.unit.fake_datalake_service import FakeDataLakeServiceClient
+
+_LATENCY = 0.2
+
+
+class AsyncDownloader:
+    def __init__(self, downloader):
+        self._downloader = downloader
+        self.properties = downloader.properties
+
+    async def chunks(self):
+        for chunk in self._downloader.chunks():
+            yield chunk
+
+
+class AsyncBlobService:
+    """aio facade over the filesystem blob fake, with latency per transfer"""
+
+    def __init__(self, service):
+        self._service = service
+
+    def get_blob_client(self, container, blob):
+        service = self._service
+
+        class BlobClient:
+            async def download_blob(self, **kwargs):
+                await asyncio.sleep(_LATENCY)
+                blob_client = service.get_blob_client(container, blob)
+                return AsyncDownloader(blob_client.download_blob())
+
+        return BlobClient()
+
+    def get_container_client(self, container):
+        client = self._service.get_container_client(container)
+
+        class ContainerClient:
+            async def create_container(self):
+                client.create_container()
+
+            async def upload_blob(self, name, data, overwrite=False, **kwargs):
+                await asyncio.sleep(_LATENCY)
+                client.upload_blob(name, data, overwrite=overwrite, **kwargs)
+
+        return ContainerClient()
+
+
+class AsyncDataLakeService:
+    """aio facade over the filesystem datalake fake"""
+
+    def __init__(self, service):
+        self._service = service
+
+    def get_file_system_client(self, file_system):
+        client = self._service.get_file_system_client(file_system)
+
+        class FileClient:
+            def __init__(self, file_client):
+                self._file_client = file_client
+
+            async def create_file(self, metadata=None):
+                self._file_client.create_file(metadata=metadata)
+
+            async def append_data(self, data, offset, length=None):
+                await asyncio.sleep(_LATENCY)
+                self._file_client.append_data(data, offset=offset, length=length)
+
+            async def flush_data(self, offset, content_settings=None):
+                self._file_client.flush_data(offset, content_settings=content_settings)
+
+        class FileSystemClient:
+            async def create_file_system(self):
+                if client.exists():
+                    raise ResourceExistsError("The file system already exists.")
+                client.create_file_system()
+
+            def get_file_client(self, file_path):
+                return FileClient(client.get_file_client(file_path))
+
+        return FileSystemClient()
+
+
+def make_async_etl_manager(tmp_path, monkeypatch, compression=None):
+    store = tmp_path / "store"
+    (store / "input").mkdir(parents=True)
+    for name in ("person.csv", "person_map.json"):
+        shutil.copy("./file_input/{}".format(name), str(store / "input" / name))
+    (tmp_path / "work" / "file_input").mkdir(parents=True)
+    (tmp_path / "work" / "file_output").mkdir()
+    (tmp_path / "lake").mkdir()
+    monkeypatch.chdir(tmp_path / "work")
+    monkeypatch.setattr("etl.src.etl_manager._PLAN_CACHE_DIR", str(tmp_path / "cache"))
+
+    blob_service = FakeBlobServiceClient(str(store))
+    lake_service = FakeDataLakeServiceClient(str(tmp_path / "lake"))
+    async_etl_manager = AsyncEtlManager(
+        AsyncBlobService(blob_service), AsyncDataLakeService(lake_service)
+    )
+    # Cache lookups and upload settings of the synchronous managers
+    async_etl_manager._blob_manager = BlobManager(blob_service, compression=compression)
+    async_etl_manager._adls2_manager = ADLS2Manager(
+        lake_service, compression=compression
+    )
+    async_etl_manager._manifest_cache = ManifestCache(str(tmp_path / "manifest_cache"))
+    return async_etl_manager, blob_service, lake_service
+
+
+def test_run_job_overlaps_transfers(tmp_path, monkeypatch):
+    store = tmp_path / "store"
+    async_etl_manager, _, _ = make_async_etl_manager(tmp_path, monkeypatch)
+    start = time.perf_counter()
+    result = async_etl_manager.run_job("person.csv", "person_map.json")
+    elapsed = time.perf_counter() - start
+
+    assert result["status"] == "success"
+    assert result["rows"] == 50
+    output = (tmp_path / "work" / "file_output" / "person_transformed.csv").read_bytes()
+    assert (store / "output" / "person_transformed.csv").read_bytes() == output
+    lake_file = tmp_path / "lake" / "transformations" / "person_transformed.csv"
+    assert lake_file.read_bytes() == output
+    # Four transfers of _LATENCY each, run as two concurrent pairs
+    assert elapsed < 3.5 * _LATENCY
+
+
+def test_run_job_compresses_and_caches_like_etl_manager(tmp_path, monkeypatch):
+    store = tmp_path / "store"
+    async_etl_manager, blob_service, lake_service = make_async_etl_manager(
+        tmp_path, monkeypatch, compression="gzip"
+    )
+    result = async_etl_manager.run_job("person.csv", "person_map.json")
+    assert result["status"] == "success"
+
+    output = (tmp_path / "work" / "file_output" / "person_transformed.csv").read_bytes()
+    blob = store / "output" / "person_transformed.csv.gz"
+    assert gzip.decompress(blob.read_bytes()) == output
+    assert blob_service.metadata[str(blob)] == {"compression": "gzip"}
+    assert blob_service.content_types[str(blob)] == "text/csv"
+    lake_file = tmp_path / "lake" / "transformations" / "person_transformed.csv.gz"
+    assert gzip.decompress(lake_file.read_bytes()) == output
+    assert lake_service.content_types[str(lake_file)] == "text/csv"
+
+    cached = async_etl_manager.run_job("person.csv", "person_map.json")
+    assert cached["status"] == "cached"
+    assert cached["rows"] == 50
+
+
+def test_run_job_with_inputs_local(tmp_path, monkeypatch):
+    async_etl_manager, blob_service, _ = make_async_etl_manager(tmp_path, monkeypatch)
+    for name in ("person.csv", "person_map.json"):
+        shutil.copy("../store/input/{}".format(name), "file_input")
+    blob_service.calls.clear()
+    result = async_etl_manager.run_job(
+        "person.csv", "person_map.json", inputs_local=True
+    )
+    assert result["status"] == "success"
+    assert result["rows"] == 50
+    # Only the input fingerprints of the cache key
+    assert set(blob_service.calls) == {"get_blob_properties"}
@@ -0,0 +1,240 @@
+import datetime
+import time
+
+import azure.batch.models as batchmodels
+import pytest
+from unittest.mock import Mock
+
+from etl.src.azure_batch_manager import AzureBatchManager
+from tests.unit.fake_batch_service import FakeBatchServiceClient
+
+
+@pytest.fixture()
+def azure_batch_manager():
+    """Return Azure Batch Manager"""
+    return AzureBatchManager()
+
+
+@pytest.fixture()
+def batch_client():
+    batch_client = FakeBatchServiceClient()
+    batch_client.job.add(type("Job", (), {"id": "job"}))
+    return batch_client
+
+
+def test_add_tasks_shards_in_batches_of_100(azure_batch_manager, batch_client):
+    added = azure_batch_manager.add_tasks(
+        batch_client, "job", "person.csv", "person_map.json", shards=250
+    )
+    assert added == 250
+    batches = batch_client.calls_to("task.add_collection")
+    assert [len(task_ids) for _, task_ids in batches] == [100, 100, 50]
+    tasks = batch_client.tasks["job"]
+    assert len(tasks) == 250
+    assert tasks["CDMInsert-00007"].command_line.endswith(
+        "--shard 7 250 person.csv person_map.json"
+    )
+    assert batch_client.calls_to("task.add") == []
+
+
+def test_add_manifest_tasks_retries_server_errors(
+    azure_batch_manager, batch_client, monkeypatch
+):
+    sleeps = []
+    monkeypatch.setattr("etl.src.azure_batch_manager.time.sleep", sleeps.append)
+    pairs = [("person{}.csv".format(i), "person_map.json") for i in range(5)]
+    batch_client.server_errors = {"CDMInsert-00001", "CDMInsert-00003"}
+    assert azure_batch_manager.add_manifest_tasks(batch_client, "job", pairs) == 5
+    # One backoff before the retry
+    assert sleeps == [1]
+    batches = batch_client.calls_to("task.add_collection")
+    assert batches[1] == ("job", ["CDMInsert-00001", "CDMInsert-00003"])
+    assert list(batch_client.tasks["job"]) == [
+        "CDMInsert-0000{}".format(i) for i in (0, 2, 4, 1, 3)
+    ]
+
+
+def test_add_tasks_rejects_duplicate_ids(azure_batch_manager, batch_client):
+    azure_batch_manager.add_tasks(batch_client, "job", "person.csv", "person_map.json")
+    with pytest.raises(RuntimeError):
+        azure_batch_manager.add_tasks(
+            batch_client, "job", "person.csv", "person_map.json"
+        )
+
+
+def test_create_pool_sets_task_slots(azure_batch_manager):
+    batch_client = FakeBatchServiceClient()
+    azure_batch_manager.create_pool(batch_client, "pool")
+    azure_batch_manager.create_pool(batch_client, "pool")
+    assert batch_client.calls_to("pool.add") == [("pool",)]
+    assert batch_client.pools["pool"].task_slots_per_node == 4
+
+
+def test_wait_for_tasks_to_complete(azure_batch_manager, batch_client, monkeypatch):
+    azure_batch_manager.add_tasks(
+        batch_client, "job", "person.csv", "person_map.json", shards=6
+    )
+    task_ids = list(batch_client.tasks["job"])
+    # Two tasks finish after the 1st poll, the rest after the 5th
+    finish = {1: task_ids[:2], 5: task_ids[2:]}
+    hour = datetime.timedelta(hours=1)
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        for task_id in finish.get(len(sleeps), []):
+            batch_client.complete("job", task_id, exit_code=len(sleeps) % 2)
+        if len(sleeps) == 2:
+            # The first two completed well before the next listing
+            for task_id in task_ids[:2]:
+                batch_client.tasks["job"][task_id].state_transition_time -= hour
+
+    monkeypatch.setattr("etl.src.azure_batch_manager.time.sleep", sleep)
+    completed = []
+    assert azure_batch_manager.wait_for_tasks_to_complete(
+        batch_client,
+        "job",
+        datetime.timedelta(minutes=1),
+        on_task_completed=lambda task: completed.append(
+            (task.id, task.execution_info.exit_code)
+        ),
+    )
+
+    assert completed == [(task_id, 1) for task_id in task_ids[:2]] + [
+        (task_id, 1) for task_id in task_ids[2:]
+    ]
+    # Backs off while nothing changes, resets when tasks complete
+    assert sleeps == [1, 1, 2, 4, 8]
+    # One counts request per poll, task lists only on progress and at the end
+    assert len(batch_client.calls_to("job.get_task_counts")) == 6
+    lists = batch_client.calls_to("task.list")
+    assert lists[0] == ("job", "state eq 'completed'", "id,executionInfo")
+    # Later listings ask only for tasks completed since the previous one
+    assert lists[1][1].startswith(
+        "state eq 'completed' and stateTransitionTime ge datetime'"
+    )
+    assert lists[2] == ("job", "state ne 'completed'", "id")
+    assert len(lists) == 3
+    recent = batch_client.task.list(
+        "job", task_list_options=batchmodels.TaskListOptions(filter=lists[1][1])
+    )
+    assert [task.id for task in recent] == task_ids[2:]
+
+
+def test_save_task_output(azure_batch_manager, tmp_path):
+    batch_client = FakeBatchServiceClient(latency=0.02)
+    batch_client.job.add(type("Job", (), {"id": "job"}))
+    azure_batch_manager.add_tasks(
+        batch_client, "job", "person.csv", "person_map.json", shards=40
+    )
+    task_ids = list(batch_client.tasks["job"])
+    for task_id in task_ids[:-1]:
+        batch_client.complete(
+            "job", task_id, stdout=task_id.encode() * 100, stderr=b""
+        )
+    # The last task never ran, it has no output files
+    start = time.perf_counter()
+    saved = azure_batch_manager.save_task_output(
+        batch_client, "job", output_dir=str(tmp_path)
+    )
+    elapsed = time.perf_counter() - start
+
+    # 80 sequential file requests would take 1.6s
+    assert elapsed < 0.75
+    assert list(saved) == task_ids
+    node_id, (stdout_file, stderr_file) = saved[task_ids[0]]
+    assert node_id == "node-0"
+    with open(stdout_file, "rb") as f:
+        assert f.read() == task_ids[0].encode() * 100
+    assert saved[task_ids[-1]] == (None, (None, None))
+    # Tasks are listed once, with their node info, and never fetched again
+    assert batch_client.calls_to("task.list") == [("job", None, "id,nodeInfo")]
+
+
+def test_save_task_output_tail(azure_batch_manager, batch_client, tmp_path):
+    azure_batch_manager.add_tasks(batch_client, "job", "person.csv", "person_map.json")
+    task_id = list(batch_client.tasks["job"])[0]
+    batch_client.complete("job", task_id, stdout=b"x" * 1000 + b"last line\n", stderr=b"e")
+    saved = azure_batch_manager.save_task_output(
+        batch_client, "job", output_dir=str(tmp_path), tail_bytes=10
+    )
+    stdout_file, stderr_file = saved[task_id][1]
+    with open(stdout_file, "rb") as f:
+        assert f.read() == b"last line\n"
+    with open(stderr_file, "rb") as f:
+        assert f.read() == b"e"
+    ranges = [call[-1] for call in batch_client.calls_to("file.get_from_task")]
+    assert ranges == ["bytes=1000-1009", None]
+
+
+def test_staged_tasks_declare_resource_and_output_files(
+    azure_batch_manager, batch_client
+):
+    azure_batch_manager.stage_files(
+        "https://acct.blob.core.windows.net/input?sig=r",
+        [
+            "https://acct.blob.core.windows.net/output?sig=w",
+            "https://lake.blob.core.windows.net/transformations?sig=w",
+        ],
+    )
+    azure_batch_manager.add_tasks(
+        batch_client, "job", "person.csv", "person_map.json", shards=2
+    )
+    task = batch_client.added["job"]["CDMInsert-00001"]
+    assert task.command_line.endswith(
+        "etl_manager.py --local --shard 1 2 person.csv person_map.json"
+    )
+    # Shards read their own byte range of the data blob
+    assert [(r.http_url, r.file_path) for r in task.resource_files] == [
+        (
+            "https://acct.blob.core.windows.net/input/person_map.json?sig=r",
+            "file_input/person_map.json",
+        ),
+    ]
+    assert [
+        (o.file_pattern, o.destination.container.container_url)
+        for o in task.output_files
+    ] == [
+        ("file_output/*.csv", "https://acct.blob.core.windows.net/output?sig=w"),
+        ("file_output/*.parquet", "https://acct.blob.core.windows.net/output?sig=w"),
+        (
+            "file_output/*.csv",
+            "https://lake.blob.core.windows.net/transformations?sig=w",
+        ),
+        (
+            "file_output/*.parquet",
+            "https://lake.blob.core.windows.net/transformations?sig=w",
+        ),
+    ]
+    assert task.output_files[0].upload_options.upload_condition == "tasksuccess"
+
+
+def test_unstaged_tasks_download_their_own_inputs(azure_batch_manager, batch_client):
+    azure_batch_manager.add_tasks(batch_client, "job", "person.csv", "person_map.json")
+    task = batch_client.added["job"]["CDMInsert-00000"]
+    assert task.command_line.endswith("etl_manager.py person.csv person_map.json")
+    assert task.resource_files is None and task.output_files is None
+
+
+def test_run_manifest_skips_cached_pairs(azure_batch_manager, monkeypatch):
+    etl_manager = Mock()
+    etl_manager.cached_result.side_effect = lambda data_file, mapping_file: (
+        "key",
+        {"rows": 50} if data_file == "cached.csv" else None,
+    )
+    monkeypatch.setattr(
+        "etl.src.azure_batch_manager.EtlManager", lambda: etl_manager
+    )
+    monkeypatch.setattr("etl.src.azure_batch_manager._BATCH_STAGE_FILES", False)
+    run_tasks = Mock()
+    monkeypatch.setattr(azure_batch_manager, "run_tasks", run_tasks)
+
+    azure_batch_manager.run_manifest(
+        [("cached.csv", "map.json"), ("new.csv", "map.json")]
+    )
+    (tasks,), _ = run_tasks.call_args
+    assert [task.command_line.split()[-2] for task in tasks] == ["new.csv"]
+
+    run_tasks.reset_mock()
+    azure_batch_manager.run_job("cached.csv", "map.json")
+    run_tasks.assert_not_called()
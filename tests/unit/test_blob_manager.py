@@ -0,0 +1,345 @@
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from azure.core.exceptions import ServiceResponseError
+
+from etl.src.blob_manager import BlobManager
+from etl.src.transform_manager import TransformManager
+from tests.unit.fake_blob_service import FakeBlobClient, FakeBlobServiceClient
+
+_CONNECTION_STRING = "UseFakeBlobService"
+
+
+def make_container(root, blob_count):
+    container = root / "input"
+    container.mkdir()
+    for i in range(blob_count):
+        (container / "extract_{}.csv".format(i)).write_text("a,b\n1,2\n")
+    return container
+
+
+@pytest.mark.parametrize("blob_count", [1, 100, 1000])
+def test_download_cost_does_not_depend_on_blob_count(tmp_path, blob_count):
+    store = tmp_path / "store"
+    store.mkdir()
+    make_container(store, blob_count)
+    service = FakeBlobServiceClient(str(store))
+    blob_manager = BlobManager(service)
+
+    download_file = tmp_path / "extract_0.csv"
+    assert blob_manager.download_blob_file(
+        _CONNECTION_STRING, "input", str(download_file)
+    ) == str(download_file)
+    assert download_file.read_text() == "a,b\n1,2\n"
+    assert service.calls["blobs_listed"] == 0
+    assert sum(service.calls.values()) == 2
+
+
+def test_download_missing_blob(tmp_path):
+    store = tmp_path / "store"
+    store.mkdir()
+    make_container(store, 3)
+    blob_manager = BlobManager(FakeBlobServiceClient(str(store)))
+    assert (
+        blob_manager.download_blob_file(
+            _CONNECTION_STRING, "input", str(tmp_path / "missing.csv")
+        )
+        is None
+    )
+
+
+def test_upload_checks_container_once(tmp_path):
+    store = tmp_path / "store"
+    store.mkdir()
+    service = FakeBlobServiceClient(str(store))
+    blob_manager = BlobManager(service)
+    upload_file = tmp_path / "out.csv"
+    upload_file.write_text("x\n")
+    for _ in range(5):
+        blob_manager.upload_blob_file(_CONNECTION_STRING, "output", str(upload_file))
+    assert (store / "output" / "out.csv").read_text() == "x\n"
+    assert service.calls["container_exists"] == 1
+    assert service.calls["create_container"] == 1
+    assert service.calls["upload_blob"] == 5
+    assert service.calls["list_containers"] == 0
+
+
+def test_block_upload_and_download_round_trip(tmp_path):
+    store = tmp_path / "store"
+    store.mkdir()
+    service = FakeBlobServiceClient(str(store))
+    progress = []
+    blob_manager = BlobManager(
+        service,
+        block_size=1000,
+        max_concurrency=3,
+        progress_callback=lambda done, total, seconds: progress.append((done, total)),
+    )
+    payload = os.urandom(10_500)
+    upload_file = tmp_path / "big.bin"
+    upload_file.write_bytes(payload)
+
+    blob_manager.upload_blob_file(_CONNECTION_STRING, "output", str(upload_file))
+    assert service.calls["stage_block"] == 11
+    assert service.calls["commit_block_list"] == 1
+    assert progress[-1] == (10_500, 10_500)
+
+    download_file = tmp_path / "download" / "big.bin"
+    download_file.parent.mkdir()
+    blob_manager.download_blob_file(_CONNECTION_STRING, "output", str(download_file))
+    assert download_file.read_bytes() == payload
+    assert service.calls["download_blob"] == 11
+    assert sorted(os.listdir(download_file.parent)) == ["big.bin"]
+
+
+@pytest.mark.parametrize("size", [500, 2500])
+def test_upload_sets_content_type_from_extension(tmp_path, size):
+    service = FakeBlobServiceClient(str(tmp_path / "store"))
+    blob_manager = BlobManager(service, block_size=1000)
+    for name in ("person_transformed.parquet", "person_transformed.csv", "big.bin"):
+        upload_file = tmp_path / name
+        upload_file.write_bytes(os.urandom(size))
+        blob_manager.upload_blob_file(_CONNECTION_STRING, "output", str(upload_file))
+    output = str(tmp_path / "store" / "output")
+    assert service.content_types == {
+        os.path.join(output, "person_transformed.parquet"): (
+            "application/vnd.apache.parquet"
+        ),
+        os.path.join(output, "person_transformed.csv"): "text/csv",
+        os.path.join(output, "big.bin"): None,
+    }
+
+
+def test_download_retries_transient_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr("etl.src.blob_manager.time.sleep", lambda seconds: None)
+    store = tmp_path / "store"
+    (store / "input").mkdir(parents=True)
+    payload = os.urandom(5_000)
+    (store / "input" / "big.bin").write_bytes(payload)
+    service = FakeBlobServiceClient(str(store), fail_downloads=2)
+    blob_manager = BlobManager(service, block_size=1000, max_concurrency=1)
+
+    download_file = tmp_path / "big.bin"
+    blob_manager.download_blob_file(_CONNECTION_STRING, "input", str(download_file))
+    assert download_file.read_bytes() == payload
+    assert service.calls["download_blob"] == 7
+
+
+def test_download_resumes_from_last_completed_block(tmp_path, monkeypatch):
+    monkeypatch.setattr("etl.src.blob_manager._BLOB_MAX_RETRIES", 0)
+    store = tmp_path / "store"
+    (store / "input").mkdir(parents=True)
+    payload = os.urandom(5_000)
+    (store / "input" / "big.bin").write_bytes(payload)
+    service = FakeBlobServiceClient(str(store))
+    blob_manager = BlobManager(service, block_size=1000, max_concurrency=1)
+    download_file = tmp_path / "big.bin"
+
+    # Fail the fourth block read, with no retries left
+    real_download = FakeBlobClient.download_blob
+
+    def failing_download(self, offset=None, length=None, **kwargs):
+        if offset == 3000:
+            raise ServiceResponseError("Connection reset by peer")
+        return real_download(self, offset, length, **kwargs)
+
+    monkeypatch.setattr(FakeBlobClient, "download_blob", failing_download)
+    assert (
+        blob_manager.download_blob_file(_CONNECTION_STRING, "input", str(download_file))
+        is None
+    )
+    assert json.loads((tmp_path / "big.bin.progress").read_text())["offset"] == 3000
+
+    monkeypatch.setattr(FakeBlobClient, "download_blob", real_download)
+    service.calls.clear()
+    blob_manager.download_blob_file(_CONNECTION_STRING, "input", str(download_file))
+    assert download_file.read_bytes() == payload
+    # Only the blocks from 3000 onwards are read again
+    assert service.calls["download_blob"] == 2
+
+
+def test_download_restarts_when_blob_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr("etl.src.blob_manager._BLOB_MAX_RETRIES", 0)
+    store = tmp_path / "store"
+    (store / "input").mkdir(parents=True)
+    blob_path = store / "input" / "big.bin"
+    blob_path.write_bytes(os.urandom(5_000))
+    service = FakeBlobServiceClient(str(store))
+    blob_manager = BlobManager(service, block_size=1000, max_concurrency=1)
+    download_file = tmp_path / "big.bin"
+
+    # The blob is overwritten part way through the download
+    real_download = FakeBlobClient.download_blob
+    payload = os.urandom(5_000)
+
+    def overwriting_download(self, offset=None, length=None, **kwargs):
+        if offset == 3000:
+            blob_path.write_bytes(payload)
+            os.utime(str(blob_path), ns=(1, 1))
+        return real_download(self, offset, length, **kwargs)
+
+    monkeypatch.setattr(FakeBlobClient, "download_blob", overwriting_download)
+    assert (
+        blob_manager.download_blob_file(_CONNECTION_STRING, "input", str(download_file))
+        is None
+    )
+    # Reads after the overwrite fail instead of mixing in the new content
+    assert json.loads((tmp_path / "big.bin.progress").read_text())["offset"] == 3000
+
+    monkeypatch.setattr(FakeBlobClient, "download_blob", real_download)
+    service.calls.clear()
+    blob_manager.download_blob_file(_CONNECTION_STRING, "input", str(download_file))
+    assert download_file.read_bytes() == payload
+    # The partial file of the old version is not reused
+    assert service.calls["download_blob"] == 5
+
+
+def test_download_blob_shard_reads_only_its_range(tmp_path, monkeypatch):
+    monkeypatch.setattr("etl.src.blob_manager._LINE_SCAN_BYTES", 16)
+    store = tmp_path / "store"
+    (store / "input").mkdir(parents=True)
+    data = b"id,name\n" + b"".join(
+        "{},name {}\n".format(i, i * 7).encode() for i in range(500)
+    )
+    (store / "input" / "big.csv").write_bytes(data)
+    blob_manager = BlobManager(FakeBlobServiceClient(str(store)), block_size=256)
+    header, ranges = TransformManager().split_ranges(
+        str(store / "input" / "big.csv"), 4
+    )
+
+    real_download = FakeBlobClient.download_blob
+    read = []
+
+    def counting_download(self, offset=None, length=None, **kwargs):
+        read.append(length)
+        return real_download(self, offset, length, **kwargs)
+
+    monkeypatch.setattr(FakeBlobClient, "download_blob", counting_download)
+    for shard, (start, end) in enumerate(ranges):
+        download_file = tmp_path / "shard{}".format(shard) / "big.csv"
+        download_file.parent.mkdir()
+        del read[:]
+        assert blob_manager.download_blob_shard(
+            _CONNECTION_STRING, "input", str(download_file), shard, 4
+        ) == str(download_file)
+        # The same split as a local file, with its header
+        assert download_file.read_bytes() == header + data[start:end]
+        assert sum(read) < len(data) / 2
+
+
+def test_concurrent_downloads_to_one_target(tmp_path):
+    store = tmp_path / "store"
+    (store / "input").mkdir(parents=True)
+    data = os.urandom(20_000)
+    (store / "input" / "map.bin").write_bytes(data)
+    blob_manager = BlobManager(
+        FakeBlobServiceClient(str(store), latency=0.005),
+        block_size=1000,
+        max_concurrency=4,
+    )
+    download_file = str(tmp_path / "map.bin")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(
+                lambda _: blob_manager.download_blob_file(
+                    _CONNECTION_STRING, "input", download_file
+                ),
+                range(8),
+            )
+        )
+    assert results == [download_file] * 8
+    assert (tmp_path / "map.bin").read_bytes() == data
+    assert sorted(os.listdir(tmp_path)) == ["map.bin", "store"]
+
+
+def test_stream_upload_and_download(tmp_path):
+    store = tmp_path / "store"
+    store.mkdir()
+    service = FakeBlobServiceClient(str(store))
+    blob_manager = BlobManager(service, block_size=1000)
+    pieces = [os.urandom(n) for n in (10, 999, 2500, 1)]
+
+    uploaded = blob_manager.upload_blob_stream(
+        _CONNECTION_STRING, "output", "stream.bin", iter(pieces)
+    )
+    assert uploaded == sum(len(p) for p in pieces)
+    assert service.calls["stage_block"] == 4
+    assert b"".join(
+        blob_manager.iter_blob_chunks(_CONNECTION_STRING, "output", "stream.bin")
+    ) == b"".join(pieces)
+
+
+@pytest.mark.parametrize("codec, extension", [("gzip", ".gz"), ("zstd", ".zst")])
+def test_compressed_upload_and_download(tmp_path, codec, extension):
+    store = tmp_path / "store"
+    store.mkdir()
+    service = FakeBlobServiceClient(str(store))
+    blob_manager = BlobManager(service, block_size=1000, compression=codec)
+    payload = b"Id,MODALITY_DESCRIPTION\r\n" + b"".join(
+        b"%d,Digital Radiography\r\n" % i for i in range(2000)
+    )
+    upload_file = tmp_path / "person_transformed.csv"
+    upload_file.write_bytes(payload)
+
+    blob_manager.upload_blob_file(_CONNECTION_STRING, "output", str(upload_file))
+    blob_name = "person_transformed.csv" + extension
+    blob_path = str(store / "output" / blob_name)
+    assert os.listdir(str(store / "output")) == [blob_name]
+    assert os.path.getsize(blob_path) < len(payload) // 5
+    assert service.metadata[blob_path] == {"compression": codec}
+    assert service.content_types[blob_path] == "text/csv"
+    assert b"".join(
+        blob_manager.iter_blob_chunks(_CONNECTION_STRING, "output", blob_name)
+    ) == payload
+
+    # Streams are compressed the same way
+    blob_manager.upload_blob_stream(
+        _CONNECTION_STRING, "output", "stream.csv", iter([payload[:10], payload[10:]])
+    )
+    assert b"".join(
+        blob_manager.iter_blob_chunks(
+            _CONNECTION_STRING, "output", "stream.csv" + extension
+        )
+    ) == payload
+
+    # Downloads keep the content compressed, for transforms to read directly
+    (tmp_path / "download").mkdir()
+    downloaded = blob_manager.download_blob_file(
+        _CONNECTION_STRING, "output", str(tmp_path / "download" / blob_name)
+    )
+    assert downloaded == str(tmp_path / "download" / blob_name)
+    with open(downloaded, "rb") as f:
+        assert f.read() == open(blob_path, "rb").read()
+
+
+def test_download_names_file_for_codec_in_metadata(tmp_path):
+    store = tmp_path / "store"
+    service = FakeBlobServiceClient(str(store))
+    blob_manager = BlobManager(service)
+    blob_client = blob_manager.get_container_client(
+        _CONNECTION_STRING, "input", create=True
+    ).get_blob_client("person.csv")
+    blob_client.upload_blob(gzip.compress(b"a,b\r\n"), metadata={"compression": "gzip"})
+
+    downloaded = blob_manager.download_blob_file(
+        _CONNECTION_STRING, "input", str(tmp_path / "person.csv")
+    )
+    assert downloaded == str(tmp_path / "person.csv.gz")
+    assert gzip.decompress((tmp_path / "person.csv.gz").read_bytes()) == b"a,b\r\n"
+    assert b"".join(
+        blob_manager.iter_blob_chunks(_CONNECTION_STRING, "input", "person.csv")
+    ) == b"a,b\r\n"
+
+
+def test_container_sas_url():
+    connection_string = (
+        "DefaultEndpointsProtocol=https;AccountName=acct;"
+        "AccountKey=a2V5a2V5a2V5a2V5;EndpointSuffix=core.windows.net"
+    )
+    url = BlobManager().container_sas_url(connection_string, "input", "r")
+    container_url, _, sas_token = url.partition("?")
+    assert container_url == "https://acct.blob.core.windows.net/input"
+    assert "sp=r" in sas_token and "sig=" in sas_token and "se=" in sas_token
@@ -0,0 +1,71 @@
+import gzip
+
+import pytest
+import zstandard
+
+from etl.src.compression_manager import CompressionManager
+
+_PAYLOAD = b"Id,MODALITY_DESCRIPTION\r\n" + b"".join(
+    b"%d,Digital Radiography\r\n" % i for i in range(5000)
+)
+
+
+def split(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+@pytest.mark.parametrize("chunk_size", [1, 1000, 1 << 20])
+def test_compress_and_decompress_round_trip(codec, chunk_size):
+    compressed = b"".join(CompressionManager(codec).compress(split(_PAYLOAD, 4096)))
+    assert len(compressed) < len(_PAYLOAD) // 5
+    chunks = CompressionManager.decompress(split(compressed, chunk_size), codec)
+    assert b"".join(chunks) == _PAYLOAD
+
+
+@pytest.mark.parametrize(
+    "codec, compress",
+    [("gzip", gzip.compress), ("zstd", zstandard.ZstdCompressor().compress)],
+)
+def test_decompress_concatenated_members(codec, compress):
+    compressed = compress(b"a,b\r\n") + compress(b"1,2\r\n")
+    chunks = CompressionManager.decompress(split(compressed, 7), codec)
+    assert b"".join(chunks) == b"a,b\r\n1,2\r\n"
+
+
+def test_no_codec_passes_chunks_through():
+    assert list(CompressionManager(None).compress([b"a", b"b"])) == [b"a", b"b"]
+    assert list(CompressionManager.decompress([b"a"], None)) == [b"a"]
+
+
+def test_codec_from_extension_or_metadata():
+    assert CompressionManager.codec_for("person.csv.gz") == "gzip"
+    assert CompressionManager.codec_for("person.csv.ZST") == "zstd"
+    assert CompressionManager.codec_for("person.csv", {"compression": "zstd"}) == "zstd"
+    assert CompressionManager.codec_for("person.csv", {}) is None
+    assert CompressionManager.strip_extension("person.csv.gz") == "person.csv"
+    assert CompressionManager.strip_extension("person.csv") == "person.csv"
+    zstd = CompressionManager("zstd")
+    assert zstd.compressed_name("person.csv") == "person.csv.zst"
+    assert zstd.compressed_name("person.csv.gz") == "person.csv.gz"
+    assert zstd.metadata("person.csv") == {"compression": "zstd"}
+    assert CompressionManager(None).metadata("person.csv") is None
+    with pytest.raises(ValueError):
+        CompressionManager("lz4")
+
+
+@pytest.mark.parametrize(
+    "name, compress",
+    [
+        ("person.csv", bytes),
+        ("person.csv.gz", gzip.compress),
+        ("person.csv.zst", zstandard.ZstdCompressor().compress),
+    ],
+)
+def test_open_source_reads_lines(tmp_path, name, compress):
+    source_file = tmp_path / name
+    source_file.write_bytes(compress(_PAYLOAD))
+    with CompressionManager.open_source(str(source_file)) as source:
+        lines = list(source)
+    assert lines[0] == b"Id,MODALITY_DESCRIPTION\r\n"
+    assert b"".join(lines) == _PAYLOAD
@@ -0,0 +1,145 @@
+import petl
+import pytest
+
+from etl.src.checkpoint_manager import CheckpointManager
+from etl.src.data_mappings import ColumnMappings, DataMappings
+from etl.src.db_manager import DBManager
+
+
+class RecordingCursor:
+    """Cursor that records executed statements"""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+
+
+@pytest.fixture()
+def db_manager():
+    """Return DB Manager"""
+    return DBManager()
+
+
+def test_insert_data_single_pass(db_manager, tmp_path, monkeypatch):
+    input_file = tmp_path / "person.csv"
+    input_file.write_text(
+        "Id,DATE,BODYSITE_CODE,MODALITY_DESCRIPTION,EXTRA\n"
+        "a,2012-04-08T02:13:28Z,51299004,Digital Radiography,x\n"
+        "b,2018-01-01T07:36:11Z,344001,Digital Radiography,y\n"
+    )
+    # Every iteration of a lazy petl table reads the file again
+    reads = []
+    fromcsv = petl.fromcsv
+
+    class CountingTable(petl.Table):
+        def __init__(self, table):
+            self._table = table
+
+        def __iter__(self):
+            reads.append(1)
+            return iter(self._table)
+
+    monkeypatch.setattr(
+        petl,
+        "fromcsv",
+        lambda source, **kwargs: CountingTable(fromcsv(source, **kwargs)),
+    )
+    cursor = RecordingCursor()
+    rows = db_manager.insert_data(None, cursor, str(input_file))
+    assert rows == 2
+    assert len(reads) == 1
+    assert len(cursor.statements) == 2
+    assert "'344001','Digital Radiography')" in cursor.statements[1]
+
+
+def test_insert_data_resumes_from_checkpoint(db_manager, tmp_path):
+    input_file = tmp_path / "person.csv"
+    input_file.write_text(
+        "Id,DATE,BODYSITE_CODE,MODALITY_DESCRIPTION\n"
+        + "".join("{0},2018-01-01,{0},CT\n".format(i) for i in range(7))
+    )
+
+    class Connection:
+        commits = 0
+
+        def commit(self):
+            self.commits += 1
+
+    class CrashingCursor(RecordingCursor):
+        def execute(self, statement, params=None):
+            if len(self.statements) == 5:
+                raise RuntimeError("node lost")
+            super().execute(statement, params)
+
+    checkpoint = CheckpointManager(str(tmp_path / "state"))
+    db_manager.insert_data(
+        Connection(), CrashingCursor(), str(input_file), checkpoint, commit_every=2
+    )
+    assert checkpoint.load()["rows_committed"] == 4
+
+    cursor = RecordingCursor()
+    rows = db_manager.insert_data(
+        Connection(), cursor, str(input_file), checkpoint, commit_every=2
+    )
+    assert rows == 7
+    assert len(cursor.statements) == 3
+    assert "'4','CT')" in cursor.statements[0]
+    assert checkpoint.load() is None
+
+
+def test_upsert_rows_merges_from_staging(db_manager):
+    class Connection:
+        def commit(self):
+            pass
+
+    cursor = RecordingCursor()
+    rows = db_manager.upsert_rows(
+        Connection(),
+        cursor,
+        "person_transformed",
+        ["personId", "BodySiteCode"],
+        ["personId"],
+        [("a", "1"), ("b", "2")],
+    )
+    assert rows == 2
+    staging, insert, merge, drop = cursor.statements
+    assert "INTO #staging_person_transformed FROM person_transformed" in staging
+    assert insert.startswith("INSERT INTO #staging_person_transformed")
+    assert "MERGE person_transformed AS target" in merge
+    assert "ON target.personId = source.personId" in merge
+    assert "UPDATE SET BodySiteCode = source.BodySiteCode" in merge
+    assert drop == "DROP TABLE #staging_person_transformed"
+
+
+def test_create_mapped_table_maps_sql_server_types(db_manager):
+    data_mappings = DataMappings("person.csv", "person_transformed.csv")
+    for sink, physical_type in [
+        ("personId", "uniqueidentifier"),
+        ("personDOB", "datetime2"),
+        ("BodySiteCode", "int"),
+        ("Modality", "nvarchar"),
+        ("Active", "Boolean"),
+    ]:
+        data_mappings._column_mappings.append(
+            ColumnMappings(sink, "", physical_type, sink, "", physical_type)
+        )
+    data_mappings._table_name = "person_transformed"
+    data_mappings._key_columns = ["personId"]
+    cursor = RecordingCursor()
+    db_manager.create_mapped_table(cursor, data_mappings)
+    assert (
+        "(personId uniqueidentifier NOT NULL, personDOB datetime2, "
+        "BodySiteCode int, Modality nvarchar(255), Active bit, "
+        "PRIMARY KEY (personId))"
+    ) in cursor.statements[0]
+
+    data_mappings._key_columns = []
+    with pytest.raises(ValueError, match="no key columns"):
+        db_manager.create_mapped_table(cursor, data_mappings)
+    data_mappings._key_columns = ["personId"]
+    data_mappings._column_mappings[0]._destination_column_physical_type = "xml"
+    with pytest.raises(ValueError, match="Unsupported physicalType 'xml'"):
+        db_manager.create_mapped_table(cursor, data_mappings)
+    assert len(cursor.statements) == 1
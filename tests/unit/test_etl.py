@@ -1,19 +1,325 @@
 from unittest.mock import patch
+import csv
+import gzip
+import io
 import os
+import shutil
 import pytest
 from unittest.mock import Mock, patch
 
-from etl.src.etl_manager import EtlManager
+from etl.src.adls2_manager import ADLS2Manager
+from etl.src.blob_manager import BlobManager
+from etl.src.checkpoint_manager import BlobCheckpointManager, CheckpointManager
+from etl.src.sqlite_db_manager import SqliteDBManager
+from tests.unit.fake_blob_service import FakeBlobClient
 
 
-@pytest.fixture()
-def etl_manager():
-    """Return main ETL Manager"""
-    return EtlManager()
-
-    
 def test_etl_manager(etl_manager):
     assert etl_manager is not None
 
 
+def test_parse_mapping_file_uses_plan_cache(etl_manager, tmp_path, monkeypatch):
+    monkeypatch.setattr("etl.src.etl_manager._PLAN_CACHE_DIR", str(tmp_path))
+    data_mappings = etl_manager.parse_mapping_file("./file_input/person_map.json")
+    assert data_mappings._projection_plan._output_header == (
+        "personId",
+        "personDOB",
+        "BodySiteCode",
+        "ModalityDescription",
+    )
+    assert len(os.listdir(tmp_path)) == 1
+
+    with patch("etl.src.etl_manager.JsonManager") as json_manager:
+        cached = etl_manager.parse_mapping_file("./file_input/person_map.json")
+    json_manager.assert_not_called()
+    assert cached.to_dict() == data_mappings.to_dict()
+
+
+def test_transform_and_load_raises_failed_loads(etl_manager, monkeypatch):
+    db_manager = Mock()
+    monkeypatch.setattr("etl.src.etl_manager.DBManager", lambda: db_manager)
+    db_manager.parallel_upsert_data.return_value = 50
+    assert etl_manager.transform_and_load("person_transformed.csv", Mock()) == 50
+
+    db_manager.parallel_upsert_data.side_effect = RuntimeError("deadlock")
+    with pytest.raises(RuntimeError, match="deadlock"):
+        etl_manager.transform_and_load("person_transformed.csv", Mock())
+
+
+def test_batch_tasks_checkpoint_to_blob_storage(etl_workspace, monkeypatch):
+    etl_manager = etl_workspace.etl_manager
+    output_file = ".//file_output//person_transformed.csv"
+    assert type(etl_manager.checkpoint_manager(output_file)) is CheckpointManager
+
+    monkeypatch.setenv("AZ_BATCH_TASK_ID", "CDMInsert-00000")
+    checkpoint = etl_manager.checkpoint_manager(output_file)
+    assert isinstance(checkpoint, BlobCheckpointManager)
+    checkpoint.save(rows=5)
+    state_blob = "person_transformed.csv.checkpoint.json"
+    assert (etl_workspace.store / "checkpoints" / state_blob).exists()
+
+
+def test_run_manifest(etl_workspace, monkeypatch):
+    etl_manager = etl_workspace.etl_manager
+    inputs = etl_workspace.store / "input"
+    shutil.copy(str(inputs / "person.csv"), str(inputs / "person2.csv"))
+
+    def download_inputs(data_file, mapping_file, mapping_downloads=None):
+        if not (inputs / data_file).exists():
+            raise RuntimeError("missing {}".format(data_file))
+        for name in (data_file, mapping_file):
+            shutil.copy(str(inputs / name), ".//file_input//{}".format(name))
+        return (
+            ".//file_input//{}".format(data_file),
+            ".//file_input//{}".format(mapping_file),
+        )
+
+    uploaded = []
+    monkeypatch.setattr(etl_manager, "download_inputs", download_inputs)
+    monkeypatch.setattr(etl_manager, "upload_outputs", uploaded.append)
+
+    results = etl_manager.run_manifest(
+        [
+            ("person.csv", "person_map.json"),
+            ("missing.csv", "person_map.json"),
+            ("person2.csv", "person_map.json"),
+        ],
+        io_workers=2,
+        transform_workers=2,
+    )
+    assert [r["status"] for r in results] == ["success", "failed", "success"]
+    assert results[0]["rows"] == 50
+    assert results[1]["stage"] == "download"
+    assert sorted(uploaded) == [
+        ".//file_output//person2_transformed.csv",
+        ".//file_output//person_transformed.csv",
+    ]
+
+
+def test_run_manifest_downloads_shared_mapping_once(etl_workspace, monkeypatch):
+    etl_manager = etl_workspace.etl_manager
+    data_files = ["person{:02d}.csv".format(i) for i in range(12)]
+    for name in data_files:
+        shutil.copy(
+            str(etl_workspace.store / "input" / "person.csv"),
+            str(etl_workspace.store / "input" / name),
+        )
+    etl_workspace.blob_service.latency = 0.005
+    downloads = []
+    real_download = FakeBlobClient.download_blob
+
+    def counting_download(self, *args, **kwargs):
+        downloads.append(os.path.basename(self._path))
+        return real_download(self, *args, **kwargs)
+
+    monkeypatch.setattr(FakeBlobClient, "download_blob", counting_download)
+
+    results = etl_manager.run_manifest(
+        [(name, "person_map.json") for name in data_files],
+        io_workers=8,
+        transform_workers=2,
+    )
+    assert [r["status"] for r in results] == ["success"] * 12
+    assert downloads.count("person_map.json") == 1
+
+    with pytest.raises(RuntimeError, match="missing.csv or person_map.json"):
+        etl_manager.download_inputs("missing.csv", "person_map.json")
+
+
+def test_run_job_streaming(etl_workspace):
+    result = etl_workspace.etl_manager.run_job_streaming(
+        "person.csv", "person_map.json"
+    )
+
+    assert result["status"] == "success"
+    assert result["rows"] == 50
+    expected = etl_workspace.expected.read_bytes()
+    assert (etl_workspace.store / "output" / "person_transformed.csv").read_bytes() == (
+        expected
+    )
+    lake_file = etl_workspace.lake / "transformations" / "person_transformed.csv"
+    assert lake_file.read_bytes() == expected
+    assert os.listdir("file_input") == ["person_map.json"]
+
+
+def test_transform_fan_out(etl_workspace):
+    etl_manager = etl_workspace.etl_manager
+    with open(os.path.join(etl_workspace.data_dir, "person.csv"), "rb") as f:
+        source = f.read()
+    db_manager = SqliteDBManager(str(etl_workspace.work / "persons.db"))
+    source_reads = []
+
+    def source_chunks():
+        for i in range(0, len(source), 512):
+            source_reads.append(i)
+            yield source[i : i + 512]
+
+    rows = etl_manager.transform_fan_out(
+        etl_workspace.data_mappings, source_chunks(), db_manager
+    )
+
+    assert rows == 50
+    # The source is parsed exactly once
+    assert len(source_reads) == len(set(source_reads))
+    output = etl_workspace.expected.read_bytes()
+    for output_file in (
+        etl_workspace.work / "file_output" / "person_transformed.csv",
+        etl_workspace.store / "output" / "person_transformed.csv",
+    ):
+        assert output_file.read_bytes() == output
+    lake_file = etl_workspace.lake / "transformations" / "person_transformed.csv"
+    assert lake_file.read_bytes() == output
+    # Repeated personIds are upserted, the last row wins
+    latest = {row[0]: tuple(row) for row in csv.reader(io.StringIO(output.decode()))}
+    del latest["personId"]
+    conn = db_manager.connect_to_db()
+    stored = conn.execute("SELECT * FROM person_transformed").fetchall()
+    assert sorted(stored) == sorted(latest.values())
+
+
+def test_transform_shard(etl_workspace):
+    source = os.path.join(etl_workspace.data_dir, "person.csv")
+    mapping = os.path.join(etl_workspace.data_dir, "person_map.json")
+
+    header, rows = None, []
+    for shard in range(3):
+        output_file, count = etl_workspace.etl_manager.transform_shard(
+            source, mapping, shard, 3
+        )
+        assert output_file.endswith("person_transformed_part{:04d}.csv".format(shard))
+        with open(output_file, "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+        header = lines[0]
+        rows.extend(lines[1:])
+        assert count == len(lines) - 1
+    assert header + b"".join(rows) == etl_workspace.expected.read_bytes()
+
+
+def test_run_job_with_inputs_local(etl_workspace):
+    etl_manager = etl_workspace.etl_manager
+    for name in ("person.csv", "person_map.json"):
+        shutil.copy(str(etl_workspace.store / "input" / name), "file_input")
+
+    result = etl_manager.run_job("person.csv", "person_map.json", inputs_local=True)
+
+    assert result["status"] == "success"
+    assert result["rows"] == 50
+    assert (etl_workspace.work / "file_output" / "person_transformed.csv").exists()
+    # Batch staged the inputs and uploads the output, only the input
+    # fingerprints of the cache key are read
+    assert set(etl_workspace.blob_service.calls) == {"get_blob_properties"}
+
+    missing = etl_manager.run_job("missing.csv", "person_map.json", inputs_local=True)
+    assert missing["status"] == "failed"
+
+
+def test_run_job_shard_downloads_its_range(etl_workspace):
+    shutil.copy(str(etl_workspace.store / "input" / "person_map.json"), "file_input")
+
+    header, rows = None, []
+    for shard in range(3):
+        result = etl_workspace.etl_manager.run_job_shard(
+            "person.csv", "person_map.json", shard, 3, inputs_local=True
+        )
+        assert result["status"] == "success"
+        with open(result["output_file"], "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+        header = lines[0]
+        rows.extend(lines[1:])
+    assert header + b"".join(rows) == etl_workspace.expected.read_bytes()
+
+
+def test_run_job_skips_unchanged_inputs(etl_workspace, monkeypatch):
+    etl_manager = etl_workspace.etl_manager
+    blob_service = etl_workspace.blob_service
+    monkeypatch.setattr(etl_manager, "get_adls2_manager", Mock)
+
+    first = etl_manager.run_job("person.csv", "person_map.json")
+    assert first["status"] == "success"
+
+    blob_service.calls.clear()
+    second = etl_manager.run_job("person.csv", "person_map.json")
+    assert second["status"] == "cached"
+    assert second["rows"] == 50
+    assert second["output_file"] == first["output_file"]
+    assert set(blob_service.calls) == {"get_blob_properties"}
+
+    data_file = etl_workspace.store / "input" / "person.csv"
+    with open(str(data_file), "a") as f:
+        f.write("\n" + open(str(data_file)).readlines()[-1])
+    changed = etl_manager.run_job("person.csv", "person_map.json")
+    assert changed["status"] == "success"
+    assert changed["rows"] == 51
+
+
+def test_cached_result_with_removed_output_is_a_miss(etl_workspace):
+    etl_manager = etl_workspace.etl_manager
+
+    assert etl_manager.run_job("person.csv", "person_map.json")["status"] == "success"
+    cached = etl_manager.run_job("person.csv", "person_map.json")
+    assert cached["status"] == "cached"
+    assert cached["output_blob"] == "person_transformed.csv"
+
+    os.remove(str(etl_workspace.lake / "transformations" / "person_transformed.csv"))
+    assert etl_manager.run_job("person.csv", "person_map.json")["status"] == "success"
+    os.remove(str(etl_workspace.store / "output" / "person_transformed.csv"))
+    assert etl_manager.run_job("person.csv", "person_map.json")["status"] == "success"
+    assert etl_manager.run_job("person.csv", "person_map.json")["status"] == "cached"
+
+
+def test_transform_data_streaming_parquet(etl_workspace):
+    etl_manager = etl_workspace.etl_manager
+    data_mappings = etl_workspace.data_mappings
+    shutil.copy(os.path.join(etl_workspace.data_dir, "person.csv"), "file_input")
+
+    rows = etl_manager.transform_data_streaming(data_mappings, output_format="parquet")
+
+    output_file = etl_manager.output_file_name(data_mappings, "parquet")
+    assert output_file == ".//file_output//person_transformed.parquet"
+    assert rows == 50
+    assert os.listdir("file_output") == ["person_transformed.parquet"]
+
+
+def test_run_job_with_compressed_input_and_output(etl_workspace, monkeypatch):
+    etl_manager = etl_workspace.etl_manager
+    data_file = etl_workspace.store / "input" / "person.csv"
+    (etl_workspace.store / "input" / "person.csv.gz").write_bytes(
+        gzip.compress(data_file.read_bytes())
+    )
+    data_file.unlink()
+    etl_manager._blob_manager = BlobManager(
+        etl_workspace.blob_service, compression="zstd"
+    )
+    monkeypatch.setattr(etl_manager, "get_adls2_manager", Mock)
+
+    result = etl_manager.run_job("person.csv.gz", "person_map.json")
+
+    assert result["status"] == "success"
+    assert result["output_file"] == ".//file_output//person_transformed.csv"
+    # The input was transformed without decompressing it to disk
+    assert sorted(os.listdir("file_input")) == ["person.csv.gz", "person_map.json"]
+    uploaded = b"".join(
+        etl_manager._blob_manager.iter_blob_chunks(
+            "UseFakeBlobService", "output", "person_transformed.csv.zst"
+        )
+    )
+    assert uploaded == etl_workspace.expected.read_bytes()
+
+
+def test_failed_upload_is_not_cached(etl_workspace, monkeypatch):
+    etl_manager = etl_workspace.etl_manager
+    adls2_manager = ADLS2Manager(Mock())
+    adls2_manager.upload_stream = Mock(side_effect=RuntimeError("network down"))
+    monkeypatch.setattr(etl_manager, "get_adls2_manager", lambda: adls2_manager)
+
+    failed = etl_manager.run_job("person.csv", "person_map.json")
+    assert failed["status"] == "failed"
+    assert failed["error"] == "network down"
+
+    adls2_manager.upload_stream = Mock()
+    assert etl_manager.run_job("person.csv", "person_map.json")["status"] == "success"
+    assert etl_manager.run_job("person.csv", "person_map.json")["status"] == "cached"
 
+    # Other output settings do not reuse the cached result
+    monkeypatch.setattr("etl.src.etl_manager._TRANSFER_COMPRESSION", "gzip")
+    assert etl_manager.cached_result("person.csv", "person_map.json")[1] is None
\ No newline at end of file
@@ -0,0 +1,58 @@
+import os
+import time
+
+from etl.src.blob_manager import BlobManager
+from etl.src.manifest_cache import BlobManifestCache, ManifestCache
+from tests.unit.fake_blob_service import FakeBlobServiceClient
+
+
+def test_key_depends_on_every_part():
+    key = ManifestCache.key("person.csv", "md5:a")
+    assert key == ManifestCache.key("person.csv", "md5:a")
+    assert key != ManifestCache.key("person.csv", "md5:b")
+
+
+def test_get_and_put(tmp_path):
+    cache = ManifestCache(str(tmp_path))
+    assert cache.get("a") is None
+    cache.put("a", {"rows": 50})
+    assert cache.get("a") == {"rows": 50}
+    assert ManifestCache(str(tmp_path)).get("a") == {"rows": 50}
+
+
+def test_entries_expire(tmp_path, monkeypatch):
+    cache = ManifestCache(str(tmp_path), ttl_seconds=60)
+    cache.put("a", 1)
+    now = time.time()
+    monkeypatch.setattr("etl.src.manifest_cache.time.time", lambda: now + 61)
+    assert cache.get("a") is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = ManifestCache(str(tmp_path), max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    past = time.time() - 10
+    os.utime(str(tmp_path / "a.json"), (past, past))
+    os.utime(str(tmp_path / "b.json"), (past - 1, past - 1))
+    assert cache.get("b") == 2
+    cache.put("c", 3)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.get("c") == 3
+
+
+def test_blob_cache_is_shared_and_expires(tmp_path, monkeypatch):
+    blob_manager = BlobManager(FakeBlobServiceClient(str(tmp_path)))
+    cache = BlobManifestCache(blob_manager, "UseFakeBlobService", ttl_seconds=60)
+    assert cache.get("a") is None
+    cache.put("a", {"rows": 50})
+    assert (tmp_path / "manifest-cache" / "a.json").exists()
+    # Another machine with the same account sees the entry
+    other = BlobManager(FakeBlobServiceClient(str(tmp_path)))
+    assert BlobManifestCache(other, "UseFakeBlobService").get("a") == {"rows": 50}
+
+    now = time.time()
+    monkeypatch.setattr("etl.src.manifest_cache.time.time", lambda: now + 61)
+    assert cache.get("a") is None
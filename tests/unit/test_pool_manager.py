@@ -0,0 +1,128 @@
+import azure.batch.models as batchmodels
+import pytest
+
+from etl.src.azure_batch_manager import AzureBatchManager
+from etl.src.pool_manager import PoolManager
+from tests.unit.fake_batch_service import FakeBatchServiceClient
+
+
+@pytest.fixture()
+def pool_manager():
+    """Return a Pool Manager with 4 slots per node and recorded timings"""
+    return PoolManager(
+        task_slots_per_node=4,
+        max_dedicated_nodes=10,
+        max_low_priority_nodes=20,
+        low_priority_ratio=0.5,
+        target_seconds=600,
+        task_seconds=[60, 180],
+    )
+
+
+def test_target_nodes(pool_manager):
+    # 100 tasks of 2 minutes in 10 minutes on 4 slot nodes: 5 nodes
+    assert pool_manager.target_nodes(100) == (3, 2)
+    # A few tasks never get more nodes than they can fill
+    assert pool_manager.target_nodes(5) == (1, 0)
+    pool_manager._task_seconds = [3600]
+    assert pool_manager.target_nodes(5) == (1, 1)
+    assert pool_manager.target_nodes(0) == (0, 0)
+    # Capped at the configured maximum
+    assert pool_manager.target_nodes(10000) == (10, 20)
+
+
+def test_record_task_and_timings_file(pool_manager, tmp_path):
+    batch_client = FakeBatchServiceClient()
+    batch_client.job.add(type("Job", (), {"id": "job"}))
+    AzureBatchManager().add_tasks(batch_client, "job", "a.csv", "map.json", shards=2)
+    for task_id in batch_client.tasks["job"]:
+        batch_client.complete("job", task_id, seconds=480)
+        pool_manager.record_task(batch_client.tasks["job"][task_id])
+    assert pool_manager.mean_task_seconds() == 300
+
+    timings_file = str(tmp_path / "timings.json")
+    pool_manager.save_timings(timings_file)
+    assert PoolManager().load_timings(timings_file).mean_task_seconds() == 300
+    assert PoolManager().load_timings(str(tmp_path / "missing.json"))._task_seconds == []
+
+
+def test_autoscale_formula(pool_manager):
+    formula = pool_manager.autoscale_formula()
+    assert "$PendingTasks" in formula
+    assert "ceil($tasks * 120.0 / (600 * 4))" in formula
+    assert "$TargetDedicatedNodes = min(10, $nodes - $lowPriority);" in formula
+
+
+def test_size_new_and_warm_pool(pool_manager):
+    azure_batch_manager = AzureBatchManager()
+    batch_client = FakeBatchServiceClient()
+
+    azure_batch_manager.size_pool(batch_client, "pool", 100, pool_manager)
+    pool = batch_client.pools["pool"]
+    assert (pool.target_dedicated_nodes, pool.target_low_priority_nodes) == (3, 2)
+    assert batch_client.calls_to("pool.resize") == []
+
+    # Warm pool: resized to the new workload, left alone when already right
+    pool.allocation_state = pool.allocation_state.steady
+    azure_batch_manager.size_pool(batch_client, "pool", 20, pool_manager)
+    azure_batch_manager.size_pool(batch_client, "pool", 20, pool_manager)
+    assert batch_client.calls_to("pool.resize") == [("pool", 1, 0)]
+
+    # Scale down when idle
+    pool.allocation_state = pool.allocation_state.steady
+    assert pool_manager.apply(batch_client, "pool", 0) == (0, 0)
+
+    azure_batch_manager.size_pool(batch_client, "pool", 20, pool_manager, autoscale=True)
+    assert pool.enable_auto_scale
+    pool.allocation_state = pool.allocation_state.steady
+    # Switching back to explicit targets turns the formula off first
+    assert pool_manager.apply(batch_client, "pool", 20) == (1, 0)
+    assert batch_client.calls_to("pool.disable_auto_scale") == [("pool",)]
+
+
+def test_resize_waits_for_steady_pool(pool_manager, monkeypatch, capsys):
+    batch_client = FakeBatchServiceClient()
+    AzureBatchManager().size_pool(batch_client, "pool", 100, pool_manager)
+    pool = batch_client.pools["pool"]
+    pool.allocation_state = batchmodels.AllocationState.resizing
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 2:
+            pool.allocation_state = batchmodels.AllocationState.steady
+
+    monkeypatch.setattr("etl.src.pool_manager.time.sleep", sleep)
+    assert pool_manager.apply(batch_client, "pool", 20) == (1, 0)
+    assert sleeps == [15, 15]
+    assert batch_client.calls_to("pool.resize") == [("pool", 1, 0)]
+
+    # A pool that stays resizing is reported and left alone
+    monkeypatch.setattr("etl.src.pool_manager.time.sleep", lambda seconds: None)
+    assert pool_manager.apply(batch_client, "pool", 100) is None
+    assert "[WARNING] : Pool [pool] is still resizing" in capsys.readouterr().out
+    assert len(batch_client.calls_to("pool.resize")) == 1
+
+
+def test_scale_down_when_idle(pool_manager):
+    batch_client = FakeBatchServiceClient()
+    AzureBatchManager().size_pool(batch_client, "pool", 100, pool_manager)
+    assert pool_manager.scale_down_when_idle(batch_client, "pool", idle_minutes=10)
+    pool = batch_client.pools["pool"]
+    # The nodes are kept until the pool has been idle, not resized now
+    assert batch_client.calls_to("pool.resize") == []
+    assert (pool.target_dedicated_nodes, pool.target_low_priority_nodes) == (3, 2)
+    assert pool.enable_auto_scale
+    assert "GetSample(TimeInterval_Minute * 10)" in pool.auto_scale_formula
+    assert "$TargetDedicatedNodes = $busy > 0 ? 3 : 0;" in pool.auto_scale_formula
+
+
+def test_create_pool_with_autoscale(pool_manager):
+    batch_client = FakeBatchServiceClient()
+    AzureBatchManager().size_pool(
+        batch_client, "pool", 100, pool_manager, autoscale=True
+    )
+    pool = batch_client.pools["pool"]
+    assert pool.enable_auto_scale
+    assert pool.target_dedicated_nodes is None
+    assert pool.auto_scale_formula == pool_manager.autoscale_formula()
@@ -0,0 +1,219 @@
+import pytest
+
+from etl.src.checkpoint_manager import CheckpointManager
+from etl.src.data_mappings import ColumnMappings, DataMappings
+from etl.src.sqlite_db_manager import SqliteDBManager
+
+
+@pytest.fixture()
+def person_file(tmp_path):
+    """Return a small person csv"""
+    input_file = tmp_path / "person.csv"
+    rows = ["Id,DATE,BODYSITE_CODE,MODALITY_DESCRIPTION"]
+    for i in range(25):
+        rows.append("{},2018-01-01T07:36:11Z,{},Digital Radiography".format(i, i % 3))
+    input_file.write_text("\n".join(rows) + "\n")
+    return str(input_file)
+
+
+@pytest.mark.parametrize("use_executemany", [True, False])
+def test_bulk_insert_data(person_file, use_executemany):
+    db_manager = SqliteDBManager()
+    conn = db_manager.connect_to_db()
+    cursor = conn.cursor()
+    db_manager.create_table(cursor)
+    rows = db_manager.bulk_insert_data(
+        conn, cursor, person_file, batch_size=4, use_executemany=use_executemany
+    )
+    assert rows == 25
+    cursor.execute("SELECT COUNT(*) FROM persons WHERE bodysite_code = '1'")
+    assert cursor.fetchone()[0] == 8
+
+
+def test_bulk_insert_commits_every_n_batches(person_file):
+    class CountingConnection:
+        def __init__(self, conn):
+            self._conn = conn
+            self.commits = 0
+
+        def commit(self):
+            self.commits += 1
+            self._conn.commit()
+
+    db_manager = SqliteDBManager()
+    conn = db_manager.connect_to_db()
+    cursor = conn.cursor()
+    db_manager.create_table(cursor)
+    counting = CountingConnection(conn)
+    db_manager.bulk_insert_data(
+        counting, cursor, person_file, batch_size=5, commit_every=2
+    )
+    # 5 full batches: commits after batches 2 and 4, plus the final commit
+    assert counting.commits == 3
+
+
+@pytest.mark.parametrize("crash_at", [0, 3, 11, 24])
+def test_insert_data_resumes_from_checkpoint(person_file, tmp_path, crash_at):
+    db_manager = SqliteDBManager()
+    conn = db_manager.connect_to_db()
+    cursor = conn.cursor()
+    db_manager.create_table(cursor)
+    checkpoint = CheckpointManager(str(tmp_path / "state"))
+    read_insert_rows = db_manager.read_insert_rows
+
+    def crashing_rows(input_file):
+        for number, row in enumerate(read_insert_rows(input_file)):
+            if number == crash_at:
+                raise RuntimeError("node lost")
+            yield row
+
+    db_manager.read_insert_rows = crashing_rows
+    with pytest.raises(RuntimeError):
+        db_manager.bulk_insert_data(
+            conn, cursor, person_file, batch_size=2, commit_every=2, checkpoint=checkpoint
+        )
+    # The transaction in progress is lost with the node
+    conn.rollback()
+    committed = crash_at // 4 * 4
+    cursor.execute("SELECT COUNT(*) FROM persons")
+    assert cursor.fetchone()[0] == committed
+    if committed:
+        assert checkpoint.load()["rows_committed"] == committed
+
+    db_manager.read_insert_rows = read_insert_rows
+    rows = db_manager.insert_data(conn, cursor, person_file, checkpoint=checkpoint)
+    assert rows == 25
+    cursor.execute("SELECT bodysite_code, COUNT(*) FROM persons GROUP BY 1 ORDER BY 1")
+    assert cursor.fetchall() == [("0", 9), ("1", 8), ("2", 8)]
+    assert checkpoint.load() is None
+
+
+@pytest.fixture()
+def data_mappings():
+    data_mappings = DataMappings("person.csv", "person_transformed.csv")
+    for source, sink, physical_type in [
+        ("Id", "personId", "String"),
+        ("DATE", "personDOB", "datetime2"),
+        ("BODYSITE_CODE", "BodySiteCode", "Int64"),
+    ]:
+        data_mappings._column_mappings.append(
+            ColumnMappings(source, "", physical_type, sink, "", physical_type)
+        )
+    data_mappings._table_name = "person_transformed"
+    data_mappings._key_columns = ["personId"]
+    data_mappings.compile_plan()
+    return data_mappings
+
+
+def test_upsert_data_is_incremental(data_mappings, tmp_path):
+    def write(name, rows):
+        output_file = tmp_path / name
+        output_file.write_text(
+            "personId,personDOB,BodySiteCode\n"
+            + "".join("{},2018-01-01,{}\n".format(*row) for row in rows)
+        )
+        return str(output_file)
+
+    db_manager = SqliteDBManager(str(tmp_path / "etl.db"))
+    conn = db_manager.connect_to_db()
+    cursor = conn.cursor()
+    full_load = write("full.csv", [(i, i) for i in range(100)])
+    assert db_manager.upsert_data(conn, cursor, data_mappings, full_load) == 100
+
+    # A delta updates one row and adds one, the rest stay in place
+    delta = write("delta.csv", [(5, 500), (100, 100)])
+    assert db_manager.upsert_data(conn, cursor, data_mappings, delta) == 2
+    cursor.execute("SELECT COUNT(*) FROM person_transformed")
+    assert cursor.fetchone()[0] == 101
+    cursor.execute("SELECT BodySiteCode FROM person_transformed WHERE personId = '5'")
+    assert cursor.fetchone()[0] == 500
+
+    cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'person_transformed'")
+    ddl = cursor.fetchone()[0]
+    assert "BodySiteCode INTEGER" in ddl
+    assert "PRIMARY KEY (personId)" in ddl
+
+
+def test_indexes_built_after_load_and_query_rows(data_mappings, tmp_path):
+    data_mappings._indexes = [["BodySiteCode"]]
+    output_file = tmp_path / "full.csv"
+    output_file.write_text(
+        "personId,personDOB,BodySiteCode\n"
+        + "".join("{},2018-01-01,{}\n".format(i, i % 7) for i in range(50))
+    )
+    db_manager = SqliteDBManager()
+    conn = db_manager.connect_to_db()
+    cursor = conn.cursor()
+    db_manager.upsert_data(conn, cursor, data_mappings, str(output_file))
+
+    plan = list(
+        db_manager.query_rows(
+            cursor,
+            "EXPLAIN QUERY PLAN SELECT * FROM person_transformed WHERE BodySiteCode = ?",
+            (3,),
+        )
+    )
+    assert "ix_person_transformed_BodySiteCode" in plan[0][-1]
+
+    rows = db_manager.query_rows(
+        cursor,
+        "SELECT personId FROM person_transformed WHERE BodySiteCode = ?",
+        (3,),
+        fetch_size=2,
+    )
+    assert sorted(int(row[0]) for row in rows) == list(range(3, 50, 7))
+
+
+def write_transformed(path, rows):
+    path.write_text(
+        "personId,personDOB,BodySiteCode\n"
+        + "".join("{},2018-01-01,{}\n".format(*row) for row in rows)
+    )
+    return str(path)
+
+
+def test_parallel_upsert_data(data_mappings, tmp_path):
+    database = str(tmp_path / "etl.db")
+    db_manager = SqliteDBManager(database)
+    # Key 7 repeats in a later partition, the last row wins
+    rows = [(i, i) for i in range(200)] + [(7, 700)]
+    input_file = write_transformed(tmp_path / "full.csv", rows)
+    assert db_manager.parallel_upsert_data(data_mappings, input_file, partitions=4) == 201
+
+    conn = db_manager.connect_to_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM person_transformed")
+    assert cursor.fetchone()[0] == 200
+    cursor.execute("SELECT BodySiteCode FROM person_transformed WHERE personId = '7'")
+    assert cursor.fetchone()[0] == 700
+    cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE '%staging%'")
+    assert cursor.fetchall() == []
+
+
+def test_parallel_upsert_data_is_all_or_nothing(data_mappings, tmp_path, monkeypatch):
+    database = str(tmp_path / "etl.db")
+    db_manager = SqliteDBManager(database)
+    db_manager.parallel_upsert_data(
+        data_mappings, write_transformed(tmp_path / "full.csv", [(1, 1), (2, 2)])
+    )
+
+    bulk_insert_rows = SqliteDBManager.bulk_insert_rows
+    loads = []
+
+    def failing_bulk_insert_rows(self, conn, cursor, table_name, *args, **kwargs):
+        loads.append(table_name)
+        if len(loads) == 3:
+            raise RuntimeError("connection lost")
+        return bulk_insert_rows(self, conn, cursor, table_name, *args, **kwargs)
+
+    monkeypatch.setattr(SqliteDBManager, "bulk_insert_rows", failing_bulk_insert_rows)
+    delta = write_transformed(tmp_path / "delta.csv", [(i, 100) for i in range(100)])
+    with pytest.raises(RuntimeError):
+        db_manager.parallel_upsert_data(data_mappings, delta, partitions=4)
+
+    conn = db_manager.connect_to_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM person_transformed ORDER BY personId")
+    assert cursor.fetchall() == [("1", "2018-01-01", 1), ("2", "2018-01-01", 2)]
+    cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE '%staging%'")
+    assert cursor.fetchall() == []
@@ -0,0 +1,453 @@
+import gzip
+import os
+from decimal import Decimal
+
+import pandas
+import petl
+import pyarrow
+import pyarrow.parquet
+import pytest
+import zstandard
+
+from etl.src.blob_manager import BlobManager
+from etl.src.checkpoint_manager import BlobCheckpointManager, CheckpointManager
+from etl.src.data_mappings import ColumnMappings, ProjectionPlan
+from etl.src.transform_manager import TransformManager
+from tests.unit.fake_blob_service import FakeBlobServiceClient
+
+_SOURCE_COLUMNS = ["Id", "DATE", "BODYSITE_CODE", "MODALITY_DESCRIPTION"]
+_DESTINATION_COLUMNS = ["personId", "personDOB", "BodySiteCode", "ModalityDescription"]
+
+
+def petl_transform(source_file, destination_file):
+    """Reference output, as EtlManager.transform_data writes it"""
+    table = petl.cut(petl.fromcsv(source_file), *_SOURCE_COLUMNS)
+    for source, destination in zip(_SOURCE_COLUMNS, _DESTINATION_COLUMNS):
+        table = petl.rename(table, source, destination)
+    petl.tocsv(table, destination_file)
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 10000])
+def test_transform_file_matches_petl(tmp_path, chunk_rows):
+    expected = tmp_path / "expected.csv"
+    actual = tmp_path / "actual.csv"
+    petl_transform("./file_input/person.csv", str(expected))
+
+    progress = []
+    rows = TransformManager(chunk_rows=chunk_rows).transform_file(
+        "./file_input/person.csv",
+        str(actual),
+        ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS),
+        lambda rows, bytes_read: progress.append((rows, bytes_read)),
+    )
+    assert actual.read_bytes() == expected.read_bytes()
+    assert rows == 50
+    assert progress[-1] == (50, os.path.getsize("./file_input/person.csv"))
+    assert len(progress) == -(-50 // chunk_rows)
+
+
+@pytest.mark.parametrize(
+    "extension, compress",
+    [(".gz", gzip.compress), (".zst", zstandard.ZstdCompressor(level=3).compress)],
+)
+def test_transforms_read_compressed_sources(tmp_path, extension, compress):
+    plan = ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    column_mappings = [
+        ColumnMappings(s, "String", "String", d, "String", "String")
+        for s, d in zip(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    ]
+    with open("./file_input/person.csv", "rb") as f:
+        source = tmp_path / ("person.csv" + extension)
+        source.write_bytes(compress(f.read()))
+    expected = tmp_path / "expected.csv"
+    transform_manager = TransformManager(chunk_rows=7)
+    transform_manager.transform_file("./file_input/person.csv", str(expected), plan)
+
+    progress = []
+    rows = transform_manager.transform_file(
+        str(source),
+        str(tmp_path / "csv.csv"),
+        plan,
+        lambda rows, bytes_read: progress.append(bytes_read),
+        CheckpointManager(str(tmp_path / "state"), interval_seconds=0),
+    )
+    assert rows == 50
+    assert (tmp_path / "csv.csv").read_bytes() == expected.read_bytes()
+    assert progress[-1] == os.path.getsize("./file_input/person.csv")
+    assert not (tmp_path / "state").exists()
+
+    transform_manager.transform_file_pandas(
+        str(source), str(tmp_path / "pandas.csv"), column_mappings, plan
+    )
+    assert (tmp_path / "pandas.csv").read_bytes() == expected.read_bytes()
+    transform_manager.transform_file_parallel(
+        str(source), str(tmp_path / "parallel.csv"), plan, workers=4
+    )
+    assert (tmp_path / "parallel.csv").read_bytes() == expected.read_bytes()
+
+
+def test_chunks_bounded_by_bytes(tmp_path):
+    source = tmp_path / "wide.csv"
+    source.write_text("a,b\n" + ("x" * 100 + ",y\n") * 10)
+    progress = []
+    TransformManager(chunk_rows=1000, max_chunk_bytes=250).transform_file(
+        str(source),
+        str(tmp_path / "out.csv"),
+        ProjectionPlan(["b"], ["B"]),
+        lambda rows, bytes_read: progress.append(rows),
+    )
+    assert progress == [3, 6, 9, 10]
+
+
+class CrashingTransformManager(TransformManager):
+    """Fails part way through the crash_at'th source row, as a lost node would"""
+
+    def __init__(self, crash_at, **kwargs):
+        super().__init__(**kwargs)
+        self._crash_at = crash_at
+
+    def read_chunks(self, reader, lines):
+        def rows():
+            for number, row in enumerate(reader):
+                if number == self._crash_at:
+                    raise RuntimeError("node lost")
+                yield row
+
+        return super().read_chunks(rows(), lines)
+
+
+@pytest.mark.parametrize("crash_at", [0, 6, 13, 49])
+def test_transform_file_resumes_from_checkpoint(tmp_path, crash_at):
+    plan = ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    expected = tmp_path / "expected.csv"
+    TransformManager().transform_file("./file_input/person.csv", str(expected), plan)
+
+    actual = tmp_path / "actual.csv"
+    state_file = tmp_path / "actual.csv.checkpoint"
+    checkpoint = CheckpointManager(str(state_file), interval_seconds=0)
+    with pytest.raises(RuntimeError):
+        CrashingTransformManager(crash_at, chunk_rows=5).transform_file(
+            "./file_input/person.csv", str(actual), plan, checkpoint=checkpoint
+        )
+    if crash_at >= 5:
+        assert checkpoint.load()["rows"] == crash_at // 5 * 5
+    # A torn write after the last checkpoint
+    with open(str(actual), "ab") as f:
+        f.write(b"5118,2018-01")
+
+    progress = []
+    rows = TransformManager(chunk_rows=5).transform_file(
+        "./file_input/person.csv",
+        str(actual),
+        plan,
+        lambda rows, bytes_read: progress.append(rows),
+        CheckpointManager(str(state_file), interval_seconds=0),
+    )
+    assert rows == 50
+    assert actual.read_bytes() == expected.read_bytes()
+    assert progress[0] == crash_at // 5 * 5 + 5
+    assert not state_file.exists()
+
+
+@pytest.mark.parametrize("crash_at", [6, 13, 49])
+def test_transform_file_resumes_on_another_node(tmp_path, crash_at):
+    plan = ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    expected = tmp_path / "expected.csv"
+    TransformManager().transform_file("./file_input/person.csv", str(expected), plan)
+    store = tmp_path / "store"
+    store.mkdir()
+    blob_service = FakeBlobServiceClient(str(store))
+
+    def blob_checkpoint():
+        return BlobCheckpointManager(
+            BlobManager(blob_service),
+            "UseFakeBlobService",
+            "actual.csv.checkpoint",
+            interval_seconds=0,
+        )
+
+    actual = tmp_path / "actual.csv"
+    with pytest.raises(RuntimeError):
+        CrashingTransformManager(crash_at, chunk_rows=5).transform_file(
+            "./file_input/person.csv", str(actual), plan, checkpoint=blob_checkpoint()
+        )
+    # The local output is lost with the node
+    actual.unlink()
+
+    progress = []
+    rows = TransformManager(chunk_rows=5).transform_file(
+        "./file_input/person.csv",
+        str(actual),
+        plan,
+        lambda rows, bytes_read: progress.append(rows),
+        blob_checkpoint(),
+    )
+    assert rows == 50
+    assert actual.read_bytes() == expected.read_bytes()
+    assert progress[0] == crash_at // 5 * 5 + 5
+    assert os.listdir(str(store / "checkpoints")) == []
+
+
+def test_checkpoint_of_another_source_is_ignored(tmp_path):
+    plan = ProjectionPlan(["b"], ["B"])
+    source = tmp_path / "source.csv"
+    source.write_text("a,b\n1,x\n2,y\n3,z\n")
+    actual = tmp_path / "actual.csv"
+    state_file = str(tmp_path / "state")
+    with pytest.raises(RuntimeError):
+        CrashingTransformManager(2, chunk_rows=1).transform_file(
+            str(source), str(actual), plan, checkpoint=CheckpointManager(state_file, 0)
+        )
+    source.write_text("a,b\n4,u\n5,v\n6,w\n")
+    TransformManager(chunk_rows=1).transform_file(
+        str(source), str(actual), plan, checkpoint=CheckpointManager(state_file, 0)
+    )
+    assert actual.read_bytes() == b"B\r\nu\r\nv\r\nw\r\n"
+
+
+def test_projection_plan():
+    plan = ProjectionPlan(["c", "a"], ["C", "A"])
+    assert plan.source_indices(["a", "b", "c"]) == (2, 0)
+    assert list(plan.project(["a", "b", "c"], [["1", "2", "3"]])) == [("3", "1")]
+    single = ProjectionPlan(["b"], ["B"])
+    assert list(single.project(["a", "b"], [["1", "2"]])) == [("2",)]
+    # Short rows are padded, blank rows skipped
+    assert list(plan.project(["a", "b", "c"], [["1"], []])) == [("", "1")]
+
+
+def test_blank_and_short_rows(tmp_path):
+    source = tmp_path / "source.csv"
+    source.write_bytes(b"a,b,c\r\n1,2,3\r\n\r\n4\r\n5,6,7\r\n")
+    plan = ProjectionPlan(["c", "a"], ["C", "A"])
+    column_mappings = [
+        ColumnMappings(s, "String", "String", d, "String", "String")
+        for s, d in zip(["c", "a"], ["C", "A"])
+    ]
+    expected = b"C,A\r\n3,1\r\n,4\r\n7,5\r\n"
+    transform_manager = TransformManager(chunk_rows=2)
+
+    rows = transform_manager.transform_file(str(source), str(tmp_path / "csv.csv"), plan)
+    assert rows == 3
+    assert (tmp_path / "csv.csv").read_bytes() == expected
+    rows = transform_manager.transform_file_pandas(
+        str(source), str(tmp_path / "pandas.csv"), column_mappings, plan
+    )
+    assert rows == 3
+    assert (tmp_path / "pandas.csv").read_bytes() == expected
+    rows = transform_manager.transform_file_parallel(
+        str(source), str(tmp_path / "parallel.csv"), plan, 2
+    )
+    assert rows == 3
+    assert (tmp_path / "parallel.csv").read_bytes() == expected
+    stream = transform_manager.transform_stream([source.read_bytes()], plan)
+    assert b"".join(stream) == expected
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 10000])
+def test_pandas_backend_matches_csv_backend(tmp_path, chunk_rows):
+    plan = ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    column_mappings = [
+        ColumnMappings(s, "String", "String", d, "String", "String")
+        for s, d in zip(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    ]
+    transform_manager = TransformManager(chunk_rows=chunk_rows)
+    transform_manager.transform_file(
+        "./file_input/person.csv", str(tmp_path / "csv.csv"), plan
+    )
+    rows = transform_manager.transform_file_pandas(
+        "./file_input/person.csv", str(tmp_path / "pandas.csv"), column_mappings, plan
+    )
+    assert rows == 50
+    assert (tmp_path / "pandas.csv").read_bytes() == (
+        tmp_path / "csv.csv"
+    ).read_bytes()
+
+
+@pytest.mark.parametrize("row_group_rows", [7, 100])
+def test_transform_file_parquet(tmp_path, row_group_rows):
+    plan = ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    column_mappings = [
+        ColumnMappings("Id", "String", "String", "personId", "String", "String"),
+        ColumnMappings(
+            "DATE", "DateTime", "datetime2", "personDOB", "DateTime", "datetime2"
+        ),
+        ColumnMappings(
+            "BODYSITE_CODE", "Int64", "Int64", "BodySiteCode", "Int64", "Int64"
+        ),
+        ColumnMappings(
+            "MODALITY_DESCRIPTION",
+            "String",
+            "String",
+            "ModalityDescription",
+            "String",
+            "String",
+        ),
+    ]
+    output = tmp_path / "person_transformed.parquet"
+    rows = TransformManager().transform_file_parquet(
+        "./file_input/person.csv",
+        str(output),
+        column_mappings,
+        plan,
+        row_group_rows=row_group_rows,
+    )
+    assert rows == 50
+
+    parquet_file = pyarrow.parquet.ParquetFile(str(output))
+    assert parquet_file.metadata.num_rows == 50
+    assert parquet_file.metadata.num_row_groups == -(-50 // row_group_rows)
+    schema = parquet_file.schema_arrow
+    assert schema.names == _DESTINATION_COLUMNS
+    assert schema.field("personDOB").type == pyarrow.timestamp("us", tz="UTC")
+    assert schema.field("BodySiteCode").type == pyarrow.int64()
+
+    source = pandas.read_csv("./file_input/person.csv", dtype=str)
+    table = parquet_file.read()
+    assert table.column("personId").to_pylist() == source["Id"].tolist()
+    assert table.column("BodySiteCode").to_pylist() == [
+        int(code) for code in source["BODYSITE_CODE"]
+    ]
+    assert table.column("personDOB").to_pylist()[0] == pandas.Timestamp(
+        source["DATE"][0]
+    )
+
+
+def test_pandas_backend_validates_on_request(tmp_path, capsys):
+    source = tmp_path / "source.csv"
+    source.write_bytes(b"a,n\r\nx,1\r\ny,two\r\n")
+    plan = ProjectionPlan(["a", "n"], ["A", "N"])
+    column_mappings = [
+        ColumnMappings("a", "String", "String", "A", "String", "String"),
+        ColumnMappings("n", "Int32", "Int32", "N", "Int32", "Int32"),
+    ]
+    transform_manager = TransformManager()
+    transform_manager.transform_file_pandas(
+        str(source), str(tmp_path / "out.csv"), column_mappings, plan
+    )
+    assert "[WARNING]" not in capsys.readouterr().out
+    transform_manager.transform_file_pandas(
+        str(source), str(tmp_path / "out.csv"), column_mappings, plan, validate=True
+    )
+    assert "1 values in N are not Int32" in capsys.readouterr().out
+    assert (tmp_path / "out.csv").read_bytes() == b"A,N\r\nx,1\r\ny,two\r\n"
+
+
+def test_coerce_frame_types():
+    transform_manager = TransformManager()
+    frame = pandas.DataFrame(
+        {"when": ["2012-04-08T02:13:28Z", ""], "count": ["1", "x"]}, dtype=str
+    )
+    typed = transform_manager.coerce_frame(
+        frame,
+        [
+            ColumnMappings("a", "DateTime", "datetime2", "when", "DateTime", "datetime2"),
+            ColumnMappings("b", "Int32", "int", "count", "Int32", "int"),
+        ],
+    )
+    assert typed["when"][0] == pandas.Timestamp("2012-04-08T02:13:28Z")
+    assert pandas.isna(typed["when"][1])
+    assert typed["count"].dtype == "Int32"
+    assert pandas.isna(typed["count"][1])
+
+
+def test_decimal_columns_keep_their_digits(tmp_path):
+    source = tmp_path / "source.csv"
+    source.write_bytes(
+        b"amount,total\r\n"
+        b"12.345,12345678901234567.89\r\n"
+        b",0.1\r\n"
+        b"x,1e40\r\n"
+    )
+    plan = ProjectionPlan(["amount", "total"], ["Amount", "Total"])
+    column_mappings = [
+        ColumnMappings("amount", "", "", "Amount", "Decimal", "decimal", 10, 2),
+        ColumnMappings("total", "", "", "Total", "Decimal", "decimal"),
+    ]
+    output = tmp_path / "decimals.parquet"
+    TransformManager().transform_file_parquet(
+        str(source), str(output), column_mappings, plan
+    )
+
+    table = pyarrow.parquet.read_table(str(output))
+    assert table.schema.field("Amount").type == pyarrow.decimal128(10, 2)
+    assert table.schema.field("Total").type == pyarrow.decimal128(38, 18)
+    assert table.column("Amount").to_pylist() == [Decimal("12.35"), None, None]
+    # Beyond the 15 to 17 significant digits a float keeps
+    assert table.column("Total").to_pylist() == [
+        Decimal("12345678901234567.890000000000000000"),
+        Decimal("0.100000000000000000"),
+        None,
+    ]
+
+
+@pytest.mark.parametrize("workers", [2, 3, 8, 64])
+def test_transform_file_parallel_matches_serial(tmp_path, workers):
+    plan = ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    transform_manager = TransformManager()
+    transform_manager.transform_file(
+        "./file_input/person.csv", str(tmp_path / "serial.csv"), plan
+    )
+    rows = transform_manager.transform_file_parallel(
+        "./file_input/person.csv", str(tmp_path / "parallel.csv"), plan, workers
+    )
+    assert rows == 50
+    assert (tmp_path / "parallel.csv").read_bytes() == (
+        tmp_path / "serial.csv"
+    ).read_bytes()
+    assert sorted(os.listdir(tmp_path)) == ["parallel.csv", "serial.csv"]
+
+
+def test_split_ranges_cover_data_rows():
+    header, ranges = TransformManager().split_ranges("./file_input/person.csv", 4)
+    assert header.startswith(b"Id,DATE,")
+    assert ranges[0][0] == len(header)
+    assert ranges[-1][1] == os.path.getsize("./file_input/person.csv")
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1000, 1 << 20])
+def test_transform_stream_matches_transform_file(tmp_path, chunk_size):
+    plan = ProjectionPlan(_SOURCE_COLUMNS, _DESTINATION_COLUMNS)
+    transform_manager = TransformManager(chunk_rows=8)
+    transform_manager.transform_file(
+        "./file_input/person.csv", str(tmp_path / "file.csv"), plan
+    )
+    with open("./file_input/person.csv", "rb") as f:
+        data = f.read()
+    chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+    output = b"".join(transform_manager.transform_stream(chunks, plan))
+    assert output == (tmp_path / "file.csv").read_bytes()
+
+
+def test_fan_out_feeds_every_consumer():
+    transform_manager = TransformManager()
+    results = transform_manager.fan_out(
+        (str(i) for i in range(100)),
+        [lambda items: "".join(items), lambda items: sum(1 for _ in items)],
+        max_queued=2,
+    )
+    assert results == ["".join(str(i) for i in range(100)), 100]
+
+
+def test_fan_out_propagates_failures():
+    transform_manager = TransformManager()
+    seen = []
+
+    def failing(items):
+        for item in items:
+            if item == 5:
+                raise ValueError("sink failed")
+
+    def collecting(items):
+        for item in items:
+            seen.append(item)
+
+    with pytest.raises(ValueError):
+        transform_manager.fan_out(iter(range(100)), [failing, collecting], 2)
+
+    def broken_source():
+        yield 1
+        raise IOError("source failed")
+
+    with pytest.raises(IOError):
+        transform_manager.fan_out(broken_source(), [collecting], 2)